@@ -8,6 +8,9 @@ from collections import defaultdict
 from os.path import isfile, basename, join, isdir
 import pandas as pd
 
+import utils
+from variant_space import expand_variant_lines
+
 
 def parse_job_dir_name(job_dir):
     # assuming no surprise underscores in job dir name
@@ -34,9 +37,11 @@ def parse_env_vars(env_vars_fn):
     return env_vars
 
 
-def get_failed_variants(main_d):
+def get_failed_variants(main_d, pdb_dir="pdb_files/prepared_pdb_files", chain="A"):
     """ get failed variants only... don't care about which job they came from
-        want an accurate list of which variants failed """
+        want an accurate list of which variants failed.
+        pdb_dir has the PDB files, for the sequences (of the given chain, like energize.py --chain)
+        of args file lines that stand for a range of variant ranks """
 
     # get list of all variants we are SUPPOSED to have, based on the args files
     # need to untar the args files into a temporary directoy
@@ -56,7 +61,9 @@ def get_failed_variants(main_d):
     for fn in [join(temp_args_dir, x) for x in os.listdir(temp_args_dir) if x.endswith(".txt")]:
         with open(fn, "r") as f:
             expected_variants += f.read()
-    expected_variants = expected_variants.splitlines()
+    # args files may have lines that stand for a range of variant ranks, expand those into individual variants
+    expected_variants = list(expand_variant_lines(expected_variants.splitlines(),
+                                                  utils.chain_seq_getter(pdb_dir, chain)))
 
     # remove temp directory
     shutil.rmtree(temp_out_dir)
@@ -115,7 +122,9 @@ def check_for_failed_jobs(energize_out_d):
                 fv = []
                 if isfile(join(jd, "failed.txt")):
                     with open(join(jd, "failed.txt"), "r") as f:
-                        fv = f.read().splitlines()
+                        # newer jobs add the failure class after the variant
+                        # (failures.TRANSIENT, DETERMINISTIC, SYSTEMIC, or TIMEOUT), older jobs only have the variant
+                        fv = [" ".join(line.split()[:2]) for line in f.read().splitlines()]
                 failed_variants += fv
 
         # if this job had zero successful log dirs, it is a completely failed job
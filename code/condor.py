@@ -1,9 +1,13 @@
 """ prepare and package HTCondor runs """
-import itertools
+import heapq
+import io
+import json
 import math
 import time
 import os
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Optional
 
 import urllib3
@@ -13,12 +17,11 @@ import shutil
 import subprocess
 import urllib.parse
 import tarfile
-# todo: tqdm is only on the local environment, not on condor environment
-#  shouldn't be a problem since this file isn't run during a condor run...
-from tqdm import tqdm
 
-import utils
-from utils import save_argparse_args, get_seq_from_pdb
+from utils import save_argparse_args, expected_runtime
+from pdb_cache import PDBCache, hash_file
+from runtime_model import RuntimeModel, count_mutations, print_calibration
+from variant_space import is_range_line, num_line_variants, parse_range_line, split_range_line, split_variant_lines
 
 # todo: find a better way to handle reading PDBs with Rosetta's pose_energy_table at the end
 #   or remove the pose energy table from all the PDBs
@@ -37,98 +40,212 @@ def get_prepare_run_dir_name(run_name="unnamed"):
     return dir_name_str.format(time.strftime("%Y-%m-%d_%H-%M-%S"), run_name)
 
 
-def chunks(lst, n):
-    """https://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks"""
-    for i in range(0, len(lst), n):
-        yield lst[i:i + n]
-
-
-def expected_runtime(seq_len):
-    # estimate the total expected runtime for a variant with given seq len, in seconds
-    return (0.52 * seq_len) + 28.50
-
-
-def gen_args(master_variant_fn, variants_per_job, out_dir, keep_sep_files=False):
-    """generate arguments files from the master variant list"""
-
-    # load the master list of variants
-    pdbs_variants = []
+def lpt_schedule(item_times, num_jobs):
+    """ longest processing time first: assign items to num_jobs jobs, from the longest item to the shortest,
+        each to the job with the smallest total time so far. the jobs are kept in a heap keyed by total time,
+        so this is O(n log num_jobs). returns the item indices in each job """
+    jobs = [[] for _ in range(num_jobs)]
+    if num_jobs == 0:
+        return jobs
+
+    # (total time, job index), ties go to the lower job index
+    heap = [(0, i) for i in range(num_jobs)]
+    for item in sorted(range(len(item_times)), key=lambda i: item_times[i], reverse=True):
+        job_time, job = heapq.heappop(heap)
+        jobs[job].append(item)
+        heapq.heappush(heap, (job_time + item_times[item], job))
+    return jobs
+
+
+def print_schedule_stats(job_times, max_item_time):
+    """ print the balance of the expected job runtimes. the run takes as long as the slowest job (the makespan),
+        which can't be less than the mean job runtime or the longest single item """
+    if len(job_times) == 0:
+        print("no jobs")
+        return
+    mean_time = sum(job_times) / len(job_times)
+    lower_bound = max(mean_time, max_item_time)
+    print("min RT: {}".format(min(job_times)))
+    print("max RT: {}".format(max(job_times)))
+    print("mean RT: {}".format(mean_time))
+    print("imbalance (max RT / mean RT): {:.3f}".format(max(job_times) / mean_time if mean_time > 0 else 1))
+    print("makespan vs lower bound: {:.3f}".format(max(job_times) / lower_bound if lower_bound > 0 else 1))
+
+
+def read_variant_lines(master_variant_fn):
+    """ stream the lines of the master variant list files """
     for mv_fn in master_variant_fn:
         with open(mv_fn, "r") as f:
-            pdbs_variants += f.read().splitlines()
-
-    if variants_per_job == -1:
-
-        # compute the total expected runtime for all variants
-        # will be used to determine how many jobs there should be
-        total_expected_time = 0
-        seq_len_dict = {}
-        for pdb_v in pdbs_variants:
-            base_pdb_fn = pdb_v.split()[0]
-            pdb_fn = "pdb_files/prepared_pdb_files/{}".format(base_pdb_fn)
-
-            if base_pdb_fn not in seq_len_dict:
-                seq_len_dict[base_pdb_fn] = len(get_seq_from_pdb(pdb_fn))
-
-            total_expected_time += expected_runtime(seq_len_dict[base_pdb_fn])
-
-        print("average sequence length: {}".format(sum(seq_len_dict.values()) / len(seq_len_dict.values())))
-        print("total expected time: {}".format(total_expected_time))
-
-        time_per_job = 7 * 60 * 60  # each job should take 7 hours (7 * 60 * 60 seconds)
-        num_chunks = math.ceil(total_expected_time / time_per_job)
-        print("num chunks: {}".format(num_chunks))
-
-        # sort the PDBs and variants into descending order
-        sorted_pdbs_variants = sorted(pdbs_variants, key=lambda x: seq_len_dict[x.split()[0]], reverse=True)
-
-        # too slow
-        # # now greedily distribute the variants into num_chunks chunks so each has roughly the same runtime
-        # split_variant_lists = [[] for _ in range(num_chunks)]
-        # split_variant_times = [0] * num_chunks
-        #
-        # # simple greedy algorithm
-        # # add items one at a time to the group with the smallest total time
-        # for p_v in tqdm(sorted_pdbs_variants):
-        #     t = seq_len_dict[p_v.split()[0]]
-        #     i = split_variant_times.index(min(split_variant_times))
-        #
-        #     split_variant_lists[i].append(p_v)
-        #     split_variant_times[i] += t
-
-        # different idea: round robin (probably good enough)
-        split_variant_lists = [[] for _ in range(num_chunks)]
-        svl_cycle = itertools.cycle(split_variant_lists)
-        for p_v in tqdm(sorted_pdbs_variants):
-            next(svl_cycle).append(p_v)
-
-        # check runtimes of final splits
-        rts = []
-        for svl in split_variant_lists:
-            rt = sum([expected_runtime(seq_len_dict[x.split()[0]]) for x in svl])
-            rts.append(rt)
-        print("min RT: {}".format(min(rts)))
-        print("max RT: {}".format(max(rts)))
-
+            for line in f:
+                yield line.rstrip("\r\n")
+
+
+@contextmanager
+def open_tar_gz(out_fn):
+    """ open a .tar.gz file for writing members one at a time. compresses with pigz (parallel gzip) in a
+        separate process if it's installed, otherwise with gzip in this process """
+    pigz = shutil.which("pigz")
+    if pigz is None:
+        with tarfile.open(out_fn, "w:gz", compresslevel=6) as tar:
+            yield tar
+        return
+
+    with open(out_fn, "wb") as out_f:
+        proc = subprocess.Popen([pigz, "-c", "-6"], stdin=subprocess.PIPE, stdout=out_f)
+        try:
+            with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+                yield tar
+        finally:
+            proc.stdin.close()
+            proc.wait()
+    if proc.returncode != 0:
+        raise RuntimeError("pigz failed with return code {}".format(proc.returncode))
+
+
+def add_tar_member(tar, name, data, mode=0o644):
+    """ add a file with the given contents (bytes) to an open tarfile, or a directory if data is None """
+    info = tarfile.TarInfo(name)
+    info.mtime = int(time.time())
+    if data is None:
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        tar.addfile(info)
     else:
-        # split the master variant list into separate args files
-        split_variant_lists = list(chunks(pdbs_variants, variants_per_job))
-
-    args_dir = join(out_dir, "args")
-    os.makedirs(args_dir)
-    for job_num, svl in enumerate(split_variant_lists):
-        with open(join(args_dir, "{}.txt".format(job_num)), "w") as f:
-            for line in svl:
-                f.write("{}\n".format(line))
+        info.size = len(data)
+        info.mode = mode
+        tar.addfile(info, io.BytesIO(data))
+
+
+def gen_args(master_variant_fn, variants_per_job, out_dir, keep_sep_files=False, runtime_model=None,
+             pdb_dir="pdb_files/prepared_pdb_files", max_lpt_variants=5000000):
+    """generate arguments files from the master variant list.
+    lines of the master variant list that stand for a range of variant ranks (see variant_space.py) are split
+    into smaller ranges across jobs without being expanded into individual variants.
+    with variants_per_job == -1, jobs are sized by expected runtime, from the runtime_model if given
+    (see runtime_model.py), otherwise from utils.expected_runtime, using the sequence lengths of the PDB files
+    in pdb_dir (cached, see pdb_cache.py). up to max_lpt_variants variants are packed into jobs with
+    longest-processing-time-first scheduling (see lpt_schedule), which needs all of them in memory. beyond that,
+    the stream of variants is cut into consecutive jobs of about equal expected runtime instead.
+    each job's args file is written straight into args.tar.gz as soon as the job is complete, so outside of
+    LPT scheduling, only one job's variants are held in memory at a time"""
 
     # tar the argument files -- easier to transfer lots of arg files to/from condor servers
-    tar_command = utils.get_tar_command()   # tar or gtar depending on OS
-    tar_cmd = [tar_command, "-C", out_dir, "-czf", join(out_dir, "args.tar.gz"), "args"]
-    subprocess.call(tar_cmd)
+    # keep_sep_files also writes them to the args directory
+    args_dir = join(out_dir, "args")
+    if keep_sep_files:
+        os.makedirs(args_dir)
+
+    job_times = []
+
+    with open_tar_gz(join(out_dir, "args.tar.gz")) as tar:
+        add_tar_member(tar, "args", None)
+
+        def write_job(svl, job_time=None):
+            data = "".join("{}\n".format(line) for line in svl).encode()
+            job_fn = "{}.txt".format(len(job_times))
+            add_tar_member(tar, "args/{}".format(job_fn), data)
+            if keep_sep_files:
+                with open(join(args_dir, job_fn), "wb") as f:
+                    f.write(data)
+            job_times.append(job_time)
+
+        if variants_per_job == -1:
+            # compute the total expected runtime for all variants
+            # will be used to determine how many jobs there should be
+            total_expected_time = 0
+            range_expected_time = 0
+            max_variant_time = 0
+            num_variants = 0
+            seq_len_dict = {}
+            runtime_dict = {}
+            pdb_cache = PDBCache()
+
+            def variant_runtime(pdb_v):
+                # expected runtime of each variant in the line, which the runtime model predicts from the
+                # sequence length and the number of mutations (cached, there are only so many combinations)
+                seq_len = seq_len_dict[pdb_v.split()[0]]
+                if runtime_model is None:
+                    return expected_runtime(seq_len)
+                num_mutations = parse_range_line(pdb_v)["num_subs"] if is_range_line(pdb_v) \
+                    else count_mutations(pdb_v.split()[1])
+                if (seq_len, num_mutations) not in runtime_dict:
+                    runtime_dict[(seq_len, num_mutations)] = float(runtime_model.predict(seq_len, num_mutations))
+                return runtime_dict[(seq_len, num_mutations)]
+
+            for pdb_v in read_variant_lines(master_variant_fn):
+                base_pdb_fn = pdb_v.split()[0]
+                if base_pdb_fn not in seq_len_dict:
+                    seq_len_dict[base_pdb_fn] = pdb_cache.get_seq_len(join(pdb_dir, base_pdb_fn))
+
+                # range lines become their own jobs (below), so they don't count toward the shared jobs
+                if is_range_line(pdb_v):
+                    range_expected_time += variant_runtime(pdb_v) * num_line_variants(pdb_v)
+                else:
+                    total_expected_time += variant_runtime(pdb_v)
+                    max_variant_time = max(max_variant_time, variant_runtime(pdb_v))
+                    num_variants += 1
+
+            pdb_cache.save()
+            if len(seq_len_dict) > 0:
+                print("average sequence length: {}".format(sum(seq_len_dict.values()) / len(seq_len_dict)))
+            print("total expected time: {}".format(total_expected_time + range_expected_time))
+
+            time_per_job = 7 * 60 * 60  # each job should take 7 hours (7 * 60 * 60 seconds)
+            num_chunks = math.ceil(total_expected_time / time_per_job)
+
+            def write_range_jobs(pdb_v):
+                # range lines get split into ranges that fill whole jobs, and each of those ranges is its own job
+                variants_per_range = max(1, int(time_per_job // variant_runtime(pdb_v)))
+                for line in split_range_line(pdb_v, variants_per_range):
+                    write_job([line], variant_runtime(line) * num_line_variants(line))
+
+            if num_variants <= max_lpt_variants:
+                # greedily distribute the variants into num_chunks chunks so each has roughly the same runtime
+                pdbs_variants = []
+                range_lines = []
+                for pdb_v in read_variant_lines(master_variant_fn):
+                    (range_lines if is_range_line(pdb_v) else pdbs_variants).append(pdb_v)
+                variant_times = [variant_runtime(pdb_v) for pdb_v in pdbs_variants]
+                for job in lpt_schedule(variant_times, num_chunks):
+                    write_job([pdbs_variants[i] for i in job], sum(variant_times[i] for i in job))
+                for pdb_v in range_lines:
+                    write_range_jobs(pdb_v)
+
+            else:
+                # too many variants to hold in memory for LPT, so cut the stream of variants into num_chunks jobs
+                # where the cumulative expected runtime crosses each multiple of total_expected_time / num_chunks.
+                # every job's expected runtime is within one variant's runtime of the mean
+                print("more than {} variants, splitting the variant list in order instead of with LPT".format(
+                    max_lpt_variants))
+                svl = []
+                svl_time = 0
+                cum_time = 0
+                num_chunks_written = 0
+                for pdb_v in read_variant_lines(master_variant_fn):
+                    if is_range_line(pdb_v):
+                        write_range_jobs(pdb_v)
+                        continue
+
+                    svl.append(pdb_v)
+                    svl_time += variant_runtime(pdb_v)
+                    cum_time += variant_runtime(pdb_v)
+                    if num_chunks_written < num_chunks - 1 and \
+                            cum_time >= (num_chunks_written + 1) * total_expected_time / num_chunks:
+                        write_job(svl, svl_time)
+                        num_chunks_written += 1
+                        svl = []
+                        svl_time = 0
+                if len(svl) > 0:
+                    write_job(svl, svl_time)
+
+            print("num chunks: {}".format(len(job_times)))
+            # check runtimes of final splits
+            print_schedule_stats(job_times, max_variant_time)
 
-    # delete the separate args files
-    if not keep_sep_files:
-        shutil.rmtree(args_dir)
+        else:
+            # split the master variant list into separate args files
+            for svl in split_variant_lines(read_variant_lines(master_variant_fn), variants_per_job):
+                write_job(svl)
 
     # # create a file containing the list of separate variant lists files (for condor queue)
     # with open(join(out_dir, "variant_list_fns.txt"), "w") as f:
@@ -136,7 +253,7 @@ def gen_args(master_variant_fn, variants_per_job, out_dir, keep_sep_files=False)
     #         f.write("{}.txt\n".format(i))
 
     # return the number of args files (jobs)
-    return len(split_variant_lists)
+    return len(job_times)
 
 
 def fetch_repo(github_tag, github_token, out_dir):
@@ -242,7 +359,19 @@ def prep_energize(args):
 
     # generate arguments files from the master variant list. returns the number of jobs
     # also generates a file containing the filenames of the separate variant lists (for condor queue)
-    num_jobs = gen_args(args.master_variant_fn, args.variants_per_job, out_dir)
+    runtime_model = None
+    if args.runtime_model is not None:
+        runtime_model = RuntimeModel.load(args.runtime_model)
+        pipeline = "energize" if args.run_type == "energize" else "docking"
+        if runtime_model.pipeline != pipeline:
+            raise ValueError("runtime model {} is for the {} pipeline, but this is a {} run".format(
+                args.runtime_model, runtime_model.pipeline, pipeline))
+        # predict for the hyperparameters this run will use
+        runtime_model.set_hparams_from_args_file(args.energize_args_fn)
+        print_calibration(runtime_model)
+
+    num_jobs = gen_args(args.master_variant_fn, args.variants_per_job, out_dir, runtime_model=runtime_model,
+                        pdb_dir=args.pdb_dir, max_lpt_variants=args.max_lpt_variants)
 
     # create an env_vars.txt file to define environment variables for run.sh and energize.sub
     with open(join(out_dir, "env_vars.txt"), "w") as f:
@@ -389,45 +518,135 @@ def is_url(path):
         return False
 
 
-def zip_additional_data(data_fns):
+def list_data_files(data_fns):
+    """ the files in data_fns, with directories expanded into the files they contain, in a fixed order """
+    files = []
+    for fn in data_fns:
+        if os.path.isdir(fn):
+            for root, dirs, dir_files in os.walk(fn):
+                dirs.sort()
+                files += [join(root, f) for f in sorted(dir_files)]
+        else:
+            files.append(fn)
+    return files
+
+
+def hash_data_files(files, hash_cache_fn):
+    """ sha256 of the contents of each file, hashed in parallel threads (hashlib releases the GIL).
+        hashes are cached by path, size, and modification time in hash_cache_fn, so unchanged files
+        (e.g. large model checkpoints) aren't read again the next time a run is prepared """
+    cache = {}
+    if isfile(hash_cache_fn):
+        with open(hash_cache_fn, "r") as f:
+            cache = json.load(f)
+
+    stats = {fn: os.stat(fn) for fn in files}
+    hashes = {}
+    to_hash = []
+    for fn in files:
+        entry = cache.get(os.path.abspath(fn))
+        if entry is not None and entry["size"] == stats[fn].st_size and entry["mtime_ns"] == stats[fn].st_mtime_ns:
+            hashes[fn] = entry["hash"]
+        else:
+            to_hash.append(fn)
+
+    if len(to_hash) > 0:
+        print("Hashing {} additional data files...".format(len(to_hash)))
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for fn, file_hash in zip(to_hash, executor.map(hash_file, to_hash)):
+                hashes[fn] = file_hash
+                cache[os.path.abspath(fn)] = {"size": stats[fn].st_size,
+                                              "mtime_ns": stats[fn].st_mtime_ns,
+                                              "hash": file_hash}
+        tmp_cache_fn = "{}.tmp".format(hash_cache_fn)
+        with open(tmp_cache_fn, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_cache_fn, hash_cache_fn)
+
+    return hashes
+
+
+def split_file(fn, part_size):
+    """ split a file into parts of part_size bytes named fn.000, fn.001, ... (which sort in order, for run.sh
+        to put back together with cat), and remove the original file. returns the part filenames """
+    part_fns = []
+    with open(fn, "rb") as f:
+        while True:
+            part_fn = "{}.{:03d}".format(fn, len(part_fns))
+            with open(part_fn, "wb") as part_f:
+                # copy in blocks so a part is never held in memory
+                remaining = part_size
+                while remaining > 0:
+                    block = f.read(min(remaining, 1 << 24))
+                    if len(block) == 0:
+                        break
+                    part_f.write(block)
+                    remaining -= len(block)
+            if remaining == part_size:
+                # nothing left to read, this part is empty
+                os.remove(part_fn)
+                break
+            part_fns.append(part_fn)
+    os.remove(fn)
+    return part_fns
+
+
+def zip_additional_data(data_fns, zipped_data_dir=join("output", "zipped_data")):
     """ zips up model checkpoint (for transfer learning) or other additional data
-        for either squid or direct to submit node """
+        for either squid or direct to submit node.
+        the archive is named after a hash of the paths and contents of the files, so an archive is reused as
+        long as the files are unchanged, and changed files always get a new archive (never a stale one on squid).
+        archives over 1GB are split into parts that run.sh combines. returns the archive or part filenames """
 
     if not isinstance(data_fns, list):
         data_fns = [data_fns]
 
+    os.makedirs(zipped_data_dir, exist_ok=True)
+    files = list_data_files(data_fns)
+    hashes = hash_data_files(files, join(zipped_data_dir, "file_hashes.json"))
+
     # compute hash of the files, this will become the zip filename
     # prevents uploading the same file over and over to squid and
     # having to keep track of which files are already on squid
     hash_len = 6
-    # todo: this only hashes filenames, it would be more fool-proof to hash file contents
-    hash_object = hashlib.shake_256(",".join(data_fns).encode("utf-8"))
+    hash_object = hashlib.shake_256()
+    for fn in files:
+        hash_object.update("{}\0{}\n".format(fn, hashes[fn]).encode("utf-8"))
     fns_hash = hash_object.hexdigest(hash_len)
 
-    # create the output directory containing
-    out_dir = join("output", "zipped_data", fns_hash)
-    os.makedirs(out_dir, exist_ok=True)
+    # create the output directory containing the archive (or its parts) and a manifest of what's in it
+    # the manifest is written last, so an archive without one is incomplete
+    out_dir = join(zipped_data_dir, fns_hash)
+    manifest_fn = join(out_dir, "manifest.json")
+    if isfile(manifest_fn):
+        with open(manifest_fn, "r") as f:
+            manifest = json.load(f)
+        print("Zipped data with the same contents already exists: {}. Skipping...".format(out_dir))
+        return [join(out_dir, fn) for fn in manifest["archive_fns"]]
+
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
 
-    # check if zipped file already exists, if so just print a message and return
     out_fn = join(out_dir, "{}.tar.gz".format(fns_hash))
-    if isfile(out_fn):
-        print("Zipped data file already exists: {}. "
-              "Existing file should be correct unless source contents were changed. Skipping...".format(out_fn))
-    else:
-        cmd = ["tar", "-czf", out_fn] + data_fns
-        subprocess.call(cmd)
+    with open_tar_gz(out_fn) as tar:
+        for fn in files:
+            tar.add(fn, recursive=False)
 
-        # split files if needed (if the data file is bigger than 950mb)
-        size_limit_bytes = 1000000000
-        if os.path.getsize(out_fn) > size_limit_bytes:
-            raise NotImplementedError("The compressed additional data files are greater than 1GB. "
-                                      "That means the .tar.gz file is too big for SQUID, and it needs to be "
-                                      "split into multiple files. However, the pipeline for processing multiple "
-                                      "files is not implemented yet.")
-            # split_cmd = ["split", "-b", "900m", out_fn, out_fn + "."]
-            # subprocess.call(split_cmd)
+    # split files if needed (if the data file is bigger than 1GB, too big for SQUID)
+    size_limit_bytes = 1000000000
+    out_fns = [out_fn]
+    if os.path.getsize(out_fn) > size_limit_bytes:
+        out_fns = split_file(out_fn, 900000000)
+        print("Split zipped data into {} parts".format(len(out_fns)))
 
-    return out_fn
+    manifest = {"hash": fns_hash,
+                "files": [{"fn": fn, "sha256": hashes[fn]} for fn in files],
+                "archive_fns": [basename(fn) for fn in out_fns]}
+    with open(manifest_fn, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    return out_fns
 
 
 def prep_additional_data_files(
@@ -455,31 +674,32 @@ def prep_additional_data_files(
         else:
             local_files.append(fn)
 
-    # create a zip file w/ all the local additional data
-    additional_final_path = None
+    # create a zip file w/ all the local additional data (split into parts if it's too big)
+    additional_final_paths = []
     if len(local_files) > 0:
-        zipped_local_files_fn = zip_additional_data(local_files)
-
-        size_limit_bytes = 100000000
-        if os.path.getsize(zipped_local_files_fn) > size_limit_bytes:
-            # this file needs to be transferred to OSDF, too big for submit node
-            # additional data dir needs to be specified in this scenario
-            if additional_data_dir is None:
-                raise ValueError("The compressed additional data files are greater than 100MB. "
-                                 "The additional_data_dir must be specified to transfer these files to OSDF.")
-            additional_final_path = join(additional_data_dir, basename(zipped_local_files_fn))
-            print(f"ADDITIONAL DATA FILES NEED TO BE TRANSFERRED TO STORAGE SERVER. "
-                  f"Transfer to OSDF: {zipped_local_files_fn}. Expected final location: {additional_final_path}")
-        else:
-            # this file can be transferred from submit node, copy to run dir
-            print("Copying compressed additional data files to run directory")
-            shutil.copy(zipped_local_files_fn, run_dir)
-            additional_final_path = basename(zipped_local_files_fn)
+        for zipped_local_files_fn in zip_additional_data(local_files):
+
+            size_limit_bytes = 100000000
+            if os.path.getsize(zipped_local_files_fn) > size_limit_bytes:
+                # this file needs to be transferred to OSDF, too big for submit node
+                # additional data dir needs to be specified in this scenario
+                if additional_data_dir is None:
+                    raise ValueError("The compressed additional data files are greater than 100MB. "
+                                     "The additional_data_dir must be specified to transfer these files to OSDF.")
+                additional_final_path = join(additional_data_dir, basename(zipped_local_files_fn))
+                print(f"ADDITIONAL DATA FILES NEED TO BE TRANSFERRED TO STORAGE SERVER. "
+                      f"Transfer to OSDF: {zipped_local_files_fn}. Expected final location: {additional_final_path}")
+            else:
+                # this file can be transferred from submit node, copy to run dir
+                print("Copying compressed additional data files to run directory")
+                shutil.copy(zipped_local_files_fn, run_dir)
+                additional_final_path = basename(zipped_local_files_fn)
+            additional_final_paths.append(additional_final_path)
 
     # create the final list of additional files that should be filled in submit template
     # consists of remote files originally specified (unchanged), PLUS
     # additional local files that were zipped up and may need to be transferred to run dir or uploaded to squid
-    final_files = remote_files + [additional_final_path] if additional_final_path is not None else remote_files
+    final_files = remote_files + additional_final_paths
 
     return final_files
 
@@ -522,6 +742,24 @@ if __name__ == "__main__":
                         type=int,
                         help="the number of variants per job")
 
+    parser.add_argument("--pdb_dir",
+                        type=str,
+                        help="directory containing the PDB files in the master variant list, for their sequence "
+                             "lengths when variants_per_job is -1",
+                        default="pdb_files/prepared_pdb_files")
+
+    parser.add_argument("--max_lpt_variants",
+                        type=int,
+                        help="when variants_per_job is -1, pack up to this many variants into jobs longest first, "
+                             "which holds them all in memory. larger variant lists are split in order",
+                        default=5000000)
+
+    parser.add_argument("--runtime_model",
+                        type=str,
+                        help="runtime model (see runtime_model.py) to predict variant runtimes when "
+                             "variants_per_job is -1. if not given, uses a fixed fit on sequence length",
+                        default=None)
+
     parser.add_argument("--osdf_python_distribution",
                         type=str,
                         help="text file containing the OSDF paths to Python distribution files",
@@ -9,7 +9,10 @@ import pandas as pd
 from pandas.io.sql import SQLiteDatabase, SQLiteTable
 from tqdm import tqdm
 
+import db_fingerprint
 import utils
+import variant_index
+from pdb_cache import PDBCache
 from utils import sort_variant_mutations
 
 # import warnings
@@ -54,6 +57,25 @@ def df_to_sqlite(df: pd.DataFrame, db_file_name: str, table_name: str, chunk_siz
                 con.execute("commit")
 
 
+def add_resource_usage_columns(db_fn, table_name, df):
+    """ add any per-step resource usage columns (e.g. relax_max_rss) in df that are missing from the table.
+        databases created before these columns existed get them added, with NULL for the existing records """
+    resource_usage_suffixes = ("_cpu_user", "_cpu_sys", "_max_rss", "_io_in", "_io_out")
+
+    con = sqlite3.connect(db_fn)
+    table_cols = [row[1] for row in con.execute("PRAGMA table_info(`{}`)".format(table_name))]
+
+    # if the table doesn't exist yet, it will be created with all the columns from the dataframe
+    if len(table_cols) > 0:
+        for col in df.columns:
+            if col.endswith(resource_usage_suffixes) and col not in table_cols:
+                col_type = "REAL" if col.endswith(("_cpu_user", "_cpu_sys")) else "INTEGER"
+                con.execute("ALTER TABLE `{}` ADD COLUMN `{}` {}".format(table_name, col, col_type))
+        con.commit()
+
+    con.close()
+
+
 def add_energies(db_fn, energies_df):
     """ add new variant records into database """
 
@@ -65,12 +87,25 @@ def add_energies(db_fn, energies_df):
     # also, just in case metl-sim generates variants in the wrong order, this is the backup
     energies_db_ready["mutations"] = sort_variant_mutations(energies_db_ready["mutations"].tolist())
 
+    add_resource_usage_columns(db_fn, "variant", energies_db_ready)
+
+    # catch up on any changes made outside of database.py before the insert, so the update afterwards
+    # only needs to hash in the new rows (see db_fingerprint.py)
+    db_fingerprint.update_fingerprint(db_fn)
+
     try:
         df_to_sqlite(energies_db_ready, db_fn, "variant")
     except sqlite3.IntegrityError as e:
         print("Encountered sqlite3.IntegrityError, data already exists in database?")
         print(e)
 
+    # bring any existing variant indices (see variant_index.py) up to date with the new variants
+    for pdb_fn in energies_db_ready["pdb_fn"].unique():
+        if variant_index.index_exists(db_fn, pdb_fn):
+            variant_index.update_index(db_fn, pdb_fn)
+
+    db_fingerprint.update_fingerprint(db_fn, verify=False)
+
 
 def add_meta(db_fn, hparams_df, jobs_df):
     """ add job and hyperparameter metadata to database """
@@ -91,11 +126,15 @@ def add_meta(db_fn, hparams_df, jobs_df):
 
     con.close()
 
+    # no new variants, but the database file changed, so refresh the fingerprint's file stamp
+    db_fingerprint.update_fingerprint(db_fn, verify=False)
 
-def add_pdb(db_fn, pdb_fn):
-    """ add PDB file to database """
 
-    seq = utils.get_seq_from_pdb(pdb_fn)
+def add_pdb(db_fn, pdb_fn, pdb_cache=None):
+    """ add PDB file to database. the sequence is looked up in pdb_cache (see pdb_cache.py), if given,
+        which the caller is responsible for saving """
+
+    seq = pdb_cache.get_seq(pdb_fn) if pdb_cache is not None else utils.get_seq_from_pdb(pdb_fn)
 
     # todo: check if pdb file already exists in database and if so don't add it
     #  or handle the exception that occurs when you try to add it anyway (sqlite3.IntegrityError)
@@ -107,6 +146,8 @@ def add_pdb(db_fn, pdb_fn):
     cur.close()
     con.close()
 
+    db_fingerprint.update_fingerprint(db_fn, verify=False)
+
 
 def get_ct_fn(mode):
     if mode == "create":
@@ -129,29 +170,38 @@ def main(args):
             create_tables(con, ct_fn=get_ct_fn(args.mode))
             con.commit()
             con.close()
+            db_fingerprint.update_fingerprint(args.db_fn)
 
     elif args.mode == "add_pdbs":
         pdb_dir = "pdb_files/prepared_pdb_files"
         pdb_fns = [join(pdb_dir, x) for x in os.listdir(pdb_dir) if x.endswith(".pdb")]
+        pdb_cache = PDBCache()
         for pdb_fn in pdb_fns:
-            add_pdb(args.db_fn, pdb_fn)
+            add_pdb(args.db_fn, pdb_fn, pdb_cache)
+        pdb_cache.save()
 
     elif args.mode == "pdb_index":
         # create a PDB file index, similar to the database table from "add_pdbs" above
         # todo: better file for this code? it's similar to add_pdbs so keeping it here for now
         pdb_dir = "pdb_files/prepared_pdb_files"
         pdb_fns = [join(pdb_dir, x) for x in os.listdir(pdb_dir) if x.endswith(".pdb")]
+        pdb_cache = PDBCache()
         with open(join(pdb_dir, "index.csv"), "w") as f:
             f.write("pdb_fn,aa_sequence,seq_len\n")
             for pdb_fn in pdb_fns:
                 print("Processing {}".format(pdb_fn))
                 # seq = utils.get_seq_from_pdb(pdb_fn)
-                seq = utils.extract_seq_from_pdb(pdb_fn, error_on_multiple_chains=False)
+                seq = pdb_cache.extract_seq(pdb_fn, error_on_multiple_chains=False)
                 # check if seq has multiple chains
                 if isinstance(seq, dict):
                     print("Multiple chains found in {}, skipping".format(pdb_fn))
                     continue
                 f.write("{},{},{}\n".format(basename(pdb_fn), seq, len(seq)))
+        pdb_cache.save()
+
+    elif args.mode == "fingerprint":
+        # recompute the database fingerprint from scratch
+        print("Database fingerprint: {}".format(db_fingerprint.rebuild_fingerprint(args.db_fn)))
 
 
 if __name__ == "__main__":
@@ -163,7 +213,7 @@ if __name__ == "__main__":
     parser.add_argument("mode",
                         help="run mode",
                         type=str,
-                        choices=["create", "create_docking", "add_pdbs", "pdb_index"])
+                        choices=["create", "create_docking", "add_pdbs", "pdb_index", "fingerprint"])
 
     parser.add_argument("--db_fn",
                         help="path to database file",
@@ -0,0 +1,154 @@
+""" cheap fingerprint of the variants in a database, used in place of a hash of the whole database file
+    to tag variant lists generated against the database (see variants.py).
+    the fingerprint is a function of the number of variant rows from each job uuid, kept as an order-independent
+    sum of per-job hashes, so it can be updated from just the rows added since the last update, and it comes out
+    the same whether it was updated incrementally or rebuilt from scratch.
+    the fingerprint state is cached next to the database in "<db_fn>.fingerprint.json", stamped with the size and
+    modification time of the database file, and every update is appended to the "<db_fn>.ingest_log.jsonl" log.
+    updates hold a lock on "<db_fn>.fingerprint.lock", so processes sharing a database (e.g. variants.py with
+    --workers) wait for each other instead of racing on the state and log files """
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+from os.path import isfile
+import sqlite3
+import time
+
+FINGERPRINT_VERSION = 1
+
+HASH_MOD = 2 ** 64
+
+
+def get_fingerprint_fns(db_fn):
+    """ the fingerprint state (.fingerprint.json) and ingest log (.ingest_log.jsonl) filenames """
+    return "{}.fingerprint.json".format(db_fn), "{}.ingest_log.jsonl".format(db_fn)
+
+
+@contextmanager
+def file_lock(lock_fn):
+    """ exclusive lock on lock_fn (created if needed) for the duration of the context, blocking until it's free.
+        flock locks on separate opens of the same file conflict even within a process, so don't nest them """
+    with open(lock_fn, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def file_stamp(db_fn):
+    """ size and modification time of the database file and its write-ahead log, if any.
+        sqlite's data_version is only meaningful within a single connection, so it can't be stored """
+    stamp = {}
+    for fn in [db_fn, "{}-wal".format(db_fn)]:
+        if isfile(fn):
+            st = os.stat(fn)
+            stamp[fn] = [st.st_size, st.st_mtime_ns]
+    return stamp
+
+
+def job_hash(job_uuid, num_rows):
+    return int.from_bytes(hashlib.shake_128("{}:{}".format(job_uuid, num_rows).encode()).digest(8), "little")
+
+
+def format_fingerprint(hash_sum, num_rows):
+    return hashlib.shake_128("{}:{}:{}".format(FINGERPRINT_VERSION, hash_sum, num_rows).encode()).hexdigest(4)
+
+
+def save_state(state_fn, state):
+    tmp_state_fn = "{}.{}.tmp".format(state_fn, os.getpid())
+    with open(tmp_state_fn, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_state_fn, state_fn)
+
+
+def update_fingerprint(db_fn, verify=True):
+    """ bring the fingerprint up to date with the database and return it.
+        if the database file changed since the last update, the rows added since then (by rowid) are hashed in.
+        verify also checks that no rows the fingerprint already covers were deleted, by counting the rows
+        in the variant table, and rebuilds the fingerprint if any were. callers that know they only
+        inserted rows (e.g. database.add_energies) can skip it """
+    with file_lock("{}.fingerprint.lock".format(db_fn)):
+        return update_fingerprint_state(db_fn, verify)
+
+
+def update_fingerprint_state(db_fn, verify):
+    """ update_fingerprint, for callers holding the fingerprint lock """
+    state_fn, log_fn = get_fingerprint_fns(db_fn)
+
+    state = None
+    if isfile(state_fn):
+        with open(state_fn, "r") as f:
+            state = json.load(f)
+        if state["version"] != FINGERPRINT_VERSION:
+            state = None
+
+    stamp = file_stamp(db_fn)
+    if state is not None and state["stamp"] == stamp:
+        return state["fingerprint"]
+
+    con = sqlite3.connect("file:{}?mode=ro".format(db_fn), uri=True)
+
+    if state is not None and verify:
+        # the rows covered by the fingerprint are the rows at or below its max rowid. counting the whole table
+        # can use the smallest index, while counting rows above the max rowid is a cheap range on the rowid
+        num_rows = con.execute("SELECT COUNT(*) FROM variant").fetchone()[0]
+        num_new_rows = con.execute("SELECT COUNT(*) FROM variant WHERE rowid > ?", (state["max_rowid"],)).fetchone()[0]
+        if num_rows - num_new_rows != state["num_rows"]:
+            print("Variant rows were deleted from the database since its fingerprint was computed, rebuilding")
+            state = None
+
+    rebuild = state is None
+    if rebuild:
+        state = {"version": FINGERPRINT_VERSION, "max_rowid": 0, "num_rows": 0, "hash_sum": 0}
+
+    # number of new rows and max rowid of each job among the rows added since the last update
+    new_jobs = con.execute("SELECT job_uuid, COUNT(*), MAX(rowid) FROM variant WHERE rowid > ? GROUP BY job_uuid",
+                           (state["max_rowid"],)).fetchall()
+
+    hash_sum = state["hash_sum"]
+    for job_uuid, num_new_rows, _ in new_jobs:
+        # a job can have rows from earlier updates (e.g. an ingest that was interrupted),
+        # in which case its hash for the old row count is swapped out for the hash for the new total
+        num_old_rows = 0
+        if not rebuild:
+            num_old_rows = con.execute("SELECT COUNT(*) FROM variant WHERE job_uuid = ? AND rowid <= ?",
+                                       (job_uuid, state["max_rowid"])).fetchone()[0]
+        if num_old_rows > 0:
+            hash_sum -= job_hash(job_uuid, num_old_rows)
+        hash_sum = (hash_sum + job_hash(job_uuid, num_old_rows + num_new_rows)) % HASH_MOD
+    con.close()
+
+    num_new_rows = sum(job[1] for job in new_jobs)
+    ingest = {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "rebuild": rebuild,
+              "min_rowid": state["max_rowid"] + 1,
+              "max_rowid": max([state["max_rowid"]] + [job[2] for job in new_jobs]),
+              "num_rows": num_new_rows,
+              "jobs": {job[0]: job[1] for job in new_jobs}}
+
+    state["max_rowid"] = ingest["max_rowid"]
+    state["num_rows"] += num_new_rows
+    state["hash_sum"] = hash_sum
+    state["fingerprint"] = format_fingerprint(hash_sum, state["num_rows"])
+    state["stamp"] = stamp
+
+    # a rebuild starts a new log, otherwise only log updates that actually added rows
+    if rebuild or num_new_rows > 0:
+        with open(log_fn, "w" if rebuild else "a") as f:
+            f.write("{}\n".format(json.dumps(ingest)))
+    save_state(state_fn, state)
+
+    return state["fingerprint"]
+
+
+def rebuild_fingerprint(db_fn):
+    """ recompute the fingerprint from scratch, e.g. after rows were modified outside of database.py
+        in a way the row counts can't detect """
+    state_fn, _ = get_fingerprint_fns(db_fn)
+    with file_lock("{}.fingerprint.lock".format(db_fn)):
+        if isfile(state_fn):
+            os.remove(state_fn)
+        return update_fingerprint_state(db_fn, verify=True)
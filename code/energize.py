@@ -5,27 +5,150 @@ import subprocess
 import shutil
 import os
 import sys
-from os.path import isdir, join, basename, abspath
+from os.path import isdir, isfile, join, basename, abspath
 import uuid
 import socket
 import csv
+import itertools
 import platform
+import re
+import signal
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Optional
 
 import shortuuid
 import numpy as np
 import pandas as pd
 
-from templates import fill_templates
+import analysis
+from templates import fill_templates, get_template_cache, link_file
+from journal import VariantJournal
+from results_writer import ResultsWriter
+from score_file import ScoreFileError, parse_score_file
+from utils import chain_seq_getter, expected_runtime, extract_seq_from_pdb
+from variant_space import expand_variant_lines
+import failures
 import time
 
 
+# exit code that tells HTCondor the job saved a checkpoint and should be restarted (checkpoint_exit_code in energize.sub)
+CHECKPOINT_EXIT_CODE = 85
+
+
 class RosettaError(Exception):
     # a simple custom error for when Rosetta gives a bad return code
+    def __init__(self, message, return_code=None):
+        super().__init__(message)
+        self.return_code = return_code
+
+
+class RosettaTimeoutError(RosettaError):
+    # rosetta was killed because a step ran longer than its timeout (a hung process or pathological variant)
     pass
 
 
+# resource usage recorded for each rosetta step, see get_resource_usage()
+RESOURCE_USAGE_FIELDS = ["cpu_user", "cpu_sys", "max_rss", "io_in", "io_out"]
+
+
+def get_resource_usage(rusage=None):
+    """ the resource usage of a finished rosetta process: user and system cpu time (seconds),
+        peak resident memory (kilobytes), and block input and output operations.
+        with no rusage (the step didn't run), all usage is 0 """
+    if rusage is None:
+        return {field: 0 for field in RESOURCE_USAGE_FIELDS}
+
+    # ru_maxrss is in kilobytes on linux but in bytes on macOS
+    max_rss = rusage.ru_maxrss // 1024 if platform.system() == "Darwin" else rusage.ru_maxrss
+    return {"cpu_user": rusage.ru_utime,
+            "cpu_sys": rusage.ru_stime,
+            "max_rss": max_rss,
+            "io_in": rusage.ru_inblock,
+            "io_out": rusage.ru_oublock}
+
+
+def kill_process_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        # the process group already exited
+        pass
+
+
+def run_rosetta_cmd(cmd, working_dir, out_fn, timeout=None):
+    """ run a rosetta command in the working directory with stdout and stderr going to out_fn.
+        if the command runs longer than timeout seconds, its whole process group is killed and
+        RosettaTimeoutError is raised. returns the return code and resource usage of the rosetta process """
+    with open(out_fn, "w") as f:
+        # rosetta gets its own process group (session) so it can be killed along with anything it started
+        proc = subprocess.Popen(cmd, cwd=working_dir, stdout=f, stderr=f, start_new_session=True)
+        timed_out = threading.Event()
+        watchdog = None
+        if timeout is not None:
+            def on_timeout():
+                timed_out.set()
+                kill_process_group(proc)
+            watchdog = threading.Timer(timeout, on_timeout)
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            # wait4 reaps this specific process and returns its own rusage
+            # (resource.getrusage(RUSAGE_CHILDREN) would accumulate over all steps and worker processes)
+            _, status, rusage = os.wait4(proc.pid, 0)
+        except BaseException:
+            kill_process_group(proc)
+            proc.wait()
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    # if the process exited on its own right as the watchdog fired, keep its result
+    if timed_out.is_set() and proc.returncode == -signal.SIGKILL:
+        raise RosettaTimeoutError("Rosetta command timed out after {:.0f} seconds: {}".format(timeout,
+                                                                                          basename(cmd[0])))
+
+    return proc.returncode, get_resource_usage(rusage)
+
+
+def get_step_timeout(seq_len, timeout_factor, min_step_timeout):
+    """ the timeout for each rosetta step of a variant, as a multiple of the expected runtime of the whole
+        variant for the sequence length (see utils.expected_runtime), but no less than min_step_timeout.
+        returns None (no timeout) if timeout_factor is 0 """
+    if timeout_factor <= 0:
+        return None
+    return max(min_step_timeout, timeout_factor * expected_runtime(seq_len))
+
+
+def get_pdb_step_timeout(pdb_fn, chain, timeout_factor, min_step_timeout):
+    """ get_step_timeout for the sequence length of the given chain of pdb_fn (which can have other chains).
+        falls back to min_step_timeout if the sequence can't be read from the pdb file """
+    if timeout_factor <= 0:
+        return None
+    try:
+        seq_len = len(extract_seq_from_pdb(pdb_fn, chain_id=chain))
+    except ValueError as e:
+        print("Unable to get the sequence length of chain {} of {}, using the minimum step timeout: {}".format(
+            chain, basename(pdb_fn), e), flush=True)
+        return min_step_timeout
+    return get_step_timeout(seq_len, timeout_factor, min_step_timeout)
+
+
+def resource_usage_columns(run_usage, steps):
+    """ flatten the per-step resource usage into energies record columns, e.g. relax_max_rss """
+    columns = {}
+    for step in steps:
+        for field in RESOURCE_USAGE_FIELDS:
+            value = run_usage[step][field]
+            columns["{}_{}".format(step, field)] = round(value, 2) if isinstance(value, float) else int(value)
+    return columns
+
+
 def prep_working_dir(template_dir, working_dir, pdb_fn, chain, variant,
-                     relax_distance, relax_repeats, overwrite_wd=False):
+                     relax_distance, relax_repeats, overwrite_wd=False, fused=False):
     """ prep the working directory by copying over files from the template directory, modifying as needed """
     # delete the current working directory if one exists
     if overwrite_wd:
@@ -43,36 +166,40 @@ def prep_working_dir(template_dir, working_dir, pdb_fn, chain, variant,
               flush=True)
         raise
 
-    # copy over PDB file into rosetta working dir and rename it to structure.pdb
-    shutil.copyfile(pdb_fn, join(working_dir, "structure.pdb"))
+    # link the PDB file into rosetta working dir as structure.pdb (rosetta writes its outputs to new files)
+    link_file(pdb_fn, join(working_dir, "structure.pdb"))
 
     # fill the template rosetta arguments (Rosetta scripts XML files and resfile) for this variant
     # note that if the variant is the wild-type (no mutations), then there is no need to fill these in (wont be used)
     if variant != "_wt":
-        fill_templates(template_dir, chain, variant, relax_distance, relax_repeats, working_dir)
+        fill_templates(template_dir, chain, variant, relax_distance, relax_repeats, working_dir, fused)
 
-    # copy over files from the template dir that don't need to be changed
+    # link files from the template dir that don't need to be changed
     files_to_copy = ["flags_mutate", "flags_relax", "flags_relax_all", "flags_filter", "flags_centroid",
                      "filter_3rd.xml", "total_hydrophobic_weights_version1.wts",
                      "total_hydrophobic_weights_version2.wts"]
+    if fused:
+        files_to_copy.append("flags_fused")
 
+    template_cache = get_template_cache(template_dir)
     for fn in files_to_copy:
-        shutil.copy(join(template_dir, fn), working_dir)
+        template_cache.link(fn, working_dir)
 
 
-def run_mutate_step(relax_bin_fn, database_path, mutate_default_max_cycles, working_dir):
+def run_mutate_step(relax_bin_fn, database_path, mutate_default_max_cycles, working_dir, timeout=None):
     # todo: should this use the relax binary or rosetta_scripts binary? both seem to work the same
     mutate_cmd = [relax_bin_fn, '-database', database_path,
                   '-default_max_cycles', str(mutate_default_max_cycles), '@flags_mutate']
     mutate_out_fn = join(working_dir, "mutate.out")
-    # to completely void output, can direct it to subprocess.DEVNULL instead of f
-    with open(mutate_out_fn, "w") as f:
-        return_code = subprocess.call(mutate_cmd, cwd=working_dir, stdout=f, stderr=f)
+    return_code, usage = run_rosetta_cmd(mutate_cmd, working_dir, mutate_out_fn, timeout)
     if return_code != 0:
-        raise RosettaError("Mutate step did not execute successfully. Return code: {}".format(return_code))
+        raise RosettaError("Mutate step did not execute successfully. Return code: {}".format(return_code),
+                           return_code)
+    return usage
 
 
-def run_relax_step(relax_bin_fn, database_path, relax_nstruct, relax_repeats, working_dir, variant_has_mutations=True):
+def run_relax_step(relax_bin_fn, database_path, relax_nstruct, relax_repeats, working_dir, variant_has_mutations=True,
+                   timeout=None):
     # todo: should this use the relax binary or rosetta_scripts binary? both seem to work the same
     if variant_has_mutations:
         # this is the main way to run relax for variants, where the rosettascript protocol specified in @flags_relax
@@ -85,28 +212,42 @@ def run_relax_step(relax_bin_fn, database_path, relax_nstruct, relax_repeats, wo
                      '-relax:default_repeats', str(relax_repeats), '@flags_relax_all']
 
     relax_out_fn = join(working_dir, "relax.out")
-    with open(relax_out_fn, "w") as f:
-        return_code = subprocess.call(relax_cmd, cwd=working_dir, stdout=f, stderr=f)
+    return_code, usage = run_rosetta_cmd(relax_cmd, working_dir, relax_out_fn, timeout)
     if return_code != 0:
-        raise RosettaError("Relax step did not execute successfully. Return code: {}".format(return_code))
+        raise RosettaError("Relax step did not execute successfully. Return code: {}".format(return_code),
+                           return_code)
+    return usage
 
 
-def run_filter_step(rosetta_scripts_bin_fn, database_path, working_dir):
-    filter_cmd = [rosetta_scripts_bin_fn, '-database', database_path, '@flags_filter']
+def run_filter_step(rosetta_scripts_bin_fn, database_path, working_dir, flags_fn="flags_filter", timeout=None):
+    filter_cmd = [rosetta_scripts_bin_fn, '-database', database_path, '@{}'.format(flags_fn)]
     filter_out_fn = join(working_dir, "filter.out")
-    with open(filter_out_fn, "w") as f:
-        return_code = subprocess.call(filter_cmd, cwd=working_dir, stdout=f, stderr=f)
+    return_code, usage = run_rosetta_cmd(filter_cmd, working_dir, filter_out_fn, timeout)
     if return_code != 0:
-        raise RosettaError("Filter step did not execute successfully. Return code: {}".format(return_code))
+        raise RosettaError("Filter step did not execute successfully. Return code: {}".format(return_code),
+                           return_code)
+    return usage
 
 
-def run_centroid_step(score_jd2_bin_fn, database_path, working_dir):
-    centroid_cmd = [score_jd2_bin_fn, '-database', database_path, '@flags_centroid']
+def run_centroid_step(score_jd2_bin_fn, database_path, working_dir, flags_fn="flags_centroid", timeout=None):
+    centroid_cmd = [score_jd2_bin_fn, '-database', database_path, '@{}'.format(flags_fn)]
     centroid_out_fn = join(working_dir, "centroid.out")
-    with open(centroid_out_fn, "w") as f:
-        return_code = subprocess.call(centroid_cmd, cwd=working_dir, stdout=f, stderr=f)
+    return_code, usage = run_rosetta_cmd(centroid_cmd, working_dir, centroid_out_fn, timeout)
     if return_code != 0:
-        raise RosettaError("Centroid step did not execute successfully. Return code: {}".format(return_code))
+        raise RosettaError("Centroid step did not execute successfully. Return code: {}".format(return_code),
+                           return_code)
+    return usage
+
+
+def run_fused_step(rosetta_scripts_bin_fn, database_path, relax_nstruct, working_dir, timeout=None):
+    # mutate, relax, filter, and centroid in a single rosetta_scripts run (see fused_template.xml)
+    fused_cmd = [rosetta_scripts_bin_fn, '-database', database_path, '-nstruct', str(relax_nstruct), '@flags_fused']
+    fused_out_fn = join(working_dir, "fused.out")
+    return_code, usage = run_rosetta_cmd(fused_cmd, working_dir, fused_out_fn, timeout)
+    if return_code != 0:
+        raise RosettaError("Fused step did not execute successfully. Return code: {}".format(return_code),
+                           return_code)
+    return usage
 
 
 def get_rosetta_paths(rosetta_main_dir: str):
@@ -138,7 +279,13 @@ def run_rosetta_pipeline(rosetta_main_dir: str,
                          mutate_default_max_cycles: int,
                          relax_nstruct: int,
                          relax_repeats: int,
-                         variant_has_mutations: bool = True):
+                         variant_has_mutations: bool = True,
+                         run_scoring_steps: bool = True,
+                         step_timeout: Optional[float] = None):
+    """ run the rosetta steps for a single variant. if run_scoring_steps is False, only the mutate and relax
+        steps are run, and the filter and centroid steps are left to the caller (see run_variant_batch).
+        each step is killed if it runs longer than step_timeout seconds.
+        returns the wall-clock run time and the resource usage of each step """
 
     # keep track of how long it takes to run Rosetta
     all_start = time.time()
@@ -148,9 +295,10 @@ def run_rosetta_pipeline(rosetta_main_dir: str,
 
     # this branch logic is just handling the special case of the "_wt" variant (no mutations)
     mt_run_time = 0
+    mt_usage = get_resource_usage()
     if variant_has_mutations:
         mt_start_time = time.time()
-        run_mutate_step(relax_bin_fn, database_path, mutate_default_max_cycles, working_dir)
+        mt_usage = run_mutate_step(relax_bin_fn, database_path, mutate_default_max_cycles, working_dir, step_timeout)
         mt_run_time = time.time() - mt_start_time
         # print("Mutate step took {:.2f}".format(mt_run_time))
     else:
@@ -161,19 +309,25 @@ def run_rosetta_pipeline(rosetta_main_dir: str,
     # relax also needs to know whether the variant has mutations because it needs to either run relax
     # around just the mutated residues or around the whole structure
     rx_start_time = time.time()
-    run_relax_step(relax_bin_fn, database_path, relax_nstruct, relax_repeats, working_dir, variant_has_mutations)
+    rx_usage = run_relax_step(relax_bin_fn, database_path, relax_nstruct, relax_repeats, working_dir,
+                              variant_has_mutations, step_timeout)
     rx_run_time = time.time() - rx_start_time
     # print("Relax step took {:.2f}".format(rx_run_time))
 
-    filt_start_time = time.time()
-    run_filter_step(rosetta_scripts_bin_fn, database_path, working_dir)
-    filt_run_time = time.time() - filt_start_time
-    # print("Filter step took {:.2f}".format(filt_run_time))
-
-    cent_start_time = time.time()
-    run_centroid_step(score_jd2_bin_fn, database_path, working_dir)
-    cent_run_time = time.time() - cent_start_time
-    # print("Centroid step took {:.2f}".format(cent_run_time))
+    filt_run_time = 0
+    cent_run_time = 0
+    filt_usage = get_resource_usage()
+    cent_usage = get_resource_usage()
+    if run_scoring_steps:
+        filt_start_time = time.time()
+        filt_usage = run_filter_step(rosetta_scripts_bin_fn, database_path, working_dir, timeout=step_timeout)
+        filt_run_time = time.time() - filt_start_time
+        # print("Filter step took {:.2f}".format(filt_run_time))
+
+        cent_start_time = time.time()
+        cent_usage = run_centroid_step(score_jd2_bin_fn, database_path, working_dir, timeout=step_timeout)
+        cent_run_time = time.time() - cent_start_time
+        # print("Centroid step took {:.2f}".format(cent_run_time))
 
     # keep track of how long it takes to run all steps
     all_run_time = time.time() - all_start
@@ -184,108 +338,420 @@ def run_rosetta_pipeline(rosetta_main_dir: str,
                  "centroid": cent_run_time,
                  "all": all_run_time}
 
-    return run_times
+    run_usage = {"mutate": mt_usage,
+                 "relax": rx_usage,
+                 "filter": filt_usage,
+                 "centroid": cent_usage}
 
+    return run_times, run_usage
 
-def parse_score_sc(score_sc_fn: str,
-                   agg_method: str = "avg",
-                   sort_col: str = "total_score"):
-    """ parse the score.sc file from the energize run, aggregating energies and appending info about variant
-        this function has also been co-opted to parse the centroid and filter score files, which should only
-        have 1 possible record, so no need to do any agg (and it shouldn't) """
-    score_df = pd.read_csv(score_sc_fn, delim_whitespace=True, skiprows=1, header=0)
 
-    # drop the "SCORE:" and "description" columns, these won't be needed for final output
-    score_df = score_df.drop(["SCORE:", "description"], axis=1)
+def run_fused_pipeline(rosetta_main_dir: str,
+                       working_dir: str,
+                       relax_nstruct: int,
+                       step_timeout: Optional[float] = None):
+    """ run the fused protocol, which loads the rosetta database and reads the input structure once per variant.
+        note mutate_default_max_cycles is a global rosetta option, so it can't be applied to just the mutate
+        part of the fused protocol and the mutate minimization uses the rosetta default number of cycles """
 
-    # special case: only 1 structure was generated, no need to aggregate
-    if len(score_df) == 1:
-        parsed_df = score_df.iloc[[0]]
-    else:
-        if agg_method == "min_energy_avg":
-            # select the structure(s) with the minimum total_score and average the energies if multiple structures
-            # we average just in case there are some structures with the same min total_score but different energies
-            min_score_df = score_df[score_df[sort_col] == score_df[sort_col].min()]
-            parsed_df = min_score_df.mean(axis=0).to_frame().T
-        elif agg_method == "min_energy_first":
-            # select structures with min total_score and use the first one
-            min_score_df = score_df[score_df[sort_col] == score_df[sort_col].min()]
-            parsed_df = min_score_df.iloc[[0]]
-        elif agg_method == "avg":
-            # take the average of all structures, not just the ones with the lowest score
-            parsed_df = score_df.mean(axis=0).to_frame().T
-        else:
-            raise ValueError("invalid aggregation method: {}".format(agg_method))
+    all_start = time.time()
+
+    relax_bin_fn, rosetta_scripts_bin_fn, score_jd2_bin_fn, database_path = get_rosetta_paths(rosetta_main_dir)
+    usage = run_fused_step(rosetta_scripts_bin_fn, database_path, relax_nstruct, working_dir, step_timeout)
+
+    all_run_time = time.time() - all_start
+
+    # the individual steps can't be timed separately, so the whole run is attributed to relax (the slowest step)
+    run_times = {"mutate": 0,
+                 "relax": all_run_time,
+                 "filter": 0,
+                 "centroid": 0,
+                 "all": all_run_time}
+
+    run_usage = {"mutate": get_resource_usage(),
+                 "relax": usage,
+                 "filter": get_resource_usage(),
+                 "centroid": get_resource_usage()}
 
-    return parsed_df
+    return run_times, run_usage
+
+
+def parse_fused_score_sc(score_sc_fn: str):
+    """ parse the score file from the fused protocol into the same columns as the relax, filter, and centroid
+        score files. the centroid terms are already named by the filters in fused_template.xml """
+    energies = parse_score_file(score_sc_fn)
+
+    # the filter step rescored the relaxed structure with the same score function, which is the final pose here
+    if "contact_all" not in energies:
+        raise ScoreFileError("{}: missing the contact_all column".format(score_sc_fn))
+    items = list(energies.items())
+    contact_all_idx = list(energies.keys()).index("contact_all")
+    return dict(items[:contact_all_idx] + [("filter_total_score", energies["total_score"])] + items[contact_all_idx:])
 
 
 def run_single_variant(rosetta_main_dir, pdb_fn, chain, variant, rosetta_hparams,
-                       staging_dir, output_dir, save_wd=False):
+                       working_dir, output_dir, save_wd=False, fused=False, step_timeout=None):
+    """ run the full pipeline for a single variant. returns the run time and the energies record """
     # grab the start time for this variant
     start_time = time.time()
 
     template_dir = "templates/energize_wd_template"
-    # todo: use a variant-specific working directory in the output directory (safer)
-    working_dir = "energize_wd"
 
     # if the working directory exists from a previously failed variant, remove it before starting new variant
     if isdir(working_dir):
         shutil.rmtree(working_dir)
 
+    # run the mutate and relax steps
+    variant_has_mutations = False if variant == "_wt" else True
+
+    # the wild-type relaxes the whole structure with the relax application, which the fused protocol doesn't cover
+    fused = fused and variant_has_mutations
+
     # set up the working directory (copies the pdb file, sets up the rosetta scripts, etc)
     prep_working_dir(template_dir, working_dir, pdb_fn, chain, variant,
-                     rosetta_hparams["relax_distance"], rosetta_hparams["relax_repeats"], overwrite_wd=True)
+                     rosetta_hparams["relax_distance"], rosetta_hparams["relax_repeats"], overwrite_wd=True,
+                     fused=fused)
 
-    # run the mutate and relax steps
-    variant_has_mutations = False if variant == "_wt" else True
+    if fused:
+        run_times, run_usage = run_fused_pipeline(rosetta_main_dir, working_dir, rosetta_hparams["relax_nstruct"],
+                                                  step_timeout)
+    else:
+        run_times, run_usage = run_rosetta_pipeline(rosetta_main_dir, working_dir,
+                                                    rosetta_hparams["mutate_default_max_cycles"],
+                                                    rosetta_hparams["relax_nstruct"],
+                                                    rosetta_hparams["relax_repeats"],
+                                                    variant_has_mutations,
+                                                    step_timeout=step_timeout)
 
-    run_times = run_rosetta_pipeline(rosetta_main_dir, working_dir,
-                                     rosetta_hparams["mutate_default_max_cycles"],
-                                     rosetta_hparams["relax_nstruct"],
-                                     rosetta_hparams["relax_repeats"],
-                                     variant_has_mutations)
+    record = save_variant_outputs(working_dir, pdb_fn, variant, start_time, run_times, run_usage, output_dir,
+                                  save_wd, fused)
+
+    return run_times["all"], record
+
+
+def save_variant_outputs(working_dir, pdb_fn, variant, start_time, run_times, run_usage, output_dir,
+                         save_wd=False, fused=False):
+    """ parse the score files in the working directory into a single energies record (dictionary) and
+        clean up the working dir. the record is written to energies.csv by the main process """
 
     # copy over or parse any files we want to keep from the working directory to the output directory
     # the stdout and stderr outputs from rosetta are in the working directory under mutate.out and relax.out
     # however, we don't need them, so we are going to leave them there and just parse the energies
 
-    # parse the output files into a single-record csv, appending info about variant
-    # place in a staging directory and combine with other variants that run during this job
-    score_df = parse_score_sc(join(working_dir, "relax.sc"))
-    filter_df = parse_score_sc(join(working_dir, "filter.sc"))
-    centroid_df = parse_score_sc(join(working_dir, "centroid.sc"))
+    # parse the output files into a single record, appending info about variant
+    if fused:
+        energies = parse_fused_score_sc(join(working_dir, "fused.sc"))
+    else:
+        score_energies = parse_score_file(join(working_dir, "relax.sc"))
+        filter_energies = parse_score_file(join(working_dir, "filter.sc"))
+        centroid_energies = parse_score_file(join(working_dir, "centroid.sc"))
 
-    # the total_score from filter and centroid probably won't be used, but let's keep them in just in case
-    # just need to resolve the name conflict with the total_score from score_df
-    filter_df.rename(columns={"total_score": "filter_total_score"}, inplace=True)
-    centroid_df.rename(columns={"total_score": "centroid_total_score"}, inplace=True)
+        # the total_score from filter and centroid probably won't be used, but let's keep them in just in case
+        # just need to resolve the name conflict with the total_score from score_energies
+        filter_energies = {("filter_total_score" if k == "total_score" else k): v for k, v in filter_energies.items()}
+        centroid_energies = {("centroid_total_score" if k == "total_score" else k): v
+                             for k, v in centroid_energies.items()}
 
-    full_df = pd.concat((score_df, filter_df, centroid_df), axis=1)
+        energies = {**score_energies, **filter_energies, **centroid_energies}
 
     # append info about this variant
-    full_df.insert(0, "pdb_fn", [basename(pdb_fn)])
-    full_df.insert(1, "variant", [variant])
-    full_df.insert(2, "start_time", [time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start_time))])
-    full_df.insert(3, "run_time", [int(run_times["all"])])
-    full_df.insert(4, "mutate_run_time", [int(run_times["mutate"])])
-    full_df.insert(5, "relax_run_time", [int(run_times["relax"])])
-    full_df.insert(6, "filter_run_time", [int(run_times["filter"])])
-    full_df.insert(7, "centroid_run_time", [int(run_times["centroid"])])
-
-    # note: it's not the best practice to have filenames with periods and commas
-    #   could pass in the loop ID for this single variant and use that to save the file
-    full_df.to_csv(join(staging_dir, "{}_{}_energies.csv".format(basename(pdb_fn), variant)), index=False)
+    record = {"pdb_fn": basename(pdb_fn),
+              "variant": variant,
+              "start_time": time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start_time)),
+              "run_time": int(run_times["all"]),
+              "mutate_run_time": int(run_times["mutate"]),
+              "relax_run_time": int(run_times["relax"]),
+              "filter_run_time": int(run_times["filter"]),
+              "centroid_run_time": int(run_times["centroid"]),
+              **resource_usage_columns(run_usage, ["mutate", "relax", "filter", "centroid"]),
+              **energies}
 
     # if the flag is set, save all files in the working directory for this variant
-    # these go directly to the output directory instead of the staging directory
+    # these go directly to the output directory
     if save_wd:
         shutil.copytree(working_dir, join(output_dir, "wd_{}_{}".format(basename(pdb_fn), variant)))
 
     # clean up the working dir in preparation for next variant
     shutil.rmtree(working_dir)
 
-    return run_times["all"]
+    return record
+
+
+def insert_job_uuid(record, job_uuid):
+    """ add the job uuid to an energies record as the third column, after pdb_fn and variant """
+    items = list(record.items())
+    return dict(items[:2] + [("job_uuid", job_uuid)] + items[2:])
+
+
+def split_score_sc(score_sc_fn: str, tag_re: str):
+    """ split a score file produced from multiple inputs into separate score files, one per input.
+        tag_re is a regular expression that extracts the input key from the description column.
+        returns a dictionary mapping each input key to the lines for that input's score file """
+
+    with open(score_sc_fn, "r") as f:
+        lines = f.read().splitlines()
+
+    # the first line is the "SEQUENCE:" line and the second is the header (first "SCORE:" line)
+    header_lines = lines[:2]
+
+    split_lines = {}
+    for line in lines[2:]:
+        if not line.startswith("SCORE:"):
+            continue
+        # the description column is always the last column
+        match = re.search(tag_re, line.split()[-1])
+        if match is None:
+            continue
+        split_lines.setdefault(match.group(1), []).append(line)
+
+    return {key: header_lines + key_lines for key, key_lines in split_lines.items()}
+
+
+def run_batch_scoring_steps(rosetta_main_dir, batch_dir, working_dirs, step_timeout=None):
+    """ run the filter and centroid steps for multiple variants with a single rosetta process per step.
+        the relaxed structure from each working directory is scored and the combined score files are split back
+        into per-variant filter.sc and centroid.sc files in each working directory.
+        step_timeout is per variant, so the batch steps get step_timeout times the number of variants.
+        returns the run times and resource usage of the filter and centroid steps for the whole batch """
+
+    relax_bin_fn, rosetta_scripts_bin_fn, score_jd2_bin_fn, database_path = get_rosetta_paths(rosetta_main_dir)
+
+    # the filter and centroid steps need the same inputs for every variant, so they can be run over a list
+    # of input structures. the structures get unique filenames so the score file records can be traced back
+    template_cache = get_template_cache("templates/energize_wd_template")
+    os.makedirs(batch_dir)
+    for fn in ["flags_filter_batch", "flags_centroid_batch", "filter_3rd.xml",
+               "total_hydrophobic_weights_version1.wts", "total_hydrophobic_weights_version2.wts"]:
+        template_cache.link(fn, batch_dir)
+
+    with open(join(batch_dir, "structures.txt"), "w") as f:
+        for i, working_dir in enumerate(working_dirs):
+            structure_fn = "batch_input_{}.pdb".format(i)
+            os.symlink(abspath(join(working_dir, "structure_0001_0001.pdb")), join(batch_dir, structure_fn))
+            f.write("{}\n".format(structure_fn))
+
+    # a failure on one input should not prevent splitting the records for the other inputs
+    # any variant without a record in the split score files will be treated as failed
+    batch_timeout = None if step_timeout is None else step_timeout * len(working_dirs)
+    filt_start_time = time.time()
+    filt_usage = get_resource_usage()
+    try:
+        filt_usage = run_filter_step(rosetta_scripts_bin_fn, database_path, batch_dir, flags_fn="flags_filter_batch",
+                                     timeout=batch_timeout)
+    except RosettaError as e:
+        print(e, flush=True)
+    filt_run_time = time.time() - filt_start_time
+
+    cent_start_time = time.time()
+    cent_usage = get_resource_usage()
+    try:
+        cent_usage = run_centroid_step(score_jd2_bin_fn, database_path, batch_dir,
+                                       flags_fn="flags_centroid_batch", timeout=batch_timeout)
+    except RosettaError as e:
+        print(e, flush=True)
+    cent_run_time = time.time() - cent_start_time
+
+    for sc_fn in ["filter.sc", "centroid.sc"]:
+        if not isfile(join(batch_dir, sc_fn)):
+            continue
+        for key, lines in split_score_sc(join(batch_dir, sc_fn), r"batch_input_(\d+)_").items():
+            with open(join(working_dirs[int(key)], sc_fn), "w") as f:
+                f.write("\n".join(lines) + "\n")
+
+    return filt_run_time, cent_run_time, filt_usage, cent_usage
+
+
+def run_variant_batch(tasks, batch_dir):
+    """ run a batch of variants (keyword argument dicts for run_variant_with_retries), sharing one rosetta process
+        per scoring step across the batch. variants that fail in the batch fall back to running individually
+        with the usual retry logic, unless the failure is not worth retrying (see failures.py).
+        returns a list of (energies record, failure) tuples, one per task (see run_variant_with_retries) """
+
+    template_dir = "templates/energize_wd_template"
+
+    # run the variant-specific mutate and relax steps for each variant
+    start_times = {}
+    run_times = {}
+    run_usage = {}
+    batch_failures = {}
+    for i, task in enumerate(tasks):
+        start_times[i] = time.time()
+        try:
+            print("Running Rosetta on variant {} {} ({}/{})".format(basename(task["pdb_fn"]), task["variant"],
+                                                                    task["variant_num"], task["num_variants"]),
+                  flush=True)
+            prep_working_dir(template_dir, task["working_dir"], task["pdb_fn"], task["chain"], task["variant"],
+                             task["rosetta_hparams"]["relax_distance"], task["rosetta_hparams"]["relax_repeats"],
+                             overwrite_wd=True)
+            run_times[i], run_usage[i] = run_rosetta_pipeline(task["rosetta_main_dir"], task["working_dir"],
+                                                              task["rosetta_hparams"]["mutate_default_max_cycles"],
+                                                              task["rosetta_hparams"]["relax_nstruct"],
+                                                              task["rosetta_hparams"]["relax_repeats"],
+                                                              variant_has_mutations=task["variant"] != "_wt",
+                                                              run_scoring_steps=False,
+                                                              step_timeout=task["step_timeout"])
+        except (RosettaError, OSError, ScoreFileError) as e:
+            failure = failures.TIMEOUT if isinstance(e, RosettaTimeoutError) else \
+                failures.classify_failure(e, task["working_dir"])
+            print(e, flush=True)
+            if failure == failures.TRANSIENT:
+                print("Encountered {} error running variant {} {} in batch, "
+                      "will retry individually".format(failure, basename(task["pdb_fn"]), task["variant"]),
+                      flush=True)
+            else:
+                print("Encountered {} error running variant {} {} in batch, "
+                      "will not retry".format(failure, basename(task["pdb_fn"]), task["variant"]), flush=True)
+                batch_failures[i] = failure
+                if isdir(task["working_dir"]):
+                    shutil.rmtree(task["working_dir"])
+
+    # run the filter and centroid steps once for all the variants that made it through relax
+    relaxed_idxs = sorted(run_times.keys())
+    if len(relaxed_idxs) > 0:
+        filt_run_time, cent_run_time, filt_usage, cent_usage = run_batch_scoring_steps(
+            tasks[0]["rosetta_main_dir"], batch_dir, [tasks[i]["working_dir"] for i in relaxed_idxs],
+            tasks[0]["step_timeout"])
+        shutil.rmtree(batch_dir)
+
+        # the batch run times and cpu/io usage are split evenly among the variants in the batch
+        # the peak memory is for the shared process, so each variant gets the full max_rss
+        for i in relaxed_idxs:
+            run_times[i]["filter"] = filt_run_time / len(relaxed_idxs)
+            run_times[i]["centroid"] = cent_run_time / len(relaxed_idxs)
+            run_times[i]["all"] += run_times[i]["filter"] + run_times[i]["centroid"]
+            for step, usage in [("filter", filt_usage), ("centroid", cent_usage)]:
+                run_usage[i][step] = {field: (value if field == "max_rss" else
+                                              value / len(relaxed_idxs) if isinstance(value, float) else
+                                              value // len(relaxed_idxs))
+                                      for field, value in usage.items()}
+
+    results = []
+    for i, task in enumerate(tasks):
+        if i in batch_failures:
+            results.append((None, batch_failures[i]))
+            continue
+
+        record = None
+        if i in run_times:
+            try:
+                record = save_variant_outputs(task["working_dir"], task["pdb_fn"], task["variant"], start_times[i],
+                                              run_times[i], run_usage[i], task["output_dir"], task["save_wd"])
+                print("Processing variant {} {} took {:.2f}".format(basename(task["pdb_fn"]), task["variant"],
+                                                                    run_times[i]["all"]), flush=True)
+            except (FileNotFoundError, ScoreFileError) as e:
+                # the split score files are missing or unusable for this variant
+                print(e, flush=True)
+
+        if record is None:
+            results.append(run_variant_with_retries(**task))
+        else:
+            results.append((record, None))
+
+    return results
+
+
+def run_variant_with_retries(rosetta_main_dir, pdb_fn, chain, variant, rosetta_hparams,
+                             working_dir, output_dir, save_wd=False, fused=False, step_timeout=None,
+                             variant_num=1, num_variants=1, num_attempts=3):
+    """ run a single variant, giving it multiple attempts at success. only transient failures are retried
+        (see failures.py). returns a tuple of (energies record, None) if the variant succeeded or
+        (None, failure class) if it failed.
+        this is a top-level function so it can be dispatched to worker processes """
+
+    # sometimes a single variant fails but others were/are successful
+    # give variants 3 attempts at success, then move on to other variants
+    # unless the failure would just happen again: a problem with the variant's inputs (deterministic),
+    # a problem with this machine that will cause all variants to fail (systemic), or a timeout
+    failure = None
+    for attempt in range(num_attempts):
+        try:
+            print("Running Rosetta on variant {} {} ({}/{})".format(basename(pdb_fn), variant,
+                                                                    variant_num, num_variants), flush=True)
+            run_time, record = run_single_variant(rosetta_main_dir, pdb_fn, chain, variant, rosetta_hparams,
+                                                  working_dir, output_dir, save_wd, fused, step_timeout)
+            print("Processing variant {} {} took {:.2f}".format(basename(pdb_fn), variant, run_time), flush=True)
+
+        except (RosettaError, OSError, ScoreFileError) as e:
+            # classify before the working dir (with the rosetta logs) is cleaned up
+            failure = failures.TIMEOUT if isinstance(e, RosettaTimeoutError) else \
+                failures.classify_failure(e, working_dir)
+
+            print(e, flush=True)
+            print("Encountered {} error running variant {} {}. "
+                  "Attempts remaining: {}".format(failure, basename(pdb_fn), variant,
+                                                  num_attempts - attempt - 1 if failure == failures.TRANSIENT else 0),
+                  flush=True)
+
+            # if we are supposed to save the working directory, save it now
+            # the run_single_variant() function doesn't take care of this when there's an exception
+            if save_wd and isdir(working_dir):
+                shutil.copytree(working_dir, join(output_dir, "wd_{}_{}_{}".format(basename(pdb_fn), variant, attempt)))
+
+            # clean up the working dir in preparation for next attempt
+            if isdir(working_dir):
+                shutil.rmtree(working_dir)
+
+            if failure != failures.TRANSIENT:
+                return None, failure
+        else:
+            # successful variant run
+            return record, None
+
+    # burned through all attempts without success
+    return None, failure
+
+
+def run_variants(tasks, num_workers=1, batch_size=1, batch_dir_base="energize_wd", stop=None):
+    """ run variant tasks (keyword argument dicts for run_variant_with_retries) serially or in a process pool.
+        with batch_size > 1, variants are grouped into batches that share rosetta processes (see run_variant_batch).
+        yields (task index, (energies record, failure)) tuples as the variants finish, which may be out of order with num_workers > 1.
+        once stop() returns True (checked after each variant or batch), no more variants are started, but the ones
+        already running are finished and yielded, so their results aren't thrown away """
+
+    # each unit of work is a list of task indices along with the function and arguments to run it
+    if batch_size <= 1:
+        units = [([i], run_variant_with_retries, task) for i, task in enumerate(tasks)]
+    else:
+        units = []
+        for batch_num, start in enumerate(range(0, len(tasks), batch_size)):
+            idxs = list(range(start, min(start + batch_size, len(tasks))))
+            batch_args = {"tasks": [tasks[i] for i in idxs],
+                          "batch_dir": join(batch_dir_base, "batch_{}".format(batch_num))}
+            units.append((idxs, run_variant_batch, batch_args))
+
+    def unit_results(idxs, result):
+        # batches return a list of results, single variants return a single result
+        if not isinstance(result, list):
+            result = [result]
+        return zip(idxs, result)
+
+    if num_workers <= 1:
+        for idxs, fn, fn_args in units:
+            yield from unit_results(idxs, fn(**fn_args))
+            if stop is not None and stop():
+                return
+    else:
+        # each variant gets its own working directory, so the worker processes don't step on each other
+        # rosetta binaries are single-threaded, so one worker per available core is a good default
+        # units are submitted as workers free up rather than all at once, because the executor starts queued
+        # units early (it can't cancel them once they're handed off to a worker process)
+        executor = ProcessPoolExecutor(max_workers=num_workers)
+        units = iter(units)
+        running = {}
+        try:
+            for idxs, fn, fn_args in itertools.islice(units, num_workers):
+                running[executor.submit(fn, **fn_args)] = idxs
+            while len(running) > 0:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from unit_results(running.pop(future), future.result())
+                    next_unit = None if stop is not None and stop() else next(units, None)
+                    if next_unit is not None:
+                        idxs, fn, fn_args = next_unit
+                        running[executor.submit(fn, **fn_args)] = idxs
+        finally:
+            # if a variant raised an exception, the variants that are still running finish before it's re-raised
+            executor.shutdown(wait=True)
 
 
 def get_log_dir_name(args, job_uuid, start_time, ld_prefix="energize"):
@@ -300,20 +766,20 @@ def get_log_dir_name(args, job_uuid, start_time, ld_prefix="energize"):
     return log_dir
 
 
-def combine_outputs(staging_dir):
-    """ combine the outputs from individual variants into a single csv """
-    # Note that these will probably NOT be in the same order as they were run (can add timestamp to record)
-    output_fns = [join(staging_dir, x) for x in os.listdir(staging_dir)]
+def find_resumable_log_dir(log_dir_base, cluster, process, ld_prefix="energize"):
+    """ find the log directory from a previous attempt of this HTCondor job (same cluster and process), if any """
+    if not isdir(log_dir_base):
+        return None
 
-    # read individual dataframes into a list
-    dfs = []
-    for fn in output_fns:
-        df = pd.read_csv(fn, header=0)
-        dfs.append(df)
+    # log dir names start with the prefix, cluster, and process, followed by the start time (see get_log_dir_name)
+    # so sorting them puts the most recent attempt last
+    prefix = "{}_{}_{}_".format(ld_prefix, cluster, process)
+    log_dirs = sorted([ld for ld in os.listdir(log_dir_base)
+                       if ld.startswith(prefix) and isfile(join(log_dir_base, ld, "journal.jsonl"))])
 
-    # combine into a single dataframe
-    combined_df = pd.concat(dfs, axis=0, ignore_index=True)
-    return combined_df
+    if len(log_dirs) == 0:
+        return None
+    return join(log_dir_base, log_dirs[-1])
 
 
 def save_csv_from_dict(save_fn, d):
@@ -348,95 +814,168 @@ def main(args):
     # this will be logged in UTC time (GM time) in the log directory name and output files
     script_start = time.time()
 
-    # generate a unique identifier for this run
-    job_uuid = shortuuid.encode(uuid.uuid4())[:12]
-
-    # create the log directory for this job
-    log_dir = join(args.log_dir_base, get_log_dir_name(args, job_uuid, script_start))
-    os.makedirs(log_dir)
-
-    # save the argparse arguments back out to a file
-    save_argparse_args(vars(args), join(log_dir, "args.txt"))
-
-    # save job info
-    save_job_info(script_start, job_uuid, args.cluster, args.process, args.commit_id, log_dir)
-
     # create a dictionary of just rosetta hyperparameters that can be passed around throughout functions and saved
     rosetta_hparams = {"mutate_default_max_cycles": args.mutate_default_max_cycles,
                        "relax_distance": args.relax_distance,
                        "relax_repeats": args.relax_repeats,
                        "relax_nstruct": args.relax_nstruct}
-    save_csv_from_dict(join(log_dir, "hparams.csv"), rosetta_hparams)
+
+    # if this HTCondor job was restarted (evicted, released from hold, or checkpointed), pick up where the
+    # previous attempt left off, in the same log directory and with the same uuid, instead of starting over
+    # the cluster and process only identify a job when running on HTCondor, so local runs always start fresh
+    log_dir = None
+    if args.cluster != "local" and not args.no_resume:
+        log_dir = find_resumable_log_dir(args.log_dir_base, args.cluster, args.process)
+
+    if log_dir is not None:
+        job_uuid = analysis.parse_job_dir_name(basename(log_dir))["uuid"]
+        print("Resuming job from existing log directory: {}".format(log_dir), flush=True)
+    else:
+        # generate a unique identifier for this run
+        job_uuid = shortuuid.encode(uuid.uuid4())[:12]
+
+        # create the log directory for this job
+        log_dir = join(args.log_dir_base, get_log_dir_name(args, job_uuid, script_start))
+        os.makedirs(log_dir)
+
+        # save the argparse arguments back out to a file
+        save_argparse_args(vars(args), join(log_dir, "args.txt"))
+
+        # save job info
+        save_job_info(script_start, job_uuid, args.cluster, args.process, args.commit_id, log_dir)
+
+        save_csv_from_dict(join(log_dir, "hparams.csv"), rosetta_hparams)
 
     # load the variants that will be processed with this run
     # this file contains a line for each variant
     # and each line contains the pdb file and the comma-delimited substitutions (e.g. "2qmt_p.pdb A23P,R67L")
+    # a line can also stand for a range of variant ranks (e.g. "2qmt_p.pdb ranks=2:0:500", see variant_space.py)
     with open(args.variants_fn, "r") as f:
-        pdbs_variants = f.read().splitlines()
-
-    # set up the staging dir....
-    staging_dir = join(log_dir, "staging")
-    os.makedirs(staging_dir, exist_ok=True)
-
-    # loop through each variant, model it with rosetta, save results
-    # individual variant outputs will be placed in the staging directory
-    failed = []  # keep track of any variants that file after 3 attempts
+        pdbs_variants = list(expand_variant_lines(f.read().splitlines(), chain_seq_getter(args.pdb_dir, args.chain)))
+
+    # the fused protocol already runs every step in a single rosetta process, so there is nothing to batch
+    if args.fused and args.batch_size > 1:
+        raise ValueError("--fused and --batch_size > 1 cannot be used together")
+
+    # the fused protocol repeats the mutation, filter, and centroid steps for every structure, so with
+    # more than one structure those energies would be averaged over different mutated structures
+    if args.fused and args.relax_nstruct > 1:
+        raise ValueError("--fused and --relax_nstruct > 1 cannot be used together")
+
+    # fail now instead of after running all the variants if the columnar copy can't be saved
+    if args.save_parquet:
+        pd.io.parquet.get_engine("auto")
+
+    # each variant's energies are appended to energies.csv by this (main) process as soon as the variant finishes
+    # the journal records the status of every finished variant
+    # a restarted job only needs to run the variants that are not in energies.csv yet
+    # variants that failed in a previous attempt get another chance (maybe on a better machine)
+    # but variants that failed deterministically or timed out would just fail again, so they stay failed
+    results_writer = ResultsWriter(join(log_dir, "energies.csv"))
+    journal = VariantJournal(join(log_dir, "journal.jsonl"))
+    completed = results_writer.written_keys()
+    if len(completed) > 0:
+        print("Skipping {} variants completed by a previous attempt of this job".format(len(completed)), flush=True)
+    not_retryable = {pv: r["status"] for pv, r in journal.load().items() if r["status"] in failures.NON_RETRYABLE}
+
+    # every variant gets its own working directory under a common base directory
+    # this way, variants can run concurrently with num_workers > 1
+    wd_base = "energize_wd"
+    if isdir(wd_base):
+        shutil.rmtree(wd_base)
+    os.makedirs(wd_base)
+
+    # each rosetta step gets a timeout based on the sequence length, so a hung or pathological variant
+    # only costs a few multiples of its expected runtime instead of the whole job
+    step_timeouts = {}
+
+    failed_idxs = {}  # index into pdbs_variants -> failure class (see failures.py)
+    tasks = []
+    task_idxs = []  # index into pdbs_variants for each task
     for i, pdb_variant in enumerate(pdbs_variants):
+        if pdb_variant in completed:
+            continue
+        if pdb_variant in not_retryable:
+            failed_idxs[i] = not_retryable[pdb_variant]
+            continue
         pdb_basename, variant = pdb_variant.split()
-        pdb_fn = join(args.pdb_dir, pdb_basename)
+        if pdb_basename not in step_timeouts:
+            step_timeouts[pdb_basename] = get_pdb_step_timeout(join(args.pdb_dir, pdb_basename), args.chain,
+                                                               args.timeout_factor, args.min_step_timeout)
+        task_idxs.append(i)
+        tasks.append({"rosetta_main_dir": args.rosetta_main_dir,
+                      "pdb_fn": join(args.pdb_dir, pdb_basename),
+                      "chain": args.chain,
+                      "variant": variant,
+                      "rosetta_hparams": rosetta_hparams,
+                      "working_dir": join(wd_base, "wd_{}".format(i)),
+                      "output_dir": log_dir,
+                      "save_wd": args.save_wd,
+                      "fused": args.fused,
+                      "step_timeout": step_timeouts[pdb_basename],
+                      "variant_num": i + 1,
+                      "num_variants": len(pdbs_variants)})
 
-        # sometimes a single variant fails but others were/are successful
-        # give variants 3 attempts at success, then move on to other variants
-        # in worst case scenario, there is a system-level problem that will cause all variants to fail
-        num_attempts_per_variant = 3
-        for attempt in range(num_attempts_per_variant):
-            try:
-                print("Running Rosetta on variant {} {} ({}/{})".format(basename(pdb_fn), variant,
-                                                                        i + 1, len(pdbs_variants)), flush=True)
-                run_time = run_single_variant(args.rosetta_main_dir, pdb_fn, args.chain, variant, rosetta_hparams, staging_dir,
-                                              log_dir, args.save_wd)
-                print("Processing variant {} {} took {:.2f}".format(basename(pdb_fn), variant, run_time), flush=True)
+    # loop through each variant, model it with rosetta, save results
+    # keep track of any variants that fail, and give up on this machine if variants keep failing systemically
+    # when checkpointing or aborting, no more variants are started, but the ones that are already running
+    # finish and are recorded
+    checkpoint = False
+    aborted = False
+    num_consecutive_systemic = 0
+    num_finished = 0
+    results = run_variants(tasks, args.num_workers, args.batch_size, wd_base, stop=lambda: checkpoint or aborted)
+    for num_finished, (i, (record, failure)) in enumerate(results, 1):
+        pdb_variant = pdbs_variants[task_idxs[i]]
+        if record is not None:
+            results_writer.write(insert_job_uuid(record, job_uuid))
+            journal.record(pdb_variant, "success")
+        else:
+            # add this variant to failed.txt and continue with the other variants
+            failed_idxs[task_idxs[i]] = failure
+            journal.record(pdb_variant, failure)
 
-            except (RosettaError, FileNotFoundError) as e:
-                print(e, flush=True)
-                print("Encountered error running variant {} {}. "
-                      "Attempts remaining: {}".format(pdb_basename, variant, num_attempts_per_variant - attempt - 1),
-                      flush=True)
+        if not aborted:
+            num_consecutive_systemic = num_consecutive_systemic + 1 if failure == failures.SYSTEMIC else 0
+        if 0 < args.max_systemic_failures <= num_consecutive_systemic and num_finished < len(tasks):
+            aborted = True
 
-                # if we are supposed to save the working directory, save it now
-                # the run_single_variant() function doesn't take care of this when there's an exception
-                # todo: if we end up using variant-specific working dir, update here
-                working_dir = "energize_wd"
-                if args.save_wd:
-                    shutil.copytree(working_dir, join(log_dir, "wd_{}_{}_{}".format(basename(pdb_fn), variant, attempt)))
+        # periodically exit so HTCondor can save the output directory (with the journal) as a checkpoint
+        if 0 < args.checkpoint_interval < time.time() - script_start and num_finished < len(tasks):
+            checkpoint = True
 
-                # clean up the working dir in preparation for next variant
-                shutil.rmtree(working_dir)
-            else:
-                # successful variant run, so break out of the attempt loop
-                break
-        else:
-            # else clause of the for loop triggers if we burned through all attempts without success
-            # add this variant to a failed_variants.txt file and continue with the other variants
-            failed.append(pdb_variant)
+    # the variants that were still running may have been the last ones, then there's nothing left to resume
+    if num_finished == len(tasks):
+        checkpoint = False
+        aborted = False
+    results_writer.close()
+
+    shutil.rmtree(wd_base)
+
+    if checkpoint:
+        print("Checkpointing after {:.2f} seconds, the job will resume from the journal".format(
+            time.time() - script_start), flush=True)
+        sys.exit(CHECKPOINT_EXIT_CODE)
+
+    # keep failed variants in the same order as the variants file
+    failed = [(pdbs_variants[i], failed_idxs[i]) for i in sorted(failed_idxs)]
 
     # save a txt file with failed variants (if there are failed variants)
+    # each line is the variant followed by the failure class, e.g. "2qmt_p.pdb A23P,R67L timeout"
     if len(failed) > 0:
         with open(join(log_dir, "failed.txt"), "w") as f:
-            for fv in failed:
-                f.write("{}\n".format(fv))
-
-    # if any variants were successful, concat the outputs into a final energies.csv
-    if len(failed) < len(pdbs_variants):
-        # combine outputs in the staging directory into a single csv file
-        cdf = combine_outputs(join(log_dir, "staging"))
-        # add additional column for job uuid
-        cdf.insert(2, "job_uuid", job_uuid)
-        # save in the main log directory
-        cdf.to_csv(join(log_dir, "energies.csv"), index=False)
+            for fv, failure in failed:
+                f.write("{} {}\n".format(fv, failure))
+
+    if aborted:
+        # the remaining variants were not run. exit with failure code so the job goes on hold and gets released
+        # (hopefully onto a different machine), where it resumes from the journal
+        print("Aborting after {} consecutive systemic failures, remaining variants were not run".format(
+            num_consecutive_systemic), flush=True)
+        sys.exit(1)
 
-    # compress outputs, delete the output staging directory, etc
-    shutil.rmtree(join(log_dir, "staging"))
+    if args.save_parquet:
+        results_writer.save_parquet(join(log_dir, "energies.parquet"))
 
     if (len(failed) / len(pdbs_variants)) > args.allowable_failure_fraction:
         # too many variants failed in this job. exit with failure code.
@@ -481,6 +1020,47 @@ if __name__ == "__main__":
                         type=float,
                         default=0.25)
 
+    parser.add_argument("--num_workers",
+                        help="number of variants to run concurrently in separate processes. "
+                             "should match the number of cpus available to the job (request_cpus)",
+                        type=int,
+                        default=1)
+
+    parser.add_argument("--batch_size",
+                        help="number of variants that share a single rosetta process for the filter and centroid "
+                             "steps, which amortizes rosetta startup (database loading) across variants",
+                        type=int,
+                        default=1)
+
+    parser.add_argument("--timeout_factor",
+                        help="each rosetta step is killed if it runs longer than this multiple of the expected "
+                             "runtime of a variant (based on sequence length), and the variant is recorded as a "
+                             "timeout in failed.txt without being retried. set to 0 to disable timeouts",
+                        type=float,
+                        default=10)
+
+    parser.add_argument("--min_step_timeout",
+                        help="minimum timeout in seconds for each rosetta step, see --timeout_factor",
+                        type=float,
+                        default=600)
+
+    parser.add_argument("--max_systemic_failures",
+                        help="abort the job after this many consecutive variants fail with systemic errors "
+                             "(problems with the machine or rosetta distribution, see failures.py). "
+                             "set to 0 to never abort",
+                        type=int,
+                        default=3)
+
+    parser.add_argument("--save_parquet",
+                        help="set this flag to also save the energies in a columnar format (energies.parquet) "
+                             "when the job finishes. requires pyarrow or fastparquet",
+                        action="store_true")
+
+    parser.add_argument("--fused",
+                        help="set this flag to run mutate, relax, filter, and centroid in a single rosetta_scripts "
+                             "run per variant (see templates/energize_wd_template/fused_template.xml)",
+                        action="store_true")
+
     # energize hyperparameters
     parser.add_argument("--mutate_default_max_cycles",
                         help="number of optimization cycles in the mutate step",
@@ -499,6 +1079,18 @@ if __name__ == "__main__":
                         type=float,
                         default=10.0)
 
+    # checkpointing and resuming (HTCondor)
+    parser.add_argument("--checkpoint_interval",
+                        help="exit with code {} after this many seconds so HTCondor saves the output directory as a "
+                             "checkpoint and restarts the job. 0 disables checkpointing".format(CHECKPOINT_EXIT_CODE),
+                        type=int,
+                        default=0)
+
+    parser.add_argument("--no_resume",
+                        help="set this flag to start over instead of resuming from the journal of a previous "
+                             "attempt of the same HTCondor job",
+                        action="store_true")
+
     # logging and output options
     parser.add_argument("--save_wd",
                         help="set this flag to save the full working directory for each variant",
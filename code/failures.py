@@ -0,0 +1,101 @@
+""" classify why a variant failed, from the error and the rosetta output logs (mutate.out, relax.out, etc),
+    to decide whether the variant is worth retrying and whether the job should give up early """
+import os
+from os.path import isdir, join, getmtime
+import re
+
+# failure classes, also recorded in failed.txt and the job journal
+# the variant's inputs are the problem (e.g. a bad resfile), it will fail the same way every time
+DETERMINISTIC = "deterministic"
+# the variant might succeed on another attempt (e.g. rosetta was killed or ran out of memory)
+TRANSIENT = "transient"
+# the machine or rosetta distribution is the problem (e.g. missing database), every variant will fail
+SYSTEMIC = "systemic"
+# a rosetta step ran longer than its timeout
+TIMEOUT = "timeout"
+
+# failures that are not retried, either within the job or when a restarted job resumes
+# systemic failures are also not retried within the job, but a resumed job may be on a better machine
+NON_RETRYABLE = (DETERMINISTIC, TIMEOUT)
+
+# patterns in the rosetta output logs, checked in this order (case insensitive)
+# deterministic patterns are only matched against error lines, because rosetta's regular output also
+# mentions things like the resfile
+LOG_PATTERNS = [
+    (SYSTEMIC, [r"(unable to|could not|can't|cannot) (open|find|locate|read)[^\n]*database",
+                r"database[^\n]*(not found|does not exist)",
+                r"error while loading shared libraries",
+                r"exec format error",
+                r"illegal instruction",
+                r"no space left on device",
+                r"disk quota exceeded",
+                r"read-only file system"]),
+    (TRANSIENT, [r"std::bad_alloc",
+                 r"out of memory",
+                 r"cannot allocate memory",
+                 r"resource temporarily unavailable",
+                 r"input/output error",
+                 r"stale file handle"]),
+    (DETERMINISTIC, [r"resfile",
+                     r"unrecognized (residue|amino acid|aa)",
+                     r"residue[^\n]*(not found|does not exist|out of range)",
+                     r"cannot normalize xyzvector",
+                     r"assertion[^\n]*failed"]),
+]
+
+
+def read_log_tail(log_fn, num_bytes=32768):
+    """ the end of a log file, which is where rosetta reports the error that made it exit """
+    with open(log_fn, "rb") as f:
+        f.seek(max(0, os.path.getsize(log_fn) - num_bytes))
+        return f.read().decode("utf-8", errors="replace")
+
+
+def classify_logs(working_dir):
+    """ classify the failure from the rosetta output logs in the working directory, most recent log first
+        (the step that failed). returns None if no log has a recognized error """
+    if not isdir(working_dir):
+        return None
+
+    log_fns = sorted([join(working_dir, fn) for fn in os.listdir(working_dir) if fn.endswith(".out")],
+                     key=getmtime, reverse=True)
+    for log_fn in log_fns:
+        log_text = read_log_tail(log_fn).lower()
+        error_text = "\n".join(line for line in log_text.splitlines() if "error" in line)
+        for failure, patterns in LOG_PATTERNS:
+            text = error_text if failure == DETERMINISTIC else log_text
+            if any(re.search(pattern, text) for pattern in patterns):
+                return failure
+    return None
+
+
+def classify_return_code(return_code):
+    """ classify the failure from the return code of the rosetta process """
+    if return_code is None:
+        return TRANSIENT
+    if return_code in (126, 127):
+        # the binary couldn't be executed or wasn't found
+        return SYSTEMIC
+    if return_code == -4:
+        # SIGILL, the binary uses instructions this cpu doesn't support
+        return SYSTEMIC
+    # killed by a signal (e.g. SIGKILL from the out-of-memory killer), or an unrecognized rosetta error
+    return TRANSIENT
+
+
+def classify_failure(error, working_dir):
+    """ classify a variant failure (the exception raised while running it) as deterministic, transient,
+        or systemic. timeouts are identified by the caller from the exception type """
+
+    if isinstance(error, OSError) and not (isinstance(error, FileNotFoundError) and
+                                           str(error.filename).endswith(".sc")):
+        # the rosetta binary, input pdb, or working directory is missing or inaccessible, or the disk is full
+        # a missing score file (rosetta exited without writing its output) is classified from the logs below,
+        # as is an empty or truncated score file (score_file.ScoreFileError)
+        return SYSTEMIC
+
+    log_failure = classify_logs(working_dir)
+    if log_failure is not None:
+        return log_failure
+
+    return classify_return_code(getattr(error, "return_code", None))
@@ -1,7 +1,6 @@
 """ Runs the GB1 docking pipeline but uses my Python-based framework from energize.py """
 
 import argparse
-import subprocess
 import shutil
 import os
 import sys
@@ -10,17 +9,21 @@ import uuid
 import socket
 import csv
 import platform
+from typing import Optional
 
 import shortuuid
 import numpy as np
 import pandas as pd
 
 import energize
-from templates import fill_templates
+import failures
+from results_writer import ResultsWriter
+from score_file import ScoreFileError, parse_score_file
+from templates import get_template_cache, link_file
 import time
 
 
-def run_mutate_step(rosetta_scripts_bin_fn, database_path, working_dir):
+def run_mutate_step(rosetta_scripts_bin_fn, database_path, working_dir, timeout=None):
 
     # the input structure is assumed to be "structure.pdb"
     # setting this up is handled in the prep_working_dir() function
@@ -36,11 +39,10 @@ def run_mutate_step(rosetta_scripts_bin_fn, database_path, working_dir):
                   ]
 
     mutate_out_fn = join(working_dir, "mutate.out")
-    # to completely void output, can direct it to subprocess.DEVNULL instead of f
-    with open(mutate_out_fn, "w") as f:
-        return_code = subprocess.call(mutate_cmd, cwd=working_dir, stdout=f, stderr=f)
+    return_code, usage = energize.run_rosetta_cmd(mutate_cmd, working_dir, mutate_out_fn, timeout)
     if return_code != 0:
-        raise energize.RosettaError("Mutate step did not execute successfully. Return code: {}".format(return_code))
+        raise energize.RosettaError("Mutate step did not execute successfully. Return code: {}".format(return_code),
+                                    return_code)
 
     # Sameer copied output from this step into output directory, but we can just keep it
     # where it is because our script has the option to save the whole working directory if requested
@@ -48,12 +50,15 @@ def run_mutate_step(rosetta_scripts_bin_fn, database_path, working_dir):
     # shutil.copyfile("mutated_structures/structure_0001.pdb", "output/variant_relaxed.pdb")
     # shutil.copyfile("mutated_structures/mutate.sc", "output/variant_relaxed_score.sc")
 
+    return usage
+
 
 def run_docking_step(rosetta_scripts_bin_fn: str,
                      database_path: str,
                      num_structs: int,
                      working_dir: str,
-                     variant_has_mutations: bool = True):
+                     variant_has_mutations: bool = True,
+                     timeout: Optional[float] = None):
 
     in_structure_fn = "mutated_structures/structure_0001.pdb"
 
@@ -77,16 +82,18 @@ def run_docking_step(rosetta_scripts_bin_fn: str,
         raise NotImplementedError("This function doesn't support the WT yet")
 
     dock_out_fn = join(working_dir, "dock.out")
-    with open(dock_out_fn, "w") as f:
-        return_code = subprocess.call(dock_cmd, cwd=working_dir, stdout=f, stderr=f)
+    return_code, usage = energize.run_rosetta_cmd(dock_cmd, working_dir, dock_out_fn, timeout)
     if return_code != 0:
-        raise energize.RosettaError("Docking step did not execute successfully. Return code: {}".format(return_code))
+        raise energize.RosettaError("Docking step did not execute successfully. Return code: {}".format(return_code),
+                                    return_code)
+    return usage
 
 
 def run_docking_pipeline(rosetta_main_dir: str,
                          working_dir: str,
                          num_structs: int,
-                         variant_has_mutations: bool = True):
+                         variant_has_mutations: bool = True,
+                         step_timeout: Optional[float] = None):
 
     # keep track of how long it takes to run Rosetta
     all_start = time.time()
@@ -97,14 +104,17 @@ def run_docking_pipeline(rosetta_main_dir: str,
     # run the mutate step
     if variant_has_mutations:
         mt_start_time = time.time()
-        run_mutate_step(rosetta_scripts_bin_fn, database_path, working_dir)
+        mt_usage = run_mutate_step(rosetta_scripts_bin_fn, database_path, working_dir, step_timeout)
         mt_run_time = time.time() - mt_start_time
     else:
         raise NotImplementedError("This function doesn't support the WT yet")
 
     # run docking step
     dock_start_time = time.time()
-    run_docking_step(rosetta_scripts_bin_fn, database_path, num_structs, working_dir, variant_has_mutations)
+    # the docking step generates num_structs structures, so it gets a proportionally longer timeout
+    dock_timeout = None if step_timeout is None else step_timeout * num_structs
+    dock_usage = run_docking_step(rosetta_scripts_bin_fn, database_path, num_structs, working_dir,
+                                  variant_has_mutations, dock_timeout)
     dock_run_time = time.time() - dock_start_time
 
     # keep track of how long it takes to run all steps
@@ -116,12 +126,16 @@ def run_docking_pipeline(rosetta_main_dir: str,
         "dock": dock_run_time,
         "all": all_run_time,
     }
-    return run_times
+    run_usage = {
+        "mutate": mt_usage,
+        "dock": dock_usage,
+    }
+    return run_times, run_usage
 
 
 def gen_mutate_xml(variant, chain, working_dir):
 
-    template_fn = "templates/docking_wd_template/mutate_template.xml"
+    template_cache = get_template_cache("templates/docking_wd_template")
 
     aa_map = {
         "A": "ALA", "C": "CYS", "D": "ASP", "E": "GLU", "F": "PHE", "G": "GLY",
@@ -147,8 +161,7 @@ def gen_mutate_xml(variant, chain, working_dir):
         mutate_residue_movers.append(f'<Add mover_name="mutant{i}"/>')
         protocols.append(f'<Add mover_name="mutant{i}"/>')
 
-    with open(template_fn, 'r') as template_file:
-        template = template_file.read()
+    template = template_cache.read("mutate_template.xml")
 
     filled_template = template.format(
         joined_idxs=",".join(idxs),
@@ -190,15 +203,16 @@ def prep_working_dir(template_dir, working_dir, pdb_fn, chain, variant, overwrit
     # todo: potentially remove
     os.makedirs(join(working_dir, "output"))
 
-    # copy over PDB file into rosetta working dir and rename it to structure.pdb
-    shutil.copyfile(pdb_fn, join(working_dir, "structure.pdb"))
+    # link the PDB file into rosetta working dir as structure.pdb (rosetta writes its outputs to new files)
+    link_file(pdb_fn, join(working_dir, "structure.pdb"))
 
-    # copy over files from the template dir that don't need to be changed
+    # link files from the template dir that don't need to be changed
     files_to_copy = ["docking_minimize.xml", "docking_minimize_fast.xml",
                      "options_dock.txt", "options_mutate.txt", "protein_dock_fast.sh"]
 
+    template_cache = get_template_cache(template_dir)
     for fn in files_to_copy:
-        shutil.copy(join(template_dir, fn), working_dir)
+        template_cache.link(fn, working_dir)
 
     # create the mutate.xml file
     gen_mutate_xml(variant, chain, working_dir)
@@ -210,9 +224,10 @@ def run_single_variant(rosetta_main_dir: str,
                        variant: str,
                        rosetta_hparams: dict,
                        working_dir: str,
-                       staging_dir: str,
                        output_dir: str,
-                       save_wd: bool = False):
+                       save_wd: bool = False,
+                       step_timeout: Optional[float] = None):
+    """ run the docking pipeline for a single variant. returns the run time and the energies record """
 
     start_time = time.time()
 
@@ -229,42 +244,37 @@ def run_single_variant(rosetta_main_dir: str,
     # run the mutate and relax steps
     variant_has_mutations = False if variant == "_wt" else True
 
-    run_times = run_docking_pipeline(rosetta_main_dir,
-                                     working_dir,
-                                     rosetta_hparams["num_structs"],
-                                     variant_has_mutations)
+    run_times, run_usage = run_docking_pipeline(rosetta_main_dir,
+                                                working_dir,
+                                                rosetta_hparams["num_structs"],
+                                                variant_has_mutations,
+                                                step_timeout)
 
-    # parse the output files into a single-record csv, appending info about variant
-    # place in a staging directory and combine with other variants that run during this job
+    # parse the output files into a single record, appending info about variant
     # this selects the docking structure w/ the lowest dG_separated
-    dock_df = energize.parse_score_sc(score_sc_fn=join(working_dir, "docked_structures", "docked_score.sc"),
-                                      agg_method="min_energy_first",
-                                      sort_col="dG_separated")
-
-    # no additional energies to concat... so just use the dock_df
-    full_df = dock_df
+    dock_energies = parse_score_file(score_sc_fn=join(working_dir, "docked_structures", "docked_score.sc"),
+                                     agg_method="min_energy_first",
+                                     sort_col="dG_separated")
 
     # append info about this variant
-    full_df.insert(0, "pdb_fn", [basename(pdb_fn)])
-    full_df.insert(1, "variant", [variant])
-    full_df.insert(2, "start_time", [time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start_time))])
-    full_df.insert(3, "run_time", [int(run_times["all"])])
-    full_df.insert(4, "mutate_run_time", [int(run_times["mutate"])])
-    full_df.insert(5, "dock_run_time", [int(run_times["dock"])])
-
-    # note: it's not the best practice to have filenames with periods and commas
-    #   could pass in the loop ID for this single variant and use that to save the file
-    full_df.to_csv(join(staging_dir, "{}_{}_energies.csv".format(basename(pdb_fn), variant)), index=False)
+    record = {"pdb_fn": basename(pdb_fn),
+              "variant": variant,
+              "start_time": time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start_time)),
+              "run_time": int(run_times["all"]),
+              "mutate_run_time": int(run_times["mutate"]),
+              "dock_run_time": int(run_times["dock"]),
+              **energize.resource_usage_columns(run_usage, ["mutate", "dock"]),
+              **dock_energies}
 
     # if the flag is set, save all files in the working directory for this variant
-    # these go directly to the output directory instead of the staging directory
+    # these go directly to the output directory
     if save_wd:
         shutil.copytree(working_dir, join(output_dir, "wd_{}_{}".format(basename(pdb_fn), variant)))
 
     # clean up the working dir in preparation for next variant
     shutil.rmtree(working_dir)
 
-    return run_times["all"]
+    return run_times["all"], record
 
 
 def main(args):
@@ -296,78 +306,101 @@ def main(args):
     with open(args.variants_fn, "r") as f:
         pdbs_variants = f.read().splitlines()
 
-    # set up the staging dir....
-    staging_dir = join(log_dir, "staging")
-    os.makedirs(staging_dir, exist_ok=True)
+    # each variant's energies are appended to energies.csv as soon as the variant finishes
+    results_writer = ResultsWriter(join(log_dir, "energies.csv"))
 
     # define the working directory constant
     working_dir = "docking_wd"
 
+    # each rosetta step gets a timeout based on the sequence length (see energize.get_step_timeout)
+    step_timeouts = {}
+
     # loop through each variant, model it with rosetta, save results
-    # individual variant outputs will be placed in the staging directory
-    failed = []  # keep track of any variants that file after 3 attempts
+    # keep track of any variants that fail, and give up on this machine if variants keep failing systemically
+    failed = []  # (pdb_variant, failure class) for each failed variant
+    aborted = False
+    num_consecutive_systemic = 0
     for i, pdb_variant in enumerate(pdbs_variants):
         pdb_basename, variant = pdb_variant.split()
         pdb_fn = join(args.pdb_dir, pdb_basename)
 
+        if pdb_basename not in step_timeouts:
+            step_timeouts[pdb_basename] = energize.get_pdb_step_timeout(pdb_fn, args.chain, args.timeout_factor,
+                                                                        args.min_step_timeout)
+
         # sometimes a single variant fails but others were/are successful
-        # give variants 3 attempts at success, then move on to other variants
-        # in worst case scenario, there is a system-level problem that will cause all variants to fail
+        # give variants with transient failures 3 attempts at success, then move on to other variants
+        # deterministic, systemic, and timeout failures would just fail again, so they are not retried
         num_attempts_per_variant = 3
+        failure = None
         for attempt in range(num_attempts_per_variant):
             try:
                 print("Running Rosetta on variant {} {} ({}/{})".format(basename(pdb_fn), variant,
                                                                         i + 1, len(pdbs_variants)), flush=True)
-                run_time = run_single_variant(args.rosetta_main_dir,
-                                              pdb_fn,
-                                              args.chain,
-                                              variant,
-                                              rosetta_hparams,
-                                              working_dir,
-                                              staging_dir,
-                                              log_dir, args.save_wd)
+                run_time, record = run_single_variant(args.rosetta_main_dir,
+                                                      pdb_fn,
+                                                      args.chain,
+                                                      variant,
+                                                      rosetta_hparams,
+                                                      working_dir,
+                                                      log_dir, args.save_wd,
+                                                      step_timeouts[pdb_basename])
                 print("Processing variant {} {} took {:.2f}".format(basename(pdb_fn), variant, run_time), flush=True)
 
-            except (energize.RosettaError, FileNotFoundError) as e:
+            except (energize.RosettaError, OSError, ScoreFileError) as e:
+                # classify before the working dir (with the rosetta logs) is cleaned up
+                failure = failures.TIMEOUT if isinstance(e, energize.RosettaTimeoutError) else \
+                    failures.classify_failure(e, working_dir)
+
                 print(e, flush=True)
-                print("Encountered error running variant {} {}. "
-                      "Attempts remaining: {}".format(pdb_basename, variant, num_attempts_per_variant - attempt - 1),
+                print("Encountered {} error running variant {} {}. "
+                      "Attempts remaining: {}".format(failure, pdb_basename, variant,
+                                                      num_attempts_per_variant - attempt - 1
+                                                      if failure == failures.TRANSIENT else 0),
                       flush=True)
 
                 # if we are supposed to save the working directory, save it now
                 # the run_single_variant() function doesn't take care of this when there's an exception
                 # todo: if we end up using variant-specific working dir, update here
-                if args.save_wd:
+                if args.save_wd and isdir(working_dir):
                     shutil.copytree(working_dir,
                                     join(log_dir, "wd_{}_{}_{}".format(basename(pdb_fn), variant, attempt)))
 
                 # clean up the working dir in preparation for next variant
-                shutil.rmtree(working_dir)
+                if isdir(working_dir):
+                    shutil.rmtree(working_dir)
+
+                if failure != failures.TRANSIENT:
+                    break
             else:
-                # successful variant run, so break out of the attempt loop
+                # successful variant run, so save the energies and break out of the attempt loop
+                results_writer.write(energize.insert_job_uuid(record, job_uuid))
+                failure = None
                 break
-        else:
-            # else clause of the for loop triggers if we burned through all attempts without success
-            # add this variant to a failed_variants.txt file and continue with the other variants
-            failed.append(pdb_variant)
+
+        if failure is not None:
+            # add this variant to failed.txt and continue with the other variants
+            failed.append((pdb_variant, failure))
+
+        num_consecutive_systemic = num_consecutive_systemic + 1 if failure == failures.SYSTEMIC else 0
+        if 0 < args.max_systemic_failures <= num_consecutive_systemic and i + 1 < len(pdbs_variants):
+            aborted = True
+            break
+
+    results_writer.close()
 
     # save a txt file with failed variants (if there are failed variants)
+    # each line is the variant followed by the failure class, e.g. "2qmt_p.pdb A23P,R67L timeout"
     if len(failed) > 0:
         with open(join(log_dir, "failed.txt"), "w") as f:
-            for fv in failed:
-                f.write("{}\n".format(fv))
-
-    # if any variants were successful, concat the outputs into a final energies.csv
-    if len(failed) < len(pdbs_variants):
-        # combine outputs in the staging directory into a single csv file
-        cdf = energize.combine_outputs(join(log_dir, "staging"))
-        # add additional column for job uuid
-        cdf.insert(2, "job_uuid", job_uuid)
-        # save in the main log directory
-        cdf.to_csv(join(log_dir, "energies.csv"), index=False)
+            for fv, failure in failed:
+                f.write("{} {}\n".format(fv, failure))
 
-    # compress outputs, delete the output staging directory, etc
-    shutil.rmtree(join(log_dir, "staging"))
+    if aborted:
+        # the remaining variants were not run. exit with failure code so the job goes on hold
+        print("Aborting after {} consecutive systemic failures, remaining variants were not run".format(
+            num_consecutive_systemic), flush=True)
+        sys.exit(1)
 
     if (len(failed) / len(pdbs_variants)) > args.allowable_failure_fraction:
         # too many variants failed in this job. exit with failure code.
@@ -419,6 +452,26 @@ if __name__ == "__main__":
                         default=1)
 
     # logging and output options
+    parser.add_argument("--timeout_factor",
+                        help="each rosetta step is killed if it runs longer than this multiple of the expected "
+                             "runtime of a variant (based on sequence length, times num_structs for the docking "
+                             "step), and the variant is recorded as a timeout in failed.txt without being retried. "
+                             "set to 0 to disable timeouts",
+                        type=float,
+                        default=10)
+
+    parser.add_argument("--min_step_timeout",
+                        help="minimum timeout in seconds for each rosetta step, see --timeout_factor",
+                        type=float,
+                        default=600)
+
+    parser.add_argument("--max_systemic_failures",
+                        help="abort the job after this many consecutive variants fail with systemic errors "
+                             "(problems with the machine or rosetta distribution, see failures.py). "
+                             "set to 0 to never abort",
+                        type=int,
+                        default=3)
+
     parser.add_argument("--save_wd",
                         help="set this flag to save the full working directory for each variant",
                         action="store_true")
@@ -0,0 +1,37 @@
+""" append-only journal of the variants processed by an energize job, used to resume jobs that get restarted """
+import json
+import os
+
+
+class VariantJournal:
+    """ each line of the journal is a json record for one variant: the "pdb_fn variant" line from the variants
+        file and its status ("success" or the failure class, see failures.py). the energies themselves are in energies.csv (see ResultsWriter).
+        every record is flushed and fsynced so the journal survives the job being evicted or killed """
+
+    def __init__(self, journal_fn):
+        self.journal_fn = journal_fn
+
+    def load(self):
+        """ load the latest record for each variant in the journal. returns a dictionary keyed by pdb_variant """
+        records = {}
+        if not os.path.isfile(self.journal_fn):
+            return records
+
+        with open(self.journal_fn, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the job was killed in the middle of writing this record (can only be the last line)
+                    continue
+                records[record["pdb_variant"]] = record
+
+        return records
+
+    def record(self, pdb_variant, status):
+        record = {"pdb_variant": pdb_variant, "status": status}
+
+        with open(self.journal_fn, "a") as f:
+            f.write("{}\n".format(json.dumps(record)))
+            f.flush()
+            os.fsync(f.fileno())
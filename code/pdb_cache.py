@@ -0,0 +1,102 @@
+""" on-disk cache of metadata parsed from PDB files (sequences and sequence lengths), so preparing runs for
+    thousands of structures doesn't parse every PDB file with Biopython every time.
+    results are stored by a hash of the PDB file's contents, so a PDB file that is moved, copied, or renamed
+    is still a cache hit, and a PDB file that is modified in place is parsed again. the hash of each path is
+    also stored with the file's size and modification time, so unchanged files aren't even read """
+import hashlib
+import json
+import os
+from os.path import abspath, isfile
+
+import utils
+from db_fingerprint import file_lock
+
+DEFAULT_CACHE_FN = "pdb_files/pdb_cache.json"
+
+
+def hash_file(fn):
+    hash_obj = hashlib.sha256()
+    with open(fn, "rb") as f:
+        for byte_block in iter(lambda: f.read(1 << 20), b""):
+            hash_obj.update(byte_block)
+    return hash_obj.hexdigest()
+
+
+class PDBCache:
+
+    def __init__(self, cache_fn=DEFAULT_CACHE_FN):
+        self.cache_fn = cache_fn
+        # path -> {"size", "mtime_ns", "hash"} and content hash -> {metadata key -> value}
+        self.paths, self.metadata = self.load_cache()
+        # entries computed since the cache was loaded, merged into the cache file when it is saved
+        self.new_paths = {}
+        self.new_metadata = {}
+
+    def load_cache(self):
+        if not isfile(self.cache_fn):
+            return {}, {}
+        try:
+            with open(self.cache_fn, "r") as f:
+                cache = json.load(f)
+            return cache["paths"], cache["metadata"]
+        except (ValueError, KeyError) as e:
+            print("Ignoring unreadable PDB cache {}: {}".format(self.cache_fn, e))
+            return {}, {}
+
+    def get_hash(self, pdb_fn):
+        """ the content hash of a PDB file, reusing the stored hash if its size and modification time match """
+        path = abspath(pdb_fn)
+        st = os.stat(path)
+        entry = self.paths.get(path)
+        if entry is None or entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+            entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "hash": hash_file(path)}
+            self.paths[path] = entry
+            self.new_paths[path] = entry
+        return entry["hash"]
+
+    def lookup(self, pdb_fn, key, compute):
+        """ the cached value of key for the PDB file, or compute(pdb_fn) if it's not in the cache.
+            the value must be json serializable """
+        pdb_hash = self.get_hash(pdb_fn)
+        if key not in self.metadata.get(pdb_hash, {}):
+            value = compute(pdb_fn)
+            self.metadata.setdefault(pdb_hash, {})[key] = value
+            self.new_metadata.setdefault(pdb_hash, {})[key] = value
+        return self.metadata[pdb_hash][key]
+
+    def get_seq(self, pdb_fn):
+        """ same as utils.get_seq_from_pdb """
+        return self.lookup(pdb_fn, "seq", utils.get_seq_from_pdb)
+
+    def get_seq_len(self, pdb_fn):
+        return len(self.get_seq(pdb_fn))
+
+    def extract_seq(self, pdb_fn, chain_id=None, error_on_multiple_chains=True):
+        """ same as utils.extract_seq_from_pdb. errors (e.g. multiple chains) aren't cached, so they are raised again """
+        key = "extract_seq:{}:{}".format(chain_id, error_on_multiple_chains)
+        return self.lookup(pdb_fn, key, lambda fn: utils.extract_seq_from_pdb(
+            fn, chain_id=chain_id, error_on_multiple_chains=error_on_multiple_chains))
+
+    def save(self):
+        """ merge the new entries into the cache file. the file is re-read and replaced while holding a lock
+            on a sidecar lock file, so processes sharing the cache don't drop each other's entries """
+        if len(self.new_paths) == 0 and len(self.new_metadata) == 0:
+            return
+
+        tmp_cache_fn = "{}.{}.tmp".format(self.cache_fn, os.getpid())
+        try:
+            with file_lock("{}.lock".format(self.cache_fn)):
+                paths, metadata = self.load_cache()
+                paths.update(self.new_paths)
+                for pdb_hash, values in self.new_metadata.items():
+                    metadata.setdefault(pdb_hash, {}).update(values)
+
+                with open(tmp_cache_fn, "w") as f:
+                    json.dump({"paths": paths, "metadata": metadata}, f)
+                os.replace(tmp_cache_fn, self.cache_fn)
+        except OSError as e:
+            # the cache is only an optimization, e.g. the pdb_files directory may be read-only
+            print("Unable to save the PDB cache {}: {}".format(self.cache_fn, e))
+            return
+        self.paths, self.metadata = paths, metadata
+        self.new_paths, self.new_metadata = {}, {}
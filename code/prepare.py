@@ -8,8 +8,7 @@ import subprocess
 import platform
 import time
 
-import pandas as pd
-
+import score_file
 from utils import save_argparse_args
 
 
@@ -134,16 +133,13 @@ def parse_scores(working_dir):
     """ get the filename of the lowest energy structure generated in the relax step """
     scores_fn = join(working_dir, "score.sc")
 
-    # load the scores.sc file into a pandas dataframe
-    df = pd.read_csv(scores_fn, delim_whitespace=True, skiprows=1)
-
     # get all structures with lowest energy (there may be multiple structures with same lowest energy)
-    lowest_energy_df = df[df.total_score == df.total_score.min()]
-    print("Found {} structures with lowest energy ({}).".format(len(lowest_energy_df),
-                                                                lowest_energy_df.iloc[0]["total_score"]), flush=True)
+    lowest_energy_records = score_file.lowest_energy_records(score_file.iter_score_records(scores_fn))
+    print("Found {} structures with lowest energy ({}).".format(len(lowest_energy_records),
+                                                                lowest_energy_records[0]["total_score"]), flush=True)
 
     # return the *first* structure with the lowest energy
-    return join(working_dir, lowest_energy_df.iloc[0]["description"] + ".pdb")
+    return join(working_dir, lowest_energy_records[0]["description"] + ".pdb")
 
 
 def get_output_dir(original_pdb_fn, out_dir_base):
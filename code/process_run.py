@@ -93,6 +93,18 @@ def runtimes_and_energies(energize_out_dir, out_dir):
         fig.savefig(join(out_dir, "run_time_{}.png".format(step_name)))
         plt.close(fig)
 
+    # peak memory of each rosetta step, for right-sizing request_memory in energize.sub
+    for rss_var in [col for col in energies.columns if col.endswith("_max_rss")]:
+        step_name = rss_var[:-len("_max_rss")]
+        fig, ax = plt.subplots(1)
+        sns.histplot(x=energies[rss_var] / 1024, ax=ax, bins=30)
+        ax.set(title="{} peak memory per variant (max={:.0f} MB)".format(step_name.title(),
+                                                                         energies[rss_var].max() / 1024),
+               xlabel="Peak memory (MB)", ylabel="Num variants")
+        fig.tight_layout()
+        fig.savefig(join(out_dir, "max_rss_{}.png".format(step_name)))
+        plt.close(fig)
+
     # runtimes by number of mutations?
     # print("Avg runtime: {:.2f} seconds".format(energies["run_time"].mean()))
 
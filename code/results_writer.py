@@ -0,0 +1,98 @@
+""" streaming writer for the energies.csv output of energize and docking jobs """
+import csv
+import os
+from os.path import isfile
+
+
+class ResultsWriter:
+    """ appends one record (a dictionary of column name -> value) per variant to a single csv file.
+        the file and its header are created with the first record, so a job where every variant fails
+        does not produce an energies.csv. every record is flushed and fsynced as soon as it is written,
+        so the file holds every finished variant even if the job is evicted or killed.
+        if the file already exists (a resumed job), new records are appended using its existing header.
+        a record may leave out columns of the header (they are left empty), but a record with columns that
+        are not in the header raises a ValueError """
+
+    def __init__(self, out_fn, fsync=True):
+        self.out_fn = out_fn
+        self.fsync = fsync
+        self.fieldnames = None
+        self.f = None
+        self.writer = None
+
+        if isfile(out_fn):
+            self._open_existing()
+
+    def _open_existing(self):
+        # the job may have been killed in the middle of writing a record, so drop any incomplete last line
+        with open(self.out_fn, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                start = max(0, pos - 4096)
+                f.seek(start)
+                newline_pos = f.read(pos - start).rfind(b"\n")
+                if newline_pos != -1:
+                    pos = start + newline_pos + 1
+                    break
+                pos = start
+            if pos != end:
+                f.truncate(pos)
+
+        with open(self.out_fn, "r", newline="") as f:
+            header = f.readline()
+        if header == "":
+            # nothing usable in the file, start over as if it didn't exist
+            os.remove(self.out_fn)
+            return
+
+        self.fieldnames = next(csv.reader([header]))
+        self.f = open(self.out_fn, "a", newline="")
+        self.writer = csv.DictWriter(self.f, fieldnames=self.fieldnames, restval="")
+
+    def written_keys(self, key_cols=("pdb_fn", "variant")):
+        """ the set of keys (space-delimited key_cols values, e.g. "2qmt_p.pdb A23P") already in the file """
+        keys = set()
+        if not isfile(self.out_fn):
+            return keys
+        with open(self.out_fn, "r", newline="") as f:
+            for row in csv.DictReader(f):
+                keys.add(" ".join(row[k] for k in key_cols))
+        return keys
+
+    def write(self, record):
+        if self.writer is None:
+            self.fieldnames = list(record.keys())
+            self.f = open(self.out_fn, "w", newline="")
+            self.writer = csv.DictWriter(self.f, fieldnames=self.fieldnames, restval="")
+            self.writer.writeheader()
+
+        extra_cols = [k for k in record.keys() if k not in self.fieldnames]
+        if len(extra_cols) > 0:
+            # the header was already written, so there is no place for new columns. raise instead of
+            # writing a record that silently lacks some of its energies
+            raise ValueError("record has columns not in the {} header: {}".format(self.out_fn, extra_cols))
+
+        self.writer.writerow(record)
+        self.f.flush()
+        if self.fsync:
+            os.fsync(self.f.fileno())
+
+    def save_parquet(self, out_fn):
+        """ save a columnar (parquet) copy of the records. requires pandas with pyarrow or fastparquet """
+        # imported here so pandas is only needed when the columnar copy is requested
+        import pandas as pd
+        if isfile(self.out_fn):
+            pd.read_csv(self.out_fn).to_parquet(out_fn, index=False)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,245 @@
+""" runtime model for predicting how long a variant takes to run, fit from the run times recorded in a database.
+    used by condor.gen_args to size jobs, in place of the fixed fit in utils.expected_runtime.
+    the model is linear in features of the sequence length, the number of mutations, and the amount of
+    rosetta work per variant set by the hyperparameters (relax_repeats * relax_nstruct for energize,
+    num_structs for docking). it is fit on most of the jobs in the database and checked on the rest,
+    comparing each held-out job's total predicted runtime to its total actual runtime, since that's
+    what determines whether jobs come out at the target length """
+import argparse
+import hashlib
+import json
+from os.path import join, isfile
+import sqlite3
+import time
+
+import numpy as np
+
+from utils import extract_seq_from_pdb
+
+# the job table hyperparameters that multiply the work per variant, and their defaults in each pipeline's script
+WORK_HPARAMS = {"energize": {"relax_repeats": 15, "relax_nstruct": 1},
+                "docking": {"num_structs": 1}}
+
+FEATURES = ["intercept", "seq_len", "seq_len_x_work", "num_mutations_x_work"]
+
+# predictions never go below this many seconds per variant
+MIN_RUNTIME = 1.0
+
+
+def variant_features(seq_len, num_mutations, work):
+    """ feature matrix for arrays (or scalars) of sequence lengths, numbers of mutations, and work multipliers """
+    seq_len, num_mutations, work = np.broadcast_arrays(np.asarray(seq_len, dtype=float),
+                                                       np.asarray(num_mutations, dtype=float),
+                                                       np.asarray(work, dtype=float))
+    return np.stack([np.ones_like(seq_len), seq_len, seq_len * work, num_mutations * work], axis=-1)
+
+
+def count_mutations(variant):
+    return 0 if variant == "_wt" else variant.count(",") + 1
+
+
+def is_validation_job(job_uuid, validation_frac):
+    """ deterministically assign a fraction of the jobs to the validation set, by hash of the job uuid """
+    return int(hashlib.md5(job_uuid.encode()).hexdigest()[:8], 16) < validation_frac * 16 ** 8
+
+
+def load_seq_lens(con, pdb_dir):
+    """ sequence length of each pdb file in the database, from the pdb_file table if it's there, otherwise
+        from the pdb file in pdb_dir. pdb files with multiple chains (e.g. the docking structures) count the
+        residues of every chain, since the whole complex is simulated. pdb files with neither are left out """
+    seq_lens = dict(con.execute("SELECT pdb_fn, seq_len FROM pdb_file WHERE seq_len IS NOT NULL").fetchall())
+    for (pdb_fn,) in con.execute("SELECT DISTINCT pdb_fn FROM variant"):
+        if pdb_fn not in seq_lens and isfile(join(pdb_dir, pdb_fn)):
+            try:
+                seq = extract_seq_from_pdb(join(pdb_dir, pdb_fn), error_on_missing_residue=False,
+                                           error_on_multiple_chains=False)
+            except ValueError as e:
+                print("Warning: leaving out {}, unable to get its sequence length: {}".format(pdb_fn, e))
+                continue
+            seq_lens[pdb_fn] = len(seq) if isinstance(seq, str) else sum(len(s) for s in seq.values())
+    return seq_lens
+
+
+class RuntimeModel:
+
+    def __init__(self, pipeline, coef, work=None, calibration=None, info=None):
+        if pipeline not in WORK_HPARAMS:
+            raise ValueError("unrecognized pipeline {}".format(pipeline))
+        self.pipeline = pipeline
+        self.coef = np.asarray(coef, dtype=float)
+        # the hyperparameters to predict for, defaults to the pipeline's defaults
+        self.work = self.work_from_hparams({} if work is None else work)
+        self.calibration = calibration
+        self.info = info
+
+    def work_from_hparams(self, hparams):
+        """ the work multiplier for a dictionary of hyperparameters, using defaults for the missing ones """
+        work = 1
+        for hp, default in WORK_HPARAMS[self.pipeline].items():
+            work *= hparams.get(hp, default)
+        return work
+
+    def set_hparams_from_args_file(self, args_fn):
+        """ use the hyperparameters in an argparse arguments file (e.g. energize_args/example.txt) """
+        with open(args_fn, "r") as f:
+            tokens = f.read().split()
+        hparams = {}
+        for hp in WORK_HPARAMS[self.pipeline]:
+            flag = "--{}".format(hp)
+            for i, token in enumerate(tokens):
+                if token == flag and i + 1 < len(tokens):
+                    hparams[hp] = int(tokens[i + 1])
+                elif token.startswith("{}=".format(flag)):
+                    hparams[hp] = int(token.split("=", 1)[1])
+        self.work = self.work_from_hparams(hparams)
+
+    def predict(self, seq_len, num_mutations=1, work=None):
+        """ predicted runtime in seconds per variant """
+        work = self.work if work is None else work
+        return np.maximum(MIN_RUNTIME, variant_features(seq_len, num_mutations, work) @ self.coef)
+
+    def save(self, out_fn):
+        model = {"pipeline": self.pipeline,
+                 "features": FEATURES,
+                 "coef": self.coef.tolist(),
+                 "calibration": self.calibration,
+                 "info": self.info}
+        with open(out_fn, "w") as f:
+            json.dump(model, f, indent=2)
+
+    @classmethod
+    def load(cls, model_fn):
+        with open(model_fn, "r") as f:
+            model = json.load(f)
+        if model["features"] != FEATURES:
+            raise ValueError("runtime model {} has features {}, expected {}".format(
+                model_fn, model["features"], FEATURES))
+        return cls(model["pipeline"], model["coef"], calibration=model["calibration"], info=model["info"])
+
+
+def fit_runtime_model(db_fn, pipeline="energize", pdb_dir="pdb_files/prepared_pdb_files",
+                      validation_frac=0.2, batch_size=100000):
+    """ fit a runtime model to the variant run times in the database. the rows are streamed and reduced to the
+        normal equations for least squares, plus per-job feature and runtime totals for the validation jobs """
+    if pipeline not in WORK_HPARAMS:
+        raise ValueError("unrecognized pipeline {}".format(pipeline))
+
+    con = sqlite3.connect("file:{}?mode=ro".format(db_fn), uri=True)
+    seq_lens = load_seq_lens(con, pdb_dir)
+
+    work_sql = " * ".join("job.hp_{}".format(hp) for hp in WORK_HPARAMS[pipeline])
+    not_null_sql = " AND ".join("job.hp_{} IS NOT NULL".format(hp) for hp in WORK_HPARAMS[pipeline])
+    cur = con.execute("SELECT variant.pdb_fn, variant.mutations, variant.job_uuid, variant.run_time, {} "
+                      "FROM variant JOIN job ON job.uuid = variant.job_uuid "
+                      "WHERE variant.run_time IS NOT NULL AND {}".format(work_sql, not_null_sql))
+
+    xtx = np.zeros((len(FEATURES), len(FEATURES)))
+    xty = np.zeros(len(FEATURES))
+    num_rows = 0
+    job_is_validation = {}
+    train_jobs = set()
+    # validation job uuid -> [feature totals, runtime total]
+    validation_jobs = {}
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+        rows = [row for row in rows if row[0] in seq_lens]
+        if len(rows) == 0:
+            continue
+
+        x = variant_features([seq_lens[row[0]] for row in rows],
+                             [count_mutations(row[1]) for row in rows],
+                             [row[4] for row in rows])
+        y = np.array([row[3] for row in rows], dtype=float)
+        for row in rows:
+            if row[2] not in job_is_validation:
+                job_is_validation[row[2]] = is_validation_job(row[2], validation_frac)
+        is_validation = np.array([job_is_validation[row[2]] for row in rows])
+
+        xtx += x[~is_validation].T @ x[~is_validation]
+        xty += x[~is_validation].T @ y[~is_validation]
+        num_rows += len(rows)
+        for i in np.flatnonzero(is_validation):
+            job = validation_jobs.setdefault(rows[i][2], [np.zeros(len(FEATURES)), 0.0])
+            job[0] += x[i]
+            job[1] += y[i]
+        train_jobs.update(row[2] for row, v in zip(rows, is_validation) if not v)
+    con.close()
+
+    if len(train_jobs) == 0:
+        raise ValueError("no variants with run times and hyperparameters to fit the runtime model to")
+
+    # lstsq instead of solve, because features are collinear if the training jobs all used the same hparams
+    coef = np.linalg.lstsq(xtx, xty, rcond=None)[0]
+
+    # with a linear model, a job's total predicted runtime is the model applied to the job's feature totals
+    calibration = None
+    if len(validation_jobs) > 0:
+        job_x = np.array([job[0] for job in validation_jobs.values()])
+        job_actual = np.array([job[1] for job in validation_jobs.values()])
+        job_predicted = np.maximum(MIN_RUNTIME, job_x @ coef)
+        ratios = job_actual / job_predicted
+        calibration = {"num_jobs": len(validation_jobs),
+                       "total_actual_over_predicted": float(job_actual.sum() / job_predicted.sum()),
+                       "median_actual_over_predicted": float(np.median(ratios)),
+                       "p10_actual_over_predicted": float(np.percentile(ratios, 10)),
+                       "p90_actual_over_predicted": float(np.percentile(ratios, 90)),
+                       "mean_abs_pct_error": float(np.mean(np.abs(job_actual - job_predicted) / job_actual) * 100)}
+
+    info = {"db_fn": db_fn,
+            "fit_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "num_rows": num_rows,
+            "num_train_jobs": len(train_jobs),
+            "num_validation_jobs": len(validation_jobs)}
+
+    return RuntimeModel(pipeline, coef, calibration=calibration, info=info)
+
+
+def print_calibration(model):
+    print("runtime model coefficients: {}".format(dict(zip(FEATURES, model.coef.round(4).tolist()))))
+    if model.calibration is None:
+        print("no validation jobs to calibrate the runtime model against")
+        return
+    print("calibration on {} held-out jobs (actual / predicted job runtime):".format(model.calibration["num_jobs"]))
+    for k, v in model.calibration.items():
+        if k != "num_jobs":
+            print("  {}: {:.3f}".format(k, v))
+
+
+def main(args):
+    model = fit_runtime_model(args.db_fn, args.pipeline, args.pdb_dir, args.validation_frac)
+    print_calibration(model)
+    model.save(args.out_fn)
+    print("Saved runtime model to {}".format(args.out_fn))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        fromfile_prefix_chars="@")
+
+    parser.add_argument("--db_fn",
+                        help="path to database file with the run times to fit the model to",
+                        type=str,
+                        default="variant_database/database.db")
+    parser.add_argument("--pipeline",
+                        help="which pipeline's run times to model",
+                        type=str,
+                        default="energize",
+                        choices=list(WORK_HPARAMS.keys()))
+    parser.add_argument("--pdb_dir",
+                        help="directory with the pdb files, for sequence lengths missing from the pdb_file table",
+                        type=str,
+                        default="pdb_files/prepared_pdb_files")
+    parser.add_argument("--validation_frac",
+                        help="fraction of jobs to hold out to check the calibration of the model",
+                        type=float,
+                        default=0.2)
+    parser.add_argument("--out_fn",
+                        help="output filename for the runtime model (json)",
+                        type=str,
+                        default="variant_database/runtime_model.json")
+
+    main(parser.parse_args())
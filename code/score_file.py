@@ -0,0 +1,151 @@
+""" reader for rosetta score files (score.sc) that parses the SCORE: lines directly, without pandas.
+    records are streamed one line at a time, so score files with thousands of structures are aggregated
+    without holding them all in memory """
+import math
+
+
+class ScoreFileError(ValueError):
+    # the score file has no usable structures, e.g. it's empty or rosetta was killed while writing it
+    pass
+
+
+def parse_value(token: str):
+    """ convert a score file token to an int or float, leaving non-numeric tokens as strings """
+    try:
+        return int(token)
+    except ValueError:
+        pass
+    try:
+        return float(token)
+    except ValueError:
+        return token
+
+
+def iter_score_records(score_sc_fn: str):
+    """ yield each structure in the score file as a dictionary of column name -> value. the "SCORE:" column is
+        dropped and the description column (the structure name) is left as a string """
+    columns = None
+    with open(score_sc_fn, "r") as f:
+        for line in f:
+            tokens = line.split()
+            if len(tokens) == 0 or tokens[0] != "SCORE:":
+                # the SEQUENCE: line, REMARK lines, etc
+                continue
+
+            # header lines end with the description column. rosetta writes a new header if it appends
+            # structures with different score terms to an existing score file
+            if tokens[-1] == "description":
+                columns = tokens[1:]
+                continue
+
+            if columns is None or len(tokens) - 1 != len(columns):
+                # no header yet or a truncated line (rosetta was killed while writing it)
+                continue
+
+            record = {col: parse_value(token) for col, token in zip(columns[:-1], tokens[1:-1])}
+            record[columns[-1]] = tokens[-1]
+            yield record
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not math.isnan(value)
+
+
+def lowest_energy_records(records, sort_col: str = "total_score"):
+    """ the records with the minimum value of sort_col (there may be ties), in score file order """
+    min_value = None
+    min_records = []
+    for record in records:
+        value = record.get(sort_col)
+        if not is_number(value):
+            continue
+        if min_value is None or value < min_value:
+            min_value = value
+            min_records = [record]
+        elif value == min_value:
+            min_records.append(record)
+    return min_records
+
+
+def average_records(records):
+    """ average each numeric column across records. missing values (nan) are skipped and columns with
+        non-numeric values are dropped. the averages are always floats """
+    sums = {}
+    counts = {}
+    non_numeric = set()
+    for record in records:
+        for col, value in record.items():
+            if isinstance(value, str):
+                non_numeric.add(col)
+                continue
+            if col not in sums:
+                sums[col] = 0.0
+                counts[col] = 0
+            if not math.isnan(value):
+                sums[col] += value
+                counts[col] += 1
+
+    return {col: (sums[col] / counts[col] if counts[col] > 0 else math.nan)
+            for col in sums if col not in non_numeric}
+
+
+def aggregate_score_records(records, agg_method: str = "avg", sort_col: str = "total_score"):
+    """ aggregate a stream of score records into a single record using one of the aggregation methods:
+        "avg" averages all structures, "min_energy_avg" averages the structure(s) with the minimum sort_col,
+        and "min_energy_first" selects the first structure with the minimum sort_col.
+        if there is only one structure, it is returned as-is """
+
+    if agg_method not in ["avg", "min_energy_avg", "min_energy_first"]:
+        raise ValueError("invalid aggregation method: {}".format(agg_method))
+
+    # the records are consumed in a single pass, so count them as they stream by and keep the first one
+    # for the single-structure special case
+    first_record = None
+    num_records = 0
+
+    def counted(rs):
+        nonlocal first_record, num_records
+        for r in rs:
+            if first_record is None:
+                first_record = r
+            num_records += 1
+            yield r
+
+    if agg_method == "avg":
+        aggregated = average_records(counted(records))
+    else:
+        min_records = lowest_energy_records(counted(records), sort_col)
+        if len(min_records) == 0:
+            aggregated = None
+        elif agg_method == "min_energy_avg":
+            # average just in case there are some structures with the same min score but different energies
+            aggregated = average_records(min_records)
+        else:
+            aggregated = min_records[0]
+
+    if num_records == 0:
+        raise ScoreFileError("no structures found in score file")
+
+    # special case: only 1 structure was generated, no need to aggregate
+    if num_records == 1:
+        return dict(first_record)
+
+    if aggregated is None:
+        raise ScoreFileError("no structures with a numeric {} in score file".format(sort_col))
+
+    return aggregated
+
+
+def parse_score_file(score_sc_fn: str,
+                     agg_method: str = "avg",
+                     sort_col: str = "total_score",
+                     drop_cols=("description",)):
+    """ parse a score file into a single record (dictionary of column name -> value), aggregating the
+        structures with agg_method (see aggregate_score_records) and dropping the columns in drop_cols.
+        raises ScoreFileError if the score file has no usable structures """
+    try:
+        record = aggregate_score_records(iter_score_records(score_sc_fn), agg_method, sort_col)
+    except ScoreFileError as e:
+        raise ScoreFileError("{}: {}".format(score_sc_fn, e))
+
+    return {col: value for col, value in record.items() if col not in drop_cols}
@@ -4,6 +4,45 @@ from os.path import join
 import shutil
 
 
+class TemplateCache:
+    """ per-job cache of a template directory. template files are read from disk once and kept in memory,
+        and files that are the same for every variant are hard linked into working directories """
+
+    def __init__(self, template_dir):
+        self.template_dir = template_dir
+        self.template_strs = {}
+
+    def read(self, template_fn):
+        """ the contents of a template file, loaded on first use """
+        if template_fn not in self.template_strs:
+            with open(join(self.template_dir, template_fn), "r") as f:
+                self.template_strs[template_fn] = f.read()
+        return self.template_strs[template_fn]
+
+    def link(self, template_fn, out_dir, out_fn=None):
+        """ place an unchanged template file in out_dir. rosetta only reads these files, so a hard link is
+            enough. falls back to copying if the file can't be linked (e.g. out_dir is on another filesystem) """
+        link_file(join(self.template_dir, template_fn), join(out_dir, template_fn if out_fn is None else out_fn))
+
+
+def link_file(src_fn, dst_fn):
+    try:
+        os.link(src_fn, dst_fn)
+    except OSError:
+        shutil.copyfile(src_fn, dst_fn)
+        shutil.copymode(src_fn, dst_fn)
+
+
+# one cache per template directory, shared by every variant that runs in this process
+template_caches = {}
+
+
+def get_template_cache(template_dir):
+    if template_dir not in template_caches:
+        template_caches[template_dir] = TemplateCache(template_dir)
+    return template_caches[template_dir]
+
+
 def gen_res_selector_str(variant, index_type="1-based"):
     """ generates the ResidueIndexSelector string Rosetta scripts """
     resnums = []
@@ -22,18 +61,25 @@ def gen_res_selector_str(variant, index_type="1-based"):
 
 def gen_relax_xml_str(template_dir, variant, relax_distance, relax_repeats):
     resnum_str = gen_res_selector_str(variant)
-    template_fn = "relax_template.xml"
 
     # load the template
-    template_fn = join(template_dir, template_fn)
-    with open(template_fn, "r") as f:
-        template_str = f.read()
+    template_str = get_template_cache(template_dir).read("relax_template.xml")
 
     # fill in the template
     formatted = template_str.format(resnums=resnum_str, relax_distance=relax_distance, relax_repeats=relax_repeats)
     return formatted
 
 
+def gen_fused_xml_str(template_dir, variant, relax_distance, relax_repeats):
+    """ the fused protocol runs mutate, relax, filter, and centroid in a single rosetta_scripts run """
+    resnum_str = gen_res_selector_str(variant)
+
+    template_str = get_template_cache(template_dir).read("fused_template.xml")
+
+    formatted = template_str.format(resnums=resnum_str, relax_distance=relax_distance, relax_repeats=relax_repeats)
+    return formatted
+
+
 def gen_resfile_str(template_dir, chain, variant, index_type="1-based"):
     """residue_number chain PIKAA replacement_AA"""
 
@@ -54,21 +100,28 @@ def gen_resfile_str(template_dir, chain, variant, index_type="1-based"):
     mutation_strs = "\n".join(mutation_strs)
 
     # load the templates
-    template_fn = join(template_dir, "mutation_template.resfile")
-    with open(template_fn, "r") as f:
-        template_str = f.read()
+    template_str = get_template_cache(template_dir).read("mutation_template.resfile")
 
     formatted_template = template_str.format(mutation_strs)
 
     return formatted_template
 
 
-def fill_templates(template_dir, chain, variant, relax_distance, relax_repeats, out_dir):
+def fill_templates(template_dir, chain, variant, relax_distance, relax_repeats, out_dir, fused=False):
+
+    # the fused protocol still reads the mutations from the resfile, but replaces the mutate and relax xml files
+    if fused:
+        fused_xml_str = gen_fused_xml_str(template_dir, variant, relax_distance, relax_repeats)
+        with open(join(out_dir, "fused.xml"), "w") as f:
+            f.write(fused_xml_str)
+
+        resfile_str = gen_resfile_str(template_dir, chain, variant)
+        with open(join(out_dir, "mutation.resfile"), "w") as f:
+            f.write(resfile_str)
+        return
 
-    # the mutate xml no longer has any argument that need to be filled in, so just copy the template
-    # todo: this could be done in prep_working_dir in energize.py instead, that's where other files
-    #   that are unchanged are copied from the template dir to the working dir
-    shutil.copy(join(template_dir, "mutate_template.xml"), join(out_dir, "mutate.xml"))
+    # the mutate xml no longer has any argument that need to be filled in, so just link the template
+    get_template_cache(template_dir).link("mutate_template.xml", out_dir, "mutate.xml")
 
     relax_xml_str = gen_relax_xml_str(template_dir, variant, relax_distance, relax_repeats)
     with open(join(out_dir, "relax.xml"), "w") as f:
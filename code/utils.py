@@ -1,11 +1,21 @@
 import platform
 import shutil
 from io import StringIO
+from os.path import join
 from typing import Optional
 
 from Bio import SeqIO, PDB
 from Bio.PDB.PDBParser import PDBParser
 
+try:
+    from Bio.PDB.Polypeptide import three_to_one
+except ImportError:
+    # three_to_one was removed in biopython 1.80
+    from Bio.PDB.Polypeptide import protein_letters_3to1
+
+    def three_to_one(resname):
+        return protein_letters_3to1[resname]
+
 
 def save_argparse_args(args_dict, out_fn):
     """ save argparse arguments out to a file """
@@ -46,6 +56,11 @@ def sort_variant_mutations(variants):
     return sorted_variants
 
 
+def expected_runtime(seq_len):
+    # estimate the total expected runtime for a variant with given seq len, in seconds
+    return (0.52 * seq_len) + 28.50
+
+
 def get_seq_from_pdb(pdb_fn):
     """ uses atom iterator method """
 
@@ -151,7 +166,7 @@ def extract_seq_from_pdb(pdb_fn: str,
                     seq.append("X")
                     last_residue_number += 1
 
-            seq.append(PDB.Polypeptide.three_to_one(res.get_resname()))
+            seq.append(three_to_one(res.get_resname()))
             last_residue_number = res.id[1]
 
         sequences.append("".join(seq))
@@ -163,6 +178,20 @@ def extract_seq_from_pdb(pdb_fn: str,
         return sequences[0]
 
 
+def chain_seq_getter(pdb_dir, chain):
+    """ a function that returns the sequence of the given chain of a pdb file in pdb_dir (by basename), cached.
+        used to expand range lines (see variant_space.expand_variant_lines) with the same sequence that
+        variants.py ranked the variants against, including for pdb files with multiple chains """
+    seqs = {}
+
+    def get_seq(pdb_basename):
+        if pdb_basename not in seqs:
+            seqs[pdb_basename] = extract_seq_from_pdb(join(pdb_dir, pdb_basename), chain_id=chain)
+        return seqs[pdb_basename]
+
+    return get_seq
+
+
 def get_tar_command():
     if platform.system() == "Darwin" and shutil.which("gtar"):
         print("Detected macOS. Using GNU tar (gtar) for macOS.")
@@ -0,0 +1,214 @@
+""" compact integer encoding for variants. each substitution is packed into a uint16 as position * 20 + aa,
+    where position is the 1-based sequence position and aa is the index of the new amino acid in AAS.
+    a variant is a fixed-width row of substitution codes in ascending order (which is sorted by position),
+    padded with PAD, so a list of variants is a 2D uint16 array that can be sorted, deduplicated,
+    and checked for membership with numpy instead of python strings.
+    the wild-type amino acid is not stored, decoding needs the sequence, and encoded variants of different
+    sequences can't be compared (e.g. A23P and G23P have the same code) """
+import itertools
+
+import numpy as np
+
+# same amino acid order as the chars in variants.py
+AAS = "ACDEFGHIKLMNPQRSTVWY"
+AA_IDXS = {aa: i for i, aa in enumerate(AAS)}
+
+# index of each amino acid by its code point (ascii), -1 for everything else
+AA_LOOKUP = np.full(128, -1, dtype=np.int64)
+AA_LOOKUP[[ord(aa) for aa in AAS]] = np.arange(len(AAS))
+
+# padding for variants with fewer substitutions than the array width (sorts after every substitution)
+PAD = np.uint16(0xFFFF)
+
+# positions must fit in a uint16 alongside the amino acid
+MAX_POSITION = (int(PAD) - 1) // len(AAS)
+
+# variant keys are packed into a uint64 up to this width, wider variants use a byte string (void) key
+PACKED_KEY_WIDTH = 4
+
+# the wild-type variant has no substitutions
+WT_VARIANT = "_wt"
+
+
+def encode_variants(variants, width=None):
+    """ encode a list of variant strings (e.g. "A23P,R67L") into a (num_variants, width) uint16 array.
+        the width defaults to the maximum number of substitutions in the list """
+    variants = list(variants)
+    variant_arr = np.array(variants, dtype=str)
+    is_wt = variant_arr == WT_VARIANT
+    num_muts = (code_points_of(variant_arr) == ord(",")).sum(axis=1) + 1
+    num_muts[is_wt] = 0
+
+    max_num_muts = int(num_muts.max()) if len(variants) > 0 else 0
+    if width is None:
+        width = max_num_muts
+    elif max_num_muts > width:
+        raise ValueError("variant with {} substitutions does not fit in width {}".format(max_num_muts, width))
+
+    # parse every substitution at once from the unicode code points of a fixed-width string array
+    # (wild-type amino acid, then the position digits, then the new amino acid)
+    flat_muts = ",".join(itertools.compress(variants, ~is_wt)).split(",") if num_muts.sum() > 0 else []
+    mut_arr = np.array(flat_muts, dtype=str)
+    code_points = code_points_of(mut_arr)
+    mut_lens = (code_points != 0).sum(axis=1)
+
+    positions = np.zeros(len(mut_arr), dtype=np.int64)
+    valid = mut_lens >= 3
+    for i in range(1, code_points.shape[1] - 1):
+        is_digit_col = i < mut_lens - 1
+        digits = code_points[:, i] - ord("0")
+        valid &= ~is_digit_col | ((digits >= 0) & (digits <= 9))
+        positions = np.where(is_digit_col, positions * 10 + digits, positions)
+    if not valid.all():
+        raise ValueError("invalid substitution: {}".format(flat_muts[int(np.argmin(valid))]))
+    if len(positions) > 0 and (positions.min() < 1 or positions.max() > MAX_POSITION):
+        raise ValueError("variant positions must be between 1 and {}".format(MAX_POSITION))
+
+    aas = AA_LOOKUP[np.minimum(code_points[np.arange(len(mut_arr)), mut_lens - 1], len(AA_LOOKUP) - 1)] \
+        if len(mut_arr) > 0 else np.empty(0, dtype=np.int64)
+    if (aas < 0).any():
+        raise ValueError("unrecognized amino acid: {}".format(flat_muts[int(np.argmin(aas))][-1]))
+
+    # scatter the substitution codes into their rows, then sort each row into canonical order
+    codes = np.full((len(variants), width), PAD, dtype=np.uint16)
+    rows = np.repeat(np.arange(len(variants)), num_muts)
+    cols = np.arange(len(flat_muts)) - np.repeat(np.cumsum(num_muts) - num_muts, num_muts)
+    codes[rows, cols] = positions * len(AAS) + aas
+    codes.sort(axis=1)
+    return codes
+
+
+def code_points_of(str_arr):
+    """ the unicode code points of a 1D string array as a (len, max string length) array, padded with 0 """
+    return str_arr.view(np.uint32).reshape(len(str_arr), str_arr.itemsize // 4).astype(np.int64)
+
+
+def decode_variants(codes, seq):
+    """ decode a (num_variants, width) array of substitution codes back into variant strings,
+        using seq for the wild-type amino acids """
+    codes = np.asarray(codes, dtype=np.uint16)
+
+    # format each distinct substitution once
+    unique_codes, inverse = np.unique(codes, return_inverse=True)
+    mut_strs = np.empty(len(unique_codes), dtype=object)
+    for i, code in enumerate(unique_codes.tolist()):
+        if code == PAD:
+            mut_strs[i] = ""
+        else:
+            pos, aa = divmod(code, len(AAS))
+            mut_strs[i] = "{}{}{}".format(seq[pos - 1], pos, AAS[aa])
+    muts = mut_strs[inverse.reshape(codes.shape)]
+
+    num_muts = num_mutations(codes)
+    variants = []
+    for row, n in zip(muts.tolist(), num_muts.tolist()):
+        # padding is always at the end of the row
+        variants.append(",".join(row[:n]) if n > 0 else WT_VARIANT)
+    return variants
+
+
+def wild_type_residues(variants):
+    """ a stand-in sequence for decode_variants with the wild-type residue at each position that is substituted in
+        the variant strings ("X" elsewhere), for variants of a sequence that isn't available (e.g. another pdb file) """
+    wt = {}
+    for variant in variants:
+        if variant != WT_VARIANT:
+            for mut in variant.split(","):
+                wt[int(mut[1:-1])] = mut[0]
+    return "".join(wt.get(pos, "X") for pos in range(1, max(wt, default=0) + 1))
+
+
+def num_mutations(codes):
+    """ the number of substitutions in each variant """
+    return (np.asarray(codes) != PAD).sum(axis=1)
+
+
+def pad_codes(codes, width):
+    """ widen a code array to the given width by adding padding columns """
+    codes = np.asarray(codes, dtype=np.uint16)
+    if codes.shape[1] > width:
+        raise ValueError("can't narrow codes of width {} to width {}".format(codes.shape[1], width))
+    if codes.shape[1] == width:
+        return codes
+    padded = np.full((codes.shape[0], width), PAD, dtype=np.uint16)
+    padded[:, :codes.shape[1]] = codes
+    return padded
+
+
+def variant_keys(codes):
+    """ a 1D array with one hashable, sortable key per variant, for use with np.unique, np.isin, np.searchsorted.
+        up to PACKED_KEY_WIDTH substitutions, keys are uint64s that sort in the same order as the rows.
+        keys are only comparable between code arrays of the same width """
+    codes = np.asarray(codes, dtype=np.uint16)
+    width = codes.shape[1]
+    if width <= PACKED_KEY_WIDTH:
+        keys = np.zeros(len(codes), dtype=np.uint64)
+        for i in range(PACKED_KEY_WIDTH):
+            col = codes[:, i] if i < width else np.full(len(codes), PAD, dtype=np.uint16)
+            keys = (keys << np.uint64(16)) | col.astype(np.uint64)
+        return keys
+    return np.ascontiguousarray(codes).view(np.dtype((np.void, codes.itemsize * width))).ravel()
+
+
+def keys_to_codes(keys, width):
+    """ the code array for variant keys of the given width (inverse of variant_keys) """
+    if width <= PACKED_KEY_WIDTH:
+        keys = np.asarray(keys, dtype=np.uint64)
+        codes = np.empty((len(keys), PACKED_KEY_WIDTH), dtype=np.uint16)
+        for i in range(PACKED_KEY_WIDTH):
+            shift = np.uint64(16 * (PACKED_KEY_WIDTH - 1 - i))
+            codes[:, i] = (keys >> shift) & np.uint64(0xFFFF)
+        return codes[:, :width]
+    return np.ascontiguousarray(keys).view(np.uint16).reshape(len(keys), width)
+
+
+def sorted_keys_contain(sorted_keys, keys):
+    """ boolean array of whether each key is in sorted_keys (sorted and unique, e.g. from np.unique).
+        uses binary search, so sorted_keys can be a memory-mapped array that is never fully read """
+    if len(sorted_keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    idxs = np.searchsorted(sorted_keys, keys)
+    idxs[idxs == len(sorted_keys)] = 0
+    return sorted_keys[idxs] == keys
+
+
+class EncodedVariantSet:
+    """ a set of variants stored as sorted, unique variant keys. uses about 8 bytes per variant
+        (up to PACKED_KEY_WIDTH substitutions) instead of a python string in a set """
+
+    def __init__(self, code_batches=()):
+        """ build the set from a list of encoded variant arrays, which may have different widths """
+        code_batches = [np.asarray(c, dtype=np.uint16) for c in code_batches]
+        self.width = max([PACKED_KEY_WIDTH] + [c.shape[1] for c in code_batches])
+        keys = [variant_keys(pad_codes(c, self.width)) for c in code_batches]
+        if len(keys) == 0:
+            keys = [variant_keys(np.empty((0, self.width), dtype=np.uint16))]
+        self.keys = np.unique(np.concatenate(keys))
+
+    @classmethod
+    def from_variants(cls, variants, chunk_size=1000000):
+        """ build the set from variant strings, encoded in chunks to bound the memory used by
+            the intermediate python objects """
+        variants = list(variants)
+        return cls([encode_variants(variants[i:i + chunk_size]) for i in range(0, len(variants), chunk_size)])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def contains_codes(self, codes):
+        """ boolean array of whether each encoded variant is in the set """
+        codes = np.asarray(codes, dtype=np.uint16)
+        result = np.zeros(len(codes), dtype=bool)
+        # variants with more substitutions than the set's width can't be in the set
+        fits = num_mutations(codes) <= self.width
+        if codes.shape[1] > self.width:
+            codes = codes[:, :self.width]
+        result[fits] = sorted_keys_contain(self.keys, variant_keys(pad_codes(codes[fits], self.width)))
+        return result
+
+    def contains(self, variants):
+        """ boolean array of whether each variant string is in the set """
+        return self.contains_codes(encode_variants(variants))
+
+    def __contains__(self, variant):
+        return bool(self.contains([variant])[0])
@@ -0,0 +1,218 @@
+""" persistent on-disk index of the variants in the database for each pdb file, so the "filter" and "sample"
+    database modes of variants.py don't have to load every variant from the database on every run.
+    the index for a (database, pdb file) is a sorted .npy array of encoded variant keys (see variant_encoding.py)
+    that is memory mapped and queried with binary search, plus an optional bloom filter that screens out most
+    variants that are not in the database before the binary search.
+    the index is updated incrementally with the variant table rows added since it was last updated (by rowid),
+    and rebuilt from scratch if rows it already covers were deleted or changed.
+    updates hold a lock on the index, so processes sharing a database wait for each other instead of racing """
+import json
+import os
+from os.path import join, isfile, basename
+import sqlite3
+
+import numpy as np
+
+from db_fingerprint import file_lock, file_stamp
+from variant_encoding import (EncodedVariantSet, PACKED_KEY_WIDTH, PAD, encode_variants, keys_to_codes, pad_codes,
+                              variant_keys)
+
+
+def get_index_dir(db_fn):
+    return "{}_index".format(db_fn)
+
+
+def get_index_fns(db_fn, pdb_fn):
+    """ the keys (.npy), bloom filter (.bloom.npy), and metadata (.json) filenames for the index of pdb_fn """
+    base_fn = join(get_index_dir(db_fn), basename(pdb_fn))
+    return "{}.npy".format(base_fn), "{}.bloom.npy".format(base_fn), "{}.json".format(base_fn)
+
+
+def get_lock_fn(db_fn, pdb_fn):
+    return "{}.lock".format(join(get_index_dir(db_fn), basename(pdb_fn)))
+
+
+def index_exists(db_fn, pdb_fn):
+    return isfile(get_index_fns(db_fn, pdb_fn)[2])
+
+
+def splitmix64(x):
+    """ vectorized splitmix64 hash of a uint64 array (wraps around on overflow, like the C version) """
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def bloom_bit_positions(keys, num_bits, num_hashes):
+    """ (num_hashes, len(keys)) bit positions for packed (uint64) keys, using double hashing """
+    h1 = splitmix64(keys)
+    h2 = splitmix64(h1) | np.uint64(1)
+    with np.errstate(over="ignore"):
+        return np.stack([(h1 + np.uint64(i) * h2) % np.uint64(num_bits) for i in range(num_hashes)])
+
+
+def build_bloom_filter(keys, bits_per_key):
+    """ a bloom filter (uint8 bit array) for packed keys. the last byte stores the number of hash functions """
+    # a whole number of bytes, so the number of bits can be recovered from the array length
+    num_bits = max(64, (int(len(keys) * bits_per_key) + 7) // 8 * 8)
+    num_hashes = max(1, int(round(bits_per_key * np.log(2))))
+    bits = np.zeros(num_bits // 8 + 1, dtype=np.uint8)
+    bits[-1] = num_hashes
+
+    # set the bits one chunk of keys at a time to bound the memory of the bit positions
+    chunk_size = 1000000
+    for i in range(0, len(keys), chunk_size):
+        positions = np.unique(bloom_bit_positions(np.asarray(keys[i:i + chunk_size]), num_bits, num_hashes))
+        byte_idxs = (positions >> np.uint64(3)).astype(np.int64)
+        masks = (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)).astype(np.uint8)
+        # positions are sorted, so OR together the masks for each byte with reduceat
+        starts = np.flatnonzero(np.r_[True, byte_idxs[1:] != byte_idxs[:-1]])
+        bits[byte_idxs[starts]] |= np.bitwise_or.reduceat(masks, starts)
+    return bits
+
+
+def bloom_filter_contains(bits, keys):
+    """ boolean array of whether each key may be in the bloom filter (no false negatives) """
+    num_hashes = int(bits[-1])
+    num_bits = (len(bits) - 1) * 8
+    result = np.ones(len(keys), dtype=bool)
+    for positions in bloom_bit_positions(keys, num_bits, num_hashes):
+        byte_idxs = (positions >> np.uint64(3)).astype(np.int64)
+        result &= (bits[byte_idxs] >> (positions & np.uint64(7)).astype(np.uint8)) & np.uint8(1) == 1
+    return result
+
+
+def save_npy(out_fn, arr):
+    # write to a temporary file and rename it, so readers never see a partial file
+    tmp_fn = "{}.{}.tmp.npy".format(out_fn[:-4], os.getpid())
+    np.save(tmp_fn, arr)
+    os.replace(tmp_fn, out_fn)
+
+
+def update_index(db_fn, pdb_fn, bloom_bits_per_key=None, batch_size=100000):
+    """ create or update the index for pdb_fn with the variant table rows added since the last update.
+        bloom_bits_per_key > 0 also builds a bloom filter with that many bits per variant
+        (only for variants with up to PACKED_KEY_WIDTH substitutions), 0 removes the bloom filter,
+        and None keeps the index's current setting """
+    os.makedirs(get_index_dir(db_fn), exist_ok=True)
+    with file_lock(get_lock_fn(db_fn, pdb_fn)):
+        update_index_files(db_fn, pdb_fn, bloom_bits_per_key, batch_size)
+
+
+def update_index_files(db_fn, pdb_fn, bloom_bits_per_key, batch_size=100000):
+    """ update_index, for callers holding the index lock """
+    keys_fn, bloom_fn, meta_fn = get_index_fns(db_fn, pdb_fn)
+
+    meta = None
+    if isfile(meta_fn):
+        with open(meta_fn, "r") as f:
+            meta = json.load(f)
+
+    if bloom_bits_per_key is None:
+        bloom_bits_per_key = 0 if meta is None else meta["bloom_bits_per_key"]
+
+    # nothing to do if the database file hasn't changed since the last update
+    stamp = file_stamp(db_fn)
+    if meta is not None and meta.get("stamp") == stamp and meta["bloom_bits_per_key"] == bloom_bits_per_key \
+            and isfile(keys_fn):
+        return
+
+    con = sqlite3.connect("file:{}?mode=ro".format(db_fn), uri=True)
+
+    # the index is stamped with the highest rowid it covers and the number of rows at or below it.
+    # if that number changed, rows were deleted (or replaced) since the last update, so start over
+    if meta is not None:
+        num_rows = con.execute("SELECT COUNT(*) FROM variant WHERE pdb_fn = ? AND rowid <= ?",
+                               (basename(pdb_fn), meta["max_rowid"])).fetchone()[0]
+        if num_rows != meta["num_rows"] or not isfile(keys_fn):
+            print("Database changed since the variant index for {} was built, rebuilding".format(basename(pdb_fn)))
+            meta = None
+
+    rebuild = meta is None
+    if rebuild:
+        meta = {"pdb_fn": basename(pdb_fn), "width": PACKED_KEY_WIDTH, "max_rowid": 0, "num_rows": 0,
+                "bloom_bits_per_key": 0}
+        keys = variant_keys(np.empty((0, PACKED_KEY_WIDTH), dtype=np.uint16))
+    else:
+        # memory mapped, the existing keys are only read if there is something to merge or a bloom filter to build
+        keys = np.load(keys_fn, mmap_mode="r")
+
+    # encode the new rows one batch at a time
+    cur = con.execute("SELECT rowid, mutations FROM variant WHERE pdb_fn = ? AND rowid > ? ORDER BY rowid",
+                      (basename(pdb_fn), meta["max_rowid"]))
+    code_batches = []
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+        code_batches.append(encode_variants([row[1] for row in rows]))
+        meta["max_rowid"] = rows[-1][0]
+        meta["num_rows"] += len(rows)
+    con.close()
+
+    if len(code_batches) > 0 or rebuild:
+        new_variants = EncodedVariantSet(code_batches)
+        if new_variants.width > meta["width"]:
+            # the new variants need wider keys, so re-key the existing variants
+            keys = variant_keys(pad_codes(keys_to_codes(keys, meta["width"]), new_variants.width))
+            meta["width"] = new_variants.width
+        new_keys = variant_keys(pad_codes(keys_to_codes(new_variants.keys, new_variants.width), meta["width"]))
+        keys = np.union1d(keys, new_keys)
+        save_npy(keys_fn, keys)
+        meta["bloom_bits_per_key"] = 0
+
+    if bloom_bits_per_key > 0 and meta["width"] <= PACKED_KEY_WIDTH and \
+            meta["bloom_bits_per_key"] != bloom_bits_per_key:
+        save_npy(bloom_fn, build_bloom_filter(keys, bloom_bits_per_key))
+        meta["bloom_bits_per_key"] = bloom_bits_per_key
+    elif bloom_bits_per_key == 0:
+        meta["bloom_bits_per_key"] = 0
+    if meta["bloom_bits_per_key"] == 0 and isfile(bloom_fn):
+        os.remove(bloom_fn)
+
+    meta["num_keys"] = len(keys)
+    meta["stamp"] = stamp
+    tmp_meta_fn = "{}.{}.tmp".format(meta_fn, os.getpid())
+    with open(tmp_meta_fn, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_meta_fn, meta_fn)
+
+
+class VariantIndex(EncodedVariantSet):
+    """ a read-only EncodedVariantSet backed by the memory-mapped index of a (database, pdb file) """
+
+    def __init__(self, db_fn, pdb_fn):
+        keys_fn, bloom_fn, meta_fn = get_index_fns(db_fn, pdb_fn)
+        with open(meta_fn, "r") as f:
+            meta = json.load(f)
+        self.width = meta["width"]
+        self.keys = np.load(keys_fn, mmap_mode="r")
+        self.bloom = np.load(bloom_fn) if meta["bloom_bits_per_key"] > 0 else None
+
+    def contains_codes(self, codes):
+        if self.bloom is None:
+            return super().contains_codes(codes)
+
+        codes = np.asarray(codes, dtype=np.uint16)
+        result = np.zeros(len(codes), dtype=bool)
+        # variants with more substitutions than the index's width can't be in the index
+        fits = np.flatnonzero((codes[:, self.width:] == PAD).all(axis=1))
+        keys = variant_keys(pad_codes(codes[fits][:, :self.width], self.width))
+        # only variants that pass the bloom filter need a binary search of the keys on disk
+        maybe = bloom_filter_contains(self.bloom, keys)
+        result[fits[maybe]] = super().contains_codes(keys_to_codes(keys[maybe], self.width))
+        return result
+
+
+def load_variant_index(db_fn, pdb_fn, bloom_bits_per_key=None):
+    """ update the index for pdb_fn with any new database rows, then open it """
+    print("Updating database variant index for pdb file: {}...".format(basename(pdb_fn)))
+    os.makedirs(get_index_dir(db_fn), exist_ok=True)
+    # open the index under the same lock, so its metadata and keys are from the same update
+    with file_lock(get_lock_fn(db_fn, pdb_fn)):
+        update_index_files(db_fn, pdb_fn, bloom_bits_per_key)
+        index = VariantIndex(db_fn, pdb_fn)
+    print("Database variant index has {} variants".format(len(index)))
+    return index
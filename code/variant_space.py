@@ -0,0 +1,257 @@
+""" the space of all variants of a sequence with a given number of substitutions, indexed by rank.
+    ranks follow the order of variants.gen_all_variants (position combinations in itertools.combinations order,
+    then new amino acids in itertools.product order), so a variant can be generated directly from its rank
+    without enumerating the variants before it, and random samples are drawn as distinct ranks """
+import math
+from typing import Sequence
+
+import numpy as np
+
+from variant_encoding import AAS
+
+
+class VariantSpace:
+
+    def __init__(self, seq: str, num_subs: int, chars: Sequence[str], seq_idxs: Sequence[int]):
+        self.seq = seq
+        self.num_subs = num_subs
+        self.seq_idxs = [int(i) for i in seq_idxs]
+
+        # the new amino acids at each position, in chars order
+        # every position needs the same number of options for ranks to be computed with simple arithmetic
+        # (same assumption as max_possible_variants), so the wild-type amino acid must be one of the chars
+        self.subs = []
+        for pos in self.seq_idxs:
+            if seq[pos] not in chars:
+                raise ValueError("wild-type amino acid {} at position {} is not one of the chars".format(
+                    seq[pos], pos + 1))
+            self.subs.append([c for c in chars if c != seq[pos]])
+
+        if num_subs < 1 or num_subs > len(self.seq_idxs):
+            raise ValueError("num_subs must be between 1 and the number of positions ({})".format(
+                len(self.seq_idxs)))
+
+        self.num_aa_combos = (len(chars) - 1) ** num_subs
+        self.num_pos_combos = math.comb(len(self.seq_idxs), num_subs)
+        self.size = self.num_pos_combos * self.num_aa_combos
+
+    def unrank_positions(self, rank: int):
+        """ the position combination (indices into seq_idxs) with the given lexicographic rank """
+        n = len(self.seq_idxs)
+        k = self.num_subs
+        combo = []
+        start = 0
+        for i in range(k, 0, -1):
+            # the number of combinations that start with element c (given the elements before it) is
+            # comb(n - c - 1, i - 1). skip whole blocks of combinations until the rank falls inside one.
+            # the block sizes shrink as c increases, so binary search for the first c where the
+            # cumulative count (comb(n - start, i) - comb(n - c - 1, i)) exceeds the rank
+            total = math.comb(n - start, i)
+            lo, hi = start, n - i
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if total - math.comb(n - mid - 1, i) > rank:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            rank -= total - math.comb(n - lo, i)
+            combo.append(lo)
+            start = lo + 1
+        return combo
+
+    def rank_positions(self, combo: Sequence[int]):
+        """ the lexicographic rank of a position combination (ascending indices into seq_idxs) """
+        n = len(self.seq_idxs)
+        k = len(combo)
+        rank = 0
+        start = 0
+        for j, c in enumerate(combo):
+            i = k - j
+            # all the combinations that start with an element before c
+            rank += math.comb(n - start, i) - math.comb(n - c, i)
+            start = c + 1
+        return rank
+
+    def unrank(self, rank: int):
+        """ the variant string with the given rank """
+        if rank < 0 or rank >= self.size:
+            raise ValueError("rank {} is out of range for a variant space of size {}".format(rank, self.size))
+
+        pos_rank, aa_rank = divmod(rank, self.num_aa_combos)
+        combo = self.unrank_positions(pos_rank)
+
+        # the amino acid rank is a base (len(chars) - 1) number, first position is the most significant digit
+        num_options = len(self.subs[0])
+        new_aas = []
+        for _ in range(self.num_subs):
+            aa_rank, digit = divmod(aa_rank, num_options)
+            new_aas.append(digit)
+        new_aas.reverse()
+
+        # note the pos+1 for 1-based indexing, mutations in sorted order by position
+        muts = sorted((self.seq_idxs[c], self.subs[c][a]) for c, a in zip(combo, new_aas))
+        return ",".join("{}{}{}".format(self.seq[pos], pos + 1, aa) for pos, aa in muts)
+
+    def rank(self, variant: str):
+        """ the rank of a variant string (inverse of unrank) """
+        idx_of_pos = {pos: i for i, pos in enumerate(self.seq_idxs)}
+        muts = []
+        for mut in variant.split(","):
+            pos = int(mut[1:-1]) - 1
+            if pos not in idx_of_pos or mut[0] != self.seq[pos] or mut[-1] not in self.subs[idx_of_pos[pos]]:
+                raise ValueError("variant {} is not in this variant space".format(variant))
+            muts.append((idx_of_pos[pos], self.subs[idx_of_pos[pos]].index(mut[-1])))
+        if len(muts) != self.num_subs or len(set(c for c, _ in muts)) != self.num_subs:
+            raise ValueError("variant {} is not in this variant space".format(variant))
+
+        # ranks are defined on the combination in seq_idxs order
+        muts.sort()
+        aa_rank = 0
+        for _, a in muts:
+            aa_rank = aa_rank * len(self.subs[0]) + a
+        return self.rank_positions([c for c, _ in muts]) * self.num_aa_combos + aa_rank
+
+    def sample(self, num_variants: int, rng: np.random.Generator):
+        """ a random sample of num_variants distinct variants, in random order """
+        return [self.unrank(r) for r in sample_ranks(self.size, num_variants, rng)]
+
+
+def random_below(n: int, rng: np.random.Generator):
+    """ a uniform random integer in [0, n), for n that may not fit in an int64 """
+    if n <= np.iinfo(np.int64).max:
+        return int(rng.integers(n))
+    # rejection sampling on random bits, accepts with probability > 1/2
+    num_bits = (n - 1).bit_length()
+    num_bytes = (num_bits + 7) // 8
+    while True:
+        r = int.from_bytes(rng.bytes(num_bytes), "little") >> (num_bytes * 8 - num_bits)
+        if r < n:
+            return r
+
+
+def sample_ranks(n: int, size: int, rng: np.random.Generator):
+    """ sample size distinct integers from [0, n) in random order, without enumerating [0, n) """
+    if size > n:
+        raise ValueError("can't sample {} distinct ranks from {}".format(size, n))
+
+    if n <= np.iinfo(np.int64).max:
+        # numpy uses a hash set (Floyd's algorithm) for small samples of large populations
+        # and a partial shuffle otherwise
+        return rng.choice(n, size, replace=False).tolist()
+
+    # Floyd's algorithm with python ints for spaces too large for numpy
+    # each draw is constant time, regardless of how close size is to n
+    selected = set()
+    ranks = []
+    for j in range(n - size, n):
+        t = random_below(j + 1, rng)
+        r = j if t in selected else t
+        selected.add(r)
+        ranks.append(r)
+    # Floyd's algorithm gives a uniform random subset but not a uniform random order
+    return [ranks[i] for i in rng.permutation(len(ranks))]
+
+
+# a line in a variants file can stand for a contiguous range of variant ranks instead of a single variant:
+#   "<pdb_fn> ranks=<num_subs>:<start>:<end>" or "<pdb_fn> ranks=<num_subs>:<start>:<end>:<seq_start>:<seq_end>"
+# ranks are in [start, end) of the VariantSpace for the pdb's sequence with the 20 standard amino acids (AAS).
+# the optional seq range restricts mutations to 0-based positions [seq_start, seq_end), like variants.py
+RANGE_PREFIX = "ranks="
+
+
+def is_range_line(line: str):
+    tokens = line.split()
+    return len(tokens) == 2 and tokens[1].startswith(RANGE_PREFIX)
+
+
+def format_range_line(pdb_fn: str, num_subs: int, start: int, end: int, seq_start=None, seq_end=None):
+    fields = [num_subs, start, end]
+    if seq_start is not None or seq_end is not None:
+        if seq_start is None or seq_end is None:
+            raise ValueError("both seq_start and seq_end must be specified")
+        fields += [seq_start, seq_end]
+    return "{} {}{}".format(pdb_fn, RANGE_PREFIX, ":".join(map(str, fields)))
+
+
+def parse_range_line(line: str):
+    """ parse a range line into a dictionary with the pdb_fn, num_subs, start, end, seq_start, and seq_end """
+    pdb_fn, spec = line.split()
+    fields = [int(f) for f in spec[len(RANGE_PREFIX):].split(":")]
+    if len(fields) not in (3, 5):
+        raise ValueError("invalid rank range line: {}".format(line))
+    num_subs, start, end = fields[:3]
+    seq_start, seq_end = fields[3:] if len(fields) == 5 else (None, None)
+    if start < 0 or end < start:
+        raise ValueError("invalid rank range line: {}".format(line))
+    return {"pdb_fn": pdb_fn, "num_subs": num_subs, "start": start, "end": end,
+            "seq_start": seq_start, "seq_end": seq_end}
+
+
+def num_line_variants(line: str):
+    """ the number of variants a line of a variants file stands for """
+    if is_range_line(line):
+        r = parse_range_line(line)
+        return r["end"] - r["start"]
+    return 1
+
+
+def range_line_space(line: str, seq: str):
+    """ the VariantSpace for a range line, given the sequence of its pdb file """
+    r = parse_range_line(line)
+    seq_start = 0 if r["seq_start"] is None else r["seq_start"]
+    seq_end = len(seq) if r["seq_end"] is None else r["seq_end"]
+    space = VariantSpace(seq, r["num_subs"], AAS, range(seq_start, seq_end))
+    if r["end"] > space.size:
+        raise ValueError("rank range line {} goes past the end of the variant space ({} variants)".format(
+            line, space.size))
+    return space
+
+
+def split_range_line(line: str, chunk_size: int):
+    """ split a range line into range lines of at most chunk_size variants """
+    r = parse_range_line(line)
+    for start in range(r["start"], r["end"], chunk_size):
+        yield format_range_line(r["pdb_fn"], r["num_subs"], start, min(start + chunk_size, r["end"]),
+                                r["seq_start"], r["seq_end"])
+
+
+def split_variant_lines(lines, chunk_size: int):
+    """ split the lines of a variants file into lists of lines with chunk_size variants each (the last list
+        may have fewer). range lines are split at chunk boundaries, so they are never expanded """
+    chunk = []
+    chunk_num_variants = 0
+    for line in lines:
+        if is_range_line(line):
+            r = parse_range_line(line)
+            start = r["start"]
+            while start < r["end"]:
+                end = min(r["end"], start + chunk_size - chunk_num_variants)
+                chunk.append(format_range_line(r["pdb_fn"], r["num_subs"], start, end, r["seq_start"], r["seq_end"]))
+                chunk_num_variants += end - start
+                start = end
+                if chunk_num_variants == chunk_size:
+                    yield chunk
+                    chunk = []
+                    chunk_num_variants = 0
+        else:
+            chunk.append(line)
+            chunk_num_variants += 1
+            if chunk_num_variants == chunk_size:
+                yield chunk
+                chunk = []
+                chunk_num_variants = 0
+    if len(chunk) > 0:
+        yield chunk
+
+
+def expand_variant_lines(lines, get_seq):
+    """ yield "pdb_fn variant" lines, expanding range lines into the variants they stand for.
+        get_seq(pdb_fn) returns the sequence of a pdb file (only called for range lines) """
+    for line in lines:
+        if is_range_line(line):
+            r = parse_range_line(line)
+            space = range_line_space(line, get_seq(r["pdb_fn"]))
+            for rank in range(r["start"], r["end"]):
+                yield "{} {}".format(r["pdb_fn"], space.unrank(rank))
+        else:
+            yield line
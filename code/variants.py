@@ -1,19 +1,20 @@
 """ generate variants from pdb files """
 import argparse
-import hashlib
 import itertools
+import json
 import math
+import os
 import time
 from os.path import join, basename, isfile
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import random
+import sqlite3
 from typing import Optional, Sequence, Union
 
-import pandas as pd
 from Bio.SeqIO.PdbIO import AtomIterator
 from Bio.PDB import PDBParser
 import numpy as np
-import sqlalchemy as sqla
 
 
 # silence warnings when reading PDB files generated from Rosetta (which have comments which aren't parsed by my
@@ -21,64 +22,74 @@ import sqlalchemy as sqla
 import warnings
 
 import utils
+from db_fingerprint import update_fingerprint
+from pdb_cache import PDBCache
+from variant_encoding import (AAS, PAD, EncodedVariantSet, decode_variants, encode_variants, keys_to_codes,
+                              num_mutations, sorted_keys_contain, variant_keys, wild_type_residues)
+from variant_index import load_variant_index, update_index
+from variant_space import VariantSpace, format_range_line, sample_ranks
 
 warnings.filterwarnings("ignore", message="Ignoring unrecognized record ")
 
 
-def gen_all_variants(base_seq, num_subs, chars, seq_idxs):
+def gen_all_variants(base_seq, num_subs, chars, seq_idxs, block_size=2 ** 20):
     """ generates all possible variants of base_seq with the given number of substitutions
-        using the given available chars and valid sequence idxs for substitution"""
-    # positions is a tuple of (pos(1), pos(2), ... pos(num_subs))
-    for positions in itertools.combinations(seq_idxs, num_subs):
-        # new_aas is a tuple of (aa(1), aa(2), ... aa(num_subs))
-        for new_aas in itertools.product(chars, repeat=num_subs):
-            if np.all([base_seq[pos] != new_aa for pos, new_aa in zip(positions, new_aas)]):
-                # note the pos+1 for 1-based indexing
-                variant = ",".join(["{}{}{}".format(base_seq[pos], pos+1, new_aa) for pos, new_aa in zip(positions, new_aas)])
-                # should be in sorted order already, but just in case, sort it here again
-                variant = utils.sort_variant_mutations(variant)
-                yield variant
+        using the given available chars and valid sequence idxs for substitution.
+        variants are generated in the order of itertools.combinations(seq_idxs) x itertools.product(chars),
+        but candidates are built and filtered as numpy index arrays, roughly block_size at a time,
+        and only the variants that are kept get formatted as strings """
 
+    seq_idxs = np.asarray(seq_idxs)
 
-def gen_sample(base_seq, num_mutants, num_subs, chars, seq_idxs, rng):
-    """ generates a random sample of variants with the given number of substitutions """
-
-    # using a set and a list to maintain the order
-    # this is slower and uses 2x the memory, but the final variant list will be orderd
-    mutants = set()
-    mutant_list = []
+    # the mutation string for every (seq_idxs index, char) pair, note the pos+1 for 1-based indexing,
+    # and whether that char is a substitution (differs from the wild-type amino acid)
+    mutations = np.array([["{}{}{}".format(base_seq[pos], pos + 1, c) for c in chars] for pos in seq_idxs],
+                         dtype=object)
+    is_sub = np.array([[base_seq[pos] != c for c in chars] for pos in seq_idxs], dtype=bool)
 
-    for mut_num in range(num_mutants):
+    # every combination of new chars for the num_subs positions, in itertools.product order
+    char_idxs = np.indices((len(chars),) * num_subs).reshape(num_subs, -1).T
 
-        found_valid_mutant = False
-        while not found_valid_mutant:
+    # position combinations are indices into seq_idxs, in itertools.combinations order
+    combos = itertools.combinations(range(len(seq_idxs)), num_subs)
+    combos_per_block = max(1, block_size // len(char_idxs))
+    while True:
+        block = np.fromiter(itertools.chain.from_iterable(itertools.islice(combos, combos_per_block)),
+                            dtype=np.int64).reshape(-1, num_subs)
+        if len(block) == 0:
+            break
 
-            # choose the positions to mutate and sort them in ascending order
-            positions = rng.choice(seq_idxs, num_subs, replace=False)
-            positions.sort()
+        # every candidate variant in this block as (positions, chars), then keep just the ones where
+        # all the chars are substitutions
+        shape = (len(block), len(char_idxs), num_subs)
+        pos_idxs = np.broadcast_to(block[:, None, :], shape)
+        new_idxs = np.broadcast_to(char_idxs[None, :, :], shape)
+        keep = is_sub[pos_idxs, new_idxs].all(axis=2)
+        pos_idxs = pos_idxs[keep]
+        new_idxs = new_idxs[keep]
 
-            # choose new amino acids for each of the selected positions
-            subs = []
-            for pos in positions:
-                base_aa = base_seq[pos]
-                new_aa = rng.choice([c for c in chars if c != base_aa])
-                # note the pos+1 for 1-based indexing
-                sub = "{}{}{}".format(base_aa, pos+1, new_aa)
-                subs.append(sub)
+        # put the mutations of each variant in sorted order by position (same as utils.sort_variant_mutations)
+        # they are already sorted if seq_idxs is sorted, but seq_idxs can be given in any order
+        order = np.argsort(seq_idxs[pos_idxs], axis=1, kind="stable")
+        muts = mutations[np.take_along_axis(pos_idxs, order, axis=1), np.take_along_axis(new_idxs, order, axis=1)]
 
-            # generate the mutant string
-            mutant = ",".join(subs)
+        variants = muts[:, 0]
+        for i in range(1, num_subs):
+            variants = variants + "," + muts[:, i]
+        yield from variants.tolist()
 
-            if mutant not in mutants:
-                found_valid_mutant = True
-                mutants.add(mutant)
-                mutant_list.append(mutant)
 
-    # this variant list should already be in sorted order (we sort the positions above)
-    # but just in case, sort it again here. we need variants in sorted order to avoid accidental dupes.
-    mutant_list = utils.sort_variant_mutations(mutant_list)
+def gen_sample(base_seq, num_mutants, num_subs, chars, seq_idxs, rng):
+    """ generates a random sample of variants with the given number of substitutions.
+        draws distinct ranks from the space of all variants and unranks them (see variant_space.py),
+        so there are no duplicates to reject and the cost per variant doesn't depend on the sample size """
+    space = VariantSpace(base_seq, num_subs, chars, seq_idxs)
+    if num_mutants > space.size:
+        raise ValueError("can't sample {} variants with {} substitutions, only {} are possible".format(
+            num_mutants, num_subs, space.size))
 
-    return mutant_list
+    # variants are generated with mutations in sorted order by position, to avoid accidental dupes
+    return space.sample(num_mutants, rng)
 
 
 def max_possible_variants(seq_len, num_subs, num_chars):
@@ -164,13 +175,6 @@ def single_pdb_local_variants(seq, target_num, num_subs_list, chars, seq_idxs, r
         if num_v == max_v:
             print("num_subs: {} num_v: {} max_v: {} approach: gen all".format(num_subs, num_v, max_v))
             variants += list(gen_all_variants(seq, num_subs, chars, seq_idxs))
-        elif num_v / max_v > 0.4:
-            print("num_subs: {} num_v: {} max_v: {} approach: gen all, then sample".format(num_subs, num_v, max_v))
-            # gen_sample could be slow if we are generating a sample approaching the max number of variants
-            # in that case it would be much faster to just generate all and select a sample from the pre-generated ones
-            all_variants = list(gen_all_variants(seq, num_subs, chars, seq_idxs))
-            # variants += random.sample(all_variants, num_v)
-            variants += rng.choice(all_variants, num_v, replace=False).tolist()
         else:
             print("num_subs: {} num_v: {} max_v: {} approach: sample".format(num_subs, num_v, max_v))
             variants += gen_sample(seq, num_v, num_subs, chars, seq_idxs, rng)
@@ -190,20 +194,142 @@ def get_subvariants(variant, num_subs):
     return sv
 
 
-def load_db_variants(db_fn: str, pdb_fn: str) -> set:
-    # todo: can this be sped up using connectorX?
+def load_db_variants(db_fn: str, pdb_fn: str, encoded: bool = False, batch_size: int = 100000):
+    """ load the distinct variants (mutations) in the database for the given pdb file.
+        rows are streamed from sqlite batch_size at a time, using the (pdb_fn, mutations, job_uuid)
+        primary key index, which covers the query and keeps the rows sorted for DISTINCT.
+        returns a set of variant strings or, if encoded is True, an EncodedVariantSet (see variant_encoding.py)
+        that is built one batch at a time without ever holding all the strings in memory """
     print("Loading existing database variants for pdb file: {}...".format(basename(pdb_fn)))
     start = time.time()
-    engine = sqla.create_engine('sqlite:///{}'.format(db_fn))
-    conn = engine.connect().execution_options(stream_results=True)
-    query = "SELECT mutations FROM variant WHERE `pdb_fn` == \"{}\"".format(basename(pdb_fn))
-    db = set(pd.read_sql_query(query, conn, coerce_float=False)["mutations"])
-    conn.close()
-    engine.dispose()
-    print("Loaded existing database variants in {}".format(time.time() - start))
+
+    # read-only, so loading variants can't lock the database or accidentally create an empty one
+    con = sqlite3.connect("file:{}?mode=ro".format(db_fn), uri=True)
+    cur = con.execute("SELECT DISTINCT mutations FROM variant WHERE pdb_fn = ?", (basename(pdb_fn),))
+    code_batches = []
+    db = set()
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+        variants = [row[0] for row in rows]
+        if encoded:
+            code_batches.append(encode_variants(variants))
+        else:
+            db.update(variants)
+    con.close()
+
+    if encoded:
+        db = EncodedVariantSet(code_batches)
+    print("Loaded {} existing database variants in {}".format(len(db), time.time() - start))
     return db
 
 
+class StringVariantSet:
+    """ variant strings behind the same membership interface as EncodedVariantSet, for database variants of a
+        different pdb file than the variants they are checked against. encoded variants leave out the wild-type
+        residue, so they'd match a substitution at the same position from a different wild-type residue.
+        codes are decoded with seq, the sequence of the variants being checked """
+
+    def __init__(self, variants, seq):
+        self.variants = set(variants)
+        self.seq = seq
+
+    def __len__(self):
+        return len(self.variants)
+
+    def contains(self, variants):
+        return np.array([v in self.variants for v in variants], dtype=bool)
+
+    def contains_codes(self, codes):
+        return self.contains(decode_variants(codes, self.seq))
+
+
+def load_db_variant_set(db_fn: str, pdb_fn: str, db_index: bool = True, db_index_bloom_bits: Optional[int] = None,
+                        seq: Optional[str] = None):
+    """ the database variants for pdb_fn as an EncodedVariantSet, queried from the persistent variant index
+        next to the database (see variant_index.py), or loaded from the database if db_index is False.
+        seq is given when the variants to check are of a different pdb file with sequence seq, in which case the
+        database variants are loaded as a StringVariantSet instead """
+    if seq is not None:
+        print("Database pdb file {} is not the pdb file the variants are for, "
+              "checking them against the database as strings".format(basename(pdb_fn)))
+        return StringVariantSet(load_db_variants(db_fn, pdb_fn), seq)
+
+    if db_index:
+        try:
+            return load_variant_index(db_fn, pdb_fn, db_index_bloom_bits)
+        except OSError as e:
+            # e.g. the database is in a read-only directory
+            print("Unable to use the database variant index ({}), loading variants from the database".format(e))
+    return load_db_variants(db_fn, pdb_fn, encoded=True)
+
+
+def subvariant_lattices(main_codes: np.ndarray, min_num_subs: int):
+    """ the encoded main variants followed by all of their subvariants with min_num_subs up to one less than
+        the number of substitutions in the main variants, as a (num_mains, lattice_size, num_subs) code array.
+        each main variant's lattice is in the same order as get_subvariants: the main variant, then its
+        subvariants from the most substitutions to the fewest, in combinations order """
+    main_codes = np.asarray(main_codes, dtype=np.uint16)
+    num_mains, num_subs = main_codes.shape
+    combos = [tuple(range(num_subs))]
+    for i in reversed(range(min_num_subs, num_subs)):
+        combos += list(itertools.combinations(range(num_subs), i))
+
+    # the main variant codes are in ascending order, so any subset of the columns is too
+    lattices = np.full((num_mains, len(combos), num_subs), PAD, dtype=np.uint16)
+    for j, combo in enumerate(combos):
+        lattices[:, j, :len(combo)] = main_codes[:, combo]
+    return lattices
+
+
+def collect_subvariant_lattices(main_batches, min_num_subs: int, target_num: int, keep=None):
+    """ add the subvariant lattices of batches of encoded main variants to a list of encoded variants, in order,
+        skipping variants that are already in the list and variants for which keep(codes) is False, until the list
+        has at least target_num variants. like the one-at-a-time version, it stops after the lattice that reaches
+        target_num, so the list can be a little longer. duplicates and skipped variants are counted, not printed """
+    selected = []
+    selected_keys = None
+    num_selected = 0
+    num_already_in_list = 0
+    num_not_kept = 0
+
+    for mains in main_batches:
+        lattices = subvariant_lattices(mains, min_num_subs)
+        num_mains, lattice_size, num_subs = lattices.shape
+        codes = lattices.reshape(num_mains * lattice_size, num_subs)
+        keys = variant_keys(codes)
+        if selected_keys is None:
+            selected_keys = keys[:0]
+
+        # a variant is new if this is its first occurrence in the batch and it isn't already in the list
+        is_first = np.zeros(len(keys), dtype=bool)
+        is_first[np.unique(keys, return_index=True)[1]] = True
+        is_new = is_first & ~sorted_keys_contain(selected_keys, keys)
+        is_kept = keep(codes) if keep is not None else np.ones(len(codes), dtype=bool)
+        is_added = is_new & is_kept
+
+        # stop after the main variant whose lattice reaches the target number of variants
+        cum_added = np.cumsum(is_added.reshape(num_mains, lattice_size).sum(axis=1))
+        done = cum_added[-1] >= target_num - num_selected
+        if done:
+            num_rows = (int(np.searchsorted(cum_added, target_num - num_selected)) + 1) * lattice_size
+            codes, keys, is_new, is_kept, is_added = \
+                codes[:num_rows], keys[:num_rows], is_new[:num_rows], is_kept[:num_rows], is_added[:num_rows]
+
+        num_already_in_list += int((~is_new).sum())
+        num_not_kept += int((~is_kept).sum())
+        selected.append(codes[is_added])
+        selected_keys = np.union1d(selected_keys, keys[is_added])
+        num_selected += int(is_added.sum())
+        if done:
+            break
+
+    if len(selected) == 0:
+        raise ValueError("no main variants to generate subvariants from")
+    return np.concatenate(selected), num_already_in_list, num_not_kept
+
+
 def gen_subvariants_vlist(seq: str,
                           target_num: int,
                           min_num_subs: int,
@@ -212,7 +338,11 @@ def gen_subvariants_vlist(seq: str,
                           seq_idxs: Sequence[int],
                           rng: np.random.Generator,
                           db_pdb_fn: str,
-                          db_fn: Optional[str] = None):
+                          db_fn: Optional[str] = None,
+                          db_index: bool = True,
+                          db_index_bloom_bits: Optional[int] = None,
+                          mains_per_batch: int = 10000,
+                          db_same_pdb: bool = True):
 
     # max_num_subs determines the maximum number of substitutions for the main variants
     # min_num_subs determines the minimum number of substitutions for subvariants
@@ -222,115 +352,85 @@ def gen_subvariants_vlist(seq: str,
     # If db_fn is specified, this function will check to see if the generated variants exists in the DB already,
     # and if so, it won't return them from this function. note it only some of the subvariants are in the db,
     # then this will still return the ones that aren't in the DB.
+    # db_same_pdb is False if db_pdb_fn is a different pdb file than the one with sequence seq
     db = None
     if db_fn is not None:
-        db = load_db_variants(db_fn, db_pdb_fn)
-
-    # using a set and a list to maintain the order
-    # this is slower and uses 2x the memory, but the final variant list will be ordered
-    variants_set = set()
-    variants_list = []
-
-    while len(variants_list) < target_num:
-        # generate a variant with max_num_subs substitutions
-        main_v = gen_sample(seq, num_mutants=1, num_subs=max_num_subs, chars=chars, seq_idxs=seq_idxs, rng=rng)[0]
-
-        # if the variant has already been generated, continue to next one
-        if main_v in variants_set:
-            continue
-
-        # now generate all subvariants for this variant
-        # generating subvariants for all number of substitutions down to single variants
-        av = [main_v]
-        for i in reversed(range(min_num_subs, max_num_subs)):
-            av += get_subvariants(main_v, i)
-
-        # now add this variant and all subvariants to the main list (as long as they are not already there)
-        for v in av:
-            # check if the variant is already in the set or already in the DB
-            variant_in_set = v in variants_set
-            if variant_in_set:
-                print("Generated variant already in set: {}".format(v))
-
-            variant_in_db = False
-            if db_fn is not None:
-                if v in db:
-                    variant_in_db = True
-                    print("Generated variant already in database: {}".format(v))
-
-            if not variant_in_set and not variant_in_db:
-                # only add variant to master list if it's not already in the set and it's not in the db
-                variants_set.add(v)
-                variants_list.append(v)
-
-    return variants_list
-
-
-def gen_subvariants_sample(db_fn: str,
+        db = load_db_variant_set(db_fn, db_pdb_fn, db_index, db_index_bloom_bits, None if db_same_pdb else seq)
+
+    space = VariantSpace(seq, max_num_subs, chars, seq_idxs)
+    lattice_size = sum(math.comb(max_num_subs, i) for i in range(min_num_subs, max_num_subs + 1))
+
+    def main_batches():
+        # random main variants with max_num_subs substitutions, a batch at a time, never repeating a main variant
+        # (its lattice would add nothing new). batches are sized to about what's needed to reach target_num
+        used_ranks = set()
+        while len(used_ranks) < space.size:
+            num_mains = min(mains_per_batch, space.size - len(used_ranks), -(-target_num // lattice_size))
+            ranks = [r for r in sample_ranks(space.size, num_mains, rng) if r not in used_ranks]
+            used_ranks.update(ranks)
+            if len(ranks) > 0:
+                yield encode_variants([space.unrank(r) for r in ranks], width=max_num_subs)
+        raise ValueError("not enough {}-variants to generate {} variants".format(max_num_subs, target_num))
+
+    # in filter mode, keep the variants that are NOT in the database
+    keep = (lambda codes: ~db.contains_codes(codes)) if db is not None else None
+    codes, num_already_in_list, num_in_db = collect_subvariant_lattices(main_batches(), min_num_subs, target_num, keep)
+
+    print("Skipped {} generated variants already in the list".format(num_already_in_list))
+    if db is not None:
+        print("Skipped {} generated variants already in the database".format(num_in_db))
+    return decode_variants(codes, seq)
+
+
+def gen_subvariants_sample(seq: str,
+                           db_fn: str,
                            db_pdb_fn: str,
                            target_num: int,
                            min_num_subs: int,
                            max_num_subs: int,
-                           rng: np.random.Generator):
+                           rng: np.random.Generator,
+                           db_index: bool = True,
+                           db_index_bloom_bits: Optional[int] = None,
+                           mains_per_batch: int = 10000,
+                           db_same_pdb: bool = True):
 
     """
     Generate a subvariants sample of an existing database...
     Will only include variants that exist in the given database,
     but will sample those variants using a subvariants approach
+    db_same_pdb is False if db_pdb_fn is a different pdb file than the one with sequence seq
     """
 
-    # load all the variants for the given pdb_fn from the database
-    db_variants_set = load_db_variants(db_fn, db_pdb_fn)
-    db_variants = list(db_variants_set)
-
-    df = pd.DataFrame({"variant": db_variants, "num_mutations": [len(v.split(",")) for v in db_variants]})
-
-    # iteratively sample variants with max_num_subs
-    df_max_subs = df[df["num_mutations"] == max_num_subs]
-
-    # using a set and a list to maintain the order
-    variants_set = set()
-    variants_list = []
-
-    # create the list of max_subs variants to sample from, basically just shuffle df_max_subs
-    df_max_subs = df_max_subs.sample(frac=1, random_state=rng.bit_generator).reset_index(drop=True)
-    main_v_index = 0
-
-    while len(variants_list) < target_num:
-
-        # sample the next variant from df_max_subs
-        if main_v_index > len(df_max_subs) - 1:
-            # there aren't enough df_max_subs variants to sample from to put together the target number of variants
-            raise ValueError("Not enough {}-variants to sample from".format(max_num_subs))
-
-        main_v = df_max_subs.iloc[main_v_index]["variant"]
-        main_v_index += 1
-
-        # generate all subvariants for this variant
-        av = [main_v]
-        for i in reversed(range(min_num_subs, max_num_subs)):
-            av += get_subvariants(main_v, i)
+    # the database variants for the given pdb_fn, in encoded form
+    if db_same_pdb:
+        db = load_db_variant_set(db_fn, db_pdb_fn, db_index, db_index_bloom_bits)
+    else:
+        # the sampled variants are all database variants of db_pdb_fn, so the encoded variants only need to be
+        # decoded with db_pdb_fn's wild-type residues, which are in the database variants themselves
+        db_variants = load_db_variants(db_fn, db_pdb_fn)
+        db = EncodedVariantSet.from_variants(db_variants)
+        seq = wild_type_residues(db_variants)
+        del db_variants
 
-        # add this variant and subvariants to the main list
-        # but first check to ensure they are not already in the list
-        # and also check to make sure they ARE in the database (because we are sampling the existing db)
-        # note the main_v is guaranteed to be in the database because that's where we sampled it from,
-        # but it's just easier to include it with all the subvariants
-        for v in av:
-            variant_in_set = v in variants_set
-            if variant_in_set:
-                print("Generated variant already in set: {}".format(v))
+    # shuffle the database variants with max_num_subs to use as the main variants
+    db_codes = keys_to_codes(db.keys, db.width)
+    main_codes = db_codes[num_mutations(db_codes) == max_num_subs][:, :max_num_subs]
+    main_codes = main_codes[rng.permutation(len(main_codes))]
 
-            variant_in_db = True
-            if v not in db_variants_set:
-                variant_in_db = False
-                print("Generated subvariant does NOT exist in database, skipping: {}".format(v))
+    def main_batches():
+        for i in range(0, len(main_codes), mains_per_batch):
+            yield main_codes[i:i + mains_per_batch]
+        # there aren't enough max_num_subs variants to sample from to put together the target number of variants
+        raise ValueError("Not enough {}-variants to sample from".format(max_num_subs))
 
-            if not variant_in_set and variant_in_db:
-                variants_set.add(v)
-                variants_list.append(v)
+    # the main variants are guaranteed to be in the database because that's where they were sampled from,
+    # but it's just easier to check them with all the subvariants
+    codes, num_already_in_list, num_not_in_db = collect_subvariant_lattices(main_batches(), min_num_subs, target_num,
+                                                                            db.contains_codes)
 
-    return variants_list
+    print("Skipped {} generated variants already in the list".format(num_already_in_list))
+    print("Skipped {} generated subvariants that do NOT exist in the database".format(num_not_in_db))
+    return decode_variants(codes, seq)
 
 
 def human_format(num):
@@ -366,6 +466,8 @@ def gen_random_main(pdb_fn, seq, seq_idxs, chars, target_num, num_subs_list, num
         for v in variants:
             f.write("{} {}\n".format(basename(pdb_fn), v))
 
+    return variant_summary(out_fn, len(variants), Counter([len(v.split(",")) for v in variants]))
+
 
 def gen_all_main(pdb_fn: str,
                  seq: str,
@@ -376,11 +478,24 @@ def gen_all_main(pdb_fn: str,
                  db_fn: Optional[str] = None,
                  db_mode: Optional[str] = None,
                  db_pdb_fn: Optional[str] = None,
-                 ignore_existing_out_file: bool = False):
+                 ignore_existing_out_file: bool = False,
+                 chunk_size: int = 100000,
+                 rank_ranges: bool = False,
+                 db_index: bool = True,
+                 db_index_bloom_bits: Optional[int] = None,
+                 db_hash: Optional[str] = None):
     """
     Generate all variants for a single PDB file
     db_mode: if 'filter', exclude variants that are in the given database
              if 'sample', only include variants that are in the given database
+    variants are enumerated, filtered, and written chunk_size at a time, so memory use is bounded by
+    the chunk size (plus the database variants, in 'filter' or 'sample' mode) rather than the number of variants
+    rank_ranges: instead of listing every variant, write one line per number of substitutions that stands for
+                 the whole range of variant ranks (see variant_space.py)
+    db_index: check variants against the persistent database variant index (see variant_index.py) instead of
+              loading the database variants, with a bloom filter of db_index_bloom_bits bits per variant
+              (see variant_index.update_index)
+    db_hash: the database fingerprint for the output filename, if it was already computed (see hash_db)
     """
 
     if (db_mode is None) ^ (db_fn is None):
@@ -390,13 +505,17 @@ def gen_all_main(pdb_fn: str,
     if db_mode not in [None, "filter", "sample"]:
         raise ValueError("db_mode must be None, 'filter' or 'sample'")
 
+    if rank_ranges and db_mode is not None:
+        raise ValueError("rank_ranges can't be used with a db_mode, filtered variants are not a range of ranks")
+
     # if db_pdb_fn is None, set it equal to pdb_fn
     # note db_pdb_fn will only be used if db_mode is "filter" or "sample"
     if db_pdb_fn is None:
         db_pdb_fn = pdb_fn
 
     # if db_fn is specified, we need to have a hash of the database in the filename
-    db_hash = hash_db(db_fn)
+    if db_hash is None:
+        db_hash = hash_db(db_fn)
 
     # determine the output filename
     if db_mode == "sample":
@@ -411,6 +530,9 @@ def gen_all_main(pdb_fn: str,
                                                              ",".join(map(str, num_subs_list)),
                                                              db_hash,
                                                              basename(db_pdb_fn)[:-4])
+    elif rank_ranges:
+        # no database specified, rank ranges for all variants
+        out_fn = "{}_all_NS-{}_ranks.txt".format(basename(pdb_fn)[:-4], ",".join(map(str, num_subs_list)))
     else:
         # no database specified, just generate all variants
         out_fn = "{}_all_NS-{}.txt".format(basename(pdb_fn)[:-4], ",".join(map(str, num_subs_list)))
@@ -433,39 +555,77 @@ def gen_all_main(pdb_fn: str,
         mp = max_possible_variants(len(seq_idxs), i, len(chars))
         print("Generating {} {}-mutation variants".format(mp, i))
 
-    variants = []
-    for i in num_subs_list:
-        variants += list(gen_all_variants(seq, i, chars, seq_idxs))
-
-    if db_mode == "sample":
-        # database sample mode, only include variants that are in the database
-        db_variants = load_db_variants(db_fn, db_pdb_fn)
-        variants = [v for v in variants if v in db_variants]
-
-    # database filter mode, exclude any variants that are in the database
-    elif db_mode == "filter":
-        # filter out variants already in the database if one is provided
-        db_variants = load_db_variants(db_fn, db_pdb_fn)
-        variants = [v for v in variants if v not in db_variants]
-
-    print_variant_info(variants)
-
+    if rank_ranges:
+        count = gen_all_ranks(pdb_fn, seq, seq_idxs, chars, num_subs_list, out_fn)
+        return variant_summary(out_fn, sum(count.values()), count)
+
+    variants = itertools.chain.from_iterable(gen_all_variants(seq, i, chars, seq_idxs) for i in num_subs_list)
+
+    # the database variants are held in encoded form (see variant_encoding.py), which is much smaller
+    # than a set of strings, and each chunk is checked against them at once
+    db_variants = None
+    if db_mode is not None:
+        db_variants = load_db_variant_set(db_fn, db_pdb_fn, db_index, db_index_bloom_bits,
+                                          None if basename(db_pdb_fn) == basename(pdb_fn) else seq)
+
+    # write to a temporary file and rename it when done, so an interrupted run doesn't leave behind
+    # a partial variant list that looks complete
+    tmp_out_fn = "{}.tmp".format(out_fn)
+    num_variants = 0
+    count = Counter()
+    with open(tmp_out_fn, "w") as f:
+        while True:
+            chunk = list(itertools.islice(variants, chunk_size))
+            if len(chunk) == 0:
+                break
+
+            if db_mode == "sample":
+                # database sample mode, only include variants that are in the database
+                chunk = list(itertools.compress(chunk, db_variants.contains(chunk)))
+            elif db_mode == "filter":
+                # database filter mode, exclude any variants that are in the database
+                chunk = list(itertools.compress(chunk, ~db_variants.contains(chunk)))
+            f.writelines(["{} {}\n".format(basename(pdb_fn), v) for v in chunk])
+            num_variants += len(chunk)
+            count.update(v.count(",") + 1 for v in chunk)
+    os.replace(tmp_out_fn, out_fn)
+
+    print_variant_counts(num_variants, count)
+    return variant_summary(out_fn, num_variants, count)
+
+
+def gen_all_ranks(pdb_fn, seq, seq_idxs, chars, num_subs_list, out_fn):
+    """ write rank range lines covering all variants for each number of substitutions """
+    if list(chars) != list(AAS):
+        raise ValueError("rank ranges are only defined for the standard amino acids: {}".format(AAS))
+
+    # range lines describe the positions as a contiguous range of the sequence
+    seq_idxs = np.asarray(seq_idxs)
+    if len(seq_idxs) == 0 or not np.array_equal(seq_idxs, np.arange(seq_idxs[0], seq_idxs[-1] + 1)):
+        raise ValueError("rank ranges require a contiguous range of sequence positions")
+    seq_start, seq_end = int(seq_idxs[0]), int(seq_idxs[-1]) + 1
+    if seq_start == 0 and seq_end == len(seq):
+        seq_start, seq_end = None, None
+
+    count = Counter()
     with open(out_fn, "w") as f:
-        for v in variants:
-            f.write("{} {}\n".format(basename(pdb_fn), v))
+        for num_subs in num_subs_list:
+            space = VariantSpace(seq, num_subs, chars, seq_idxs)
+            print("{}-mutants: {}".format(num_subs, space.size))
+            f.write("{}\n".format(format_range_line(basename(pdb_fn), num_subs, 0, space.size, seq_start, seq_end)))
+            count[num_subs] += space.size
+    return count
 
 
 def hash_db(db_fn):
+    """ fingerprint of the database variants for output filenames (see db_fingerprint.py), which is
+        cached next to the database instead of hashing the whole database file on every run """
     db_hash = 0
     if db_fn is not None:
-        print("Hashing database...")
+        print("Fingerprinting database...")
         start = time.time()
-        hash_obj = hashlib.shake_128()
-        with open(db_fn, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                hash_obj.update(byte_block)
-        db_hash = hash_obj.hexdigest(4)
-        print("Hashing database finished in {}".format(time.time() - start))
+        db_hash = update_fingerprint(db_fn)
+        print("Fingerprinting database finished in {}".format(time.time() - start))
     return db_hash
 
 
@@ -480,7 +640,10 @@ def gen_subvariants_main(pdb_fn: str,
                          out_dir: str,
                          db_fn: Optional[str] = None,
                          db_mode: Optional[str] = None,
-                         db_pdb_fn: Optional[str] = None):
+                         db_pdb_fn: Optional[str] = None,
+                         db_index: bool = True,
+                         db_index_bloom_bits: Optional[int] = None,
+                         db_hash: Optional[str] = None):
 
     if (db_mode is None) ^ (db_fn is None):
         raise ValueError("Both db_fn and db_mode should be specified or left as None")
@@ -494,7 +657,8 @@ def gen_subvariants_main(pdb_fn: str,
         db_pdb_fn = pdb_fn
 
     # if db_fn is specified, we need to have a hash of the database in the filename
-    db_hash = hash_db(db_fn)
+    if db_hash is None:
+        db_hash = hash_db(db_fn)
 
     # determine the output filename
     # todo: hard for the filename can't communicate all the provenance...maybe have additional metadata file?
@@ -524,10 +688,14 @@ def gen_subvariants_main(pdb_fn: str,
         # just a type hint because if db_mode is "sample" then the error checking ensures db_fn is str
         db_fn: str
         # sampling needs a special function that selects the main variant from the database
-        variants = gen_subvariants_sample(db_fn, db_pdb_fn, target_num, min_num_subs, max_num_subs, rng)
+        variants = gen_subvariants_sample(seq, db_fn, db_pdb_fn, target_num, min_num_subs, max_num_subs, rng,
+                                          db_index, db_index_bloom_bits,
+                                          db_same_pdb=basename(db_pdb_fn) == basename(pdb_fn))
     elif db_mode == "filter" or db_mode is None:
         # this can handle db_fn being None or db_mode being "filter"
-        variants = gen_subvariants_vlist(seq, target_num, min_num_subs, max_num_subs, chars, seq_idxs, rng, db_pdb_fn, db_fn)
+        variants = gen_subvariants_vlist(seq, target_num, min_num_subs, max_num_subs, chars, seq_idxs, rng, db_pdb_fn, db_fn,
+                                         db_index, db_index_bloom_bits,
+                                         db_same_pdb=basename(db_pdb_fn) == basename(pdb_fn))
     else:
         raise ValueError("db_mode must be None, 'filter' or 'sample'")
 
@@ -538,11 +706,24 @@ def gen_subvariants_main(pdb_fn: str,
         for v in variants:
             f.write("{} {}\n".format(basename(pdb_fn), v))
 
+    return variant_summary(out_fn, len(variants), Counter([len(v.split(",")) for v in variants]))
+
 
 def print_variant_info(variants):
     # print out info about the generated variants
-    print("Generated {} variants".format(len(variants)))
-    count = Counter([len(v.split(",")) for v in variants])
+    print_variant_counts(len(variants), Counter([len(v.split(",")) for v in variants]))
+
+
+def variant_summary(out_fn, num_variants, count):
+    """ what each *_main function generated, for the multi-PDB manifest """
+    return {"out_fn": out_fn,
+            "num_variants": num_variants,
+            "num_mutations": {str(k): v for k, v in sorted(count.items())}}
+
+
+def print_variant_counts(num_variants, count):
+    # count is a Counter of number of mutations -> number of variants
+    print("Generated {} variants".format(num_variants))
     for k, v in count.items():
         print("{}-mutants: {}".format(k, v))
 
@@ -564,49 +745,127 @@ def get_seq_idxs(seq: str,
     return seq_idxs
 
 
+def gen_pdb_main(args, pdb_fn: str, seq: str, seed: int, chars: list[str], db_hash: Optional[str] = None):
+    """ generate the variant list for one PDB file (with sequence seq) with the given seed, returns a summary
+        for the manifest. db_hash is the database fingerprint, if it was already computed """
+    print("Generating variant list for {}".format(pdb_fn))
+    seq_idxs = get_seq_idxs(seq, args.seq_idxs_range_start, args.seq_idxs_range_end)
+
+    if args.method == "subvariants":
+        summary = gen_subvariants_main(pdb_fn=pdb_fn,
+                                       seq=seq,
+                                       seq_idxs=seq_idxs,
+                                       chars=chars,
+                                       target_num=args.target_num,
+                                       max_num_subs=args.max_num_subs,
+                                       min_num_subs=args.min_num_subs,
+                                       seed=seed,
+                                       out_dir=args.out_dir,
+                                       db_fn=args.db_fn,
+                                       db_mode=args.db_mode,
+                                       db_pdb_fn=args.db_pdb_fn,
+                                       db_index=not args.no_db_index,
+                                       db_index_bloom_bits=args.db_index_bloom_bits,
+                                       db_hash=db_hash)
+
+    elif args.method == "random":
+        summary = gen_random_main(pdb_fn, seq, seq_idxs, chars,
+                                  args.target_num, args.num_subs_list, args.num_replicates, seed, args.out_dir)
+
+    elif args.method == "all":
+        summary = gen_all_main(pdb_fn=pdb_fn,
+                               seq=seq,
+                               seq_idxs=seq_idxs,
+                               chars=chars,
+                               num_subs_list=args.num_subs_list,
+                               out_dir=args.out_dir,
+                               db_fn=args.db_fn,
+                               db_mode=args.db_mode,
+                               db_pdb_fn=args.db_pdb_fn,
+                               ignore_existing_out_file=args.ignore_existing_out_file,
+                               chunk_size=args.chunk_size,
+                               rank_ranges=args.rank_ranges,
+                               db_index=not args.no_db_index,
+                               db_index_bloom_bits=args.db_index_bloom_bits,
+                               db_hash=db_hash)
+
+    else:
+        raise ValueError("unrecognized method {}".format(args.method))
+
+    return dict(pdb_fn=pdb_fn, seed=seed, **summary)
+
+
+def get_pdb_seeds(seed: int, num_pdbs: int):
+    """ a seed for each PDB file. a single PDB file uses the given seed as is. multiple PDB files each get an
+        independent seed spawned from it with numpy's SeedSequence, so they don't all sample with the same
+        random stream, and each PDB file's variants are the same no matter how many workers generate them """
+    if num_pdbs == 1:
+        return [seed]
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(num_pdbs)]
+
+
+def save_manifest(args, seed: int, summaries: list[dict]):
+    """ save a manifest of the variant lists generated for multiple PDB files """
+    manifest = {"method": args.method,
+                "seed": seed,
+                "num_variants": sum(s["num_variants"] for s in summaries),
+                "pdbs": summaries}
+    manifest_fn = join(args.out_dir, "manifest_{}_RS-{}_{}.json".format(
+        args.method, seed, time.strftime("%Y-%m-%d_%H-%M-%S")))
+    with open(manifest_fn, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print("Saved manifest to {}".format(manifest_fn))
+
+
 def main(args):
 
     chars = ["A", "C", "D", "E", "F", "G", "H", "I", "K", "L", "M", "N", "P", "Q", "R", "S", "T", "V", "W", "Y"]
 
-    for pdb_fn in args.pdb_fn:
-        print("Generating variant list for {}".format(pdb_fn))
-        seq = utils.extract_seq_from_pdb(pdb_fn, chain_id=args.chain_id, error_on_multiple_chains=True)
-        seq_idxs = get_seq_idxs(seq, args.seq_idxs_range_start, args.seq_idxs_range_end)
-
-        # grab a random, random seed
-        seed = args.seed
-        if seed is None:
-            seed = random.randint(100000000, 999999999)
-
-        if args.method == "subvariants":
-            gen_subvariants_main(pdb_fn=pdb_fn,
-                                 seq=seq,
-                                 seq_idxs=seq_idxs,
-                                 chars=chars,
-                                 target_num=args.target_num,
-                                 max_num_subs=args.max_num_subs,
-                                 min_num_subs=args.min_num_subs,
-                                 seed=seed,
-                                 out_dir=args.out_dir,
-                                 db_fn=args.db_fn,
-                                 db_mode=args.db_mode,
-                                 db_pdb_fn=args.db_pdb_fn)
-
-        elif args.method == "random":
-            gen_random_main(pdb_fn, seq, seq_idxs, chars,
-                            args.target_num, args.num_subs_list, args.num_replicates, seed, args.out_dir)
-
-        elif args.method == "all":
-            gen_all_main(pdb_fn=pdb_fn,
-                         seq=seq,
-                         seq_idxs=seq_idxs,
-                         chars=chars,
-                         num_subs_list=args.num_subs_list,
-                         out_dir=args.out_dir,
-                         db_fn=args.db_fn,
-                         db_mode=args.db_mode,
-                         db_pdb_fn=args.db_pdb_fn,
-                         ignore_existing_out_file=args.ignore_existing_out_file)
+    # grab a random, random seed
+    seed = args.seed
+    if seed is None:
+        seed = random.randint(100000000, 999999999)
+    pdb_seeds = get_pdb_seeds(seed, len(args.pdb_fn))
+
+    # parse the sequences here with a single PDB cache, so the cache file is read and saved once
+    pdb_cache = PDBCache()
+    seqs = [pdb_cache.extract_seq(pdb_fn, chain_id=args.chain_id, error_on_multiple_chains=True)
+            for pdb_fn in args.pdb_fn]
+    pdb_cache.save()
+
+    if args.workers <= 1:
+        summaries = [gen_pdb_main(args, pdb_fn, seq, pdb_seed, chars)
+                     for pdb_fn, seq, pdb_seed in zip(args.pdb_fn, seqs, pdb_seeds)]
+    else:
+        # bring the database fingerprint and the shared variant index up to date once, here, so the workers
+        # don't all verify and update the same files at the same time
+        db_hash = None
+        if args.db_fn is not None and args.method != "random":
+            db_hash = hash_db(args.db_fn)
+            # the index is only used for the PDB file it's for (see load_db_variant_set)
+            if args.db_mode is not None and args.db_pdb_fn is not None and not args.no_db_index and \
+                    basename(args.db_pdb_fn) in [basename(pdb_fn) for pdb_fn in args.pdb_fn]:
+                try:
+                    update_index(args.db_fn, args.db_pdb_fn, args.db_index_bloom_bits)
+                except OSError as e:
+                    # the workers will fall back to loading variants from the database
+                    print("Unable to update the database variant index: {}".format(e))
+
+        # each PDB file is generated in its own process and written to its own output file
+        # the seeds are assigned per PDB file up front, so the results don't depend on which worker gets which file
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+        try:
+            futures = {executor.submit(gen_pdb_main, args, pdb_fn, seq, pdb_seed, chars, db_hash): i
+                       for i, (pdb_fn, seq, pdb_seed) in enumerate(zip(args.pdb_fn, seqs, pdb_seeds))}
+            summaries = [None] * len(futures)
+            for future in as_completed(futures):
+                summaries[futures[future]] = future.result()
+        finally:
+            # if one of the PDB files fails, don't start the ones that are still queued
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    if len(summaries) > 1:
+        save_manifest(args, seed, summaries)
 
 
 if __name__ == "__main__":
@@ -663,10 +922,33 @@ if __name__ == "__main__":
                         help="the PDB file to use for the database. if None, use the same PDB file as the one "
                              "being used to generate variants",
                         default=None)
+    parser.add_argument("--no_db_index",
+                        action="store_true",
+                        default=False,
+                        help="load the database variants on every run instead of keeping a persistent index of "
+                             "them next to the database (<db_fn>_index)")
+    parser.add_argument("--db_index_bloom_bits",
+                        type=int,
+                        help="bits per variant for a bloom filter in the database variant index, 0 to remove it. "
+                             "by default, the index keeps its current bloom filter (if any)",
+                        default=None)
     parser.add_argument("--ignore_existing_out_file",
                         action="store_true",
                         default=False,
                         help="ignore existing filename, create a new one with appended number")
+    parser.add_argument("--chunk_size",
+                        type=int,
+                        help="for 'all' method, number of variants to generate and write at a time",
+                        default=100000)
+    parser.add_argument("--rank_ranges",
+                        action="store_true",
+                        default=False,
+                        help="for 'all' method, write a range of variant ranks for each number of substitutions "
+                             "instead of listing every variant. energize and gen_args expand/split the ranges")
+    parser.add_argument("--workers",
+                        type=int,
+                        help="number of PDB files to generate variants for concurrently in separate processes",
+                        default=1)
     # random args
     parser.add_argument("--num_subs_list",
                         type=int,
@@ -53,7 +53,7 @@ fi
 # un-tar the environment files
 if [ -f "$ENV_FN" ]; then
   echo "Extracting $ENV_FN"
-  mkdir env
+  mkdir -p env
   tar -xzf $ENV_FN -C env
   rm $ENV_FN
 fi
@@ -65,10 +65,13 @@ export PATH
 # decrypt
 # note this is done AFTER setting up the Python environment because it requires
 # the openssl version inside the environment
-echo "Decrypting Rosetta"
-openssl version # echo the version for my knowledge
-openssl enc -d -aes256 -pbkdf2 -in rosetta_min_enc.tar.gz -out rosetta_min.tar.gz -pass file:pass.txt
-rm rosetta_min_enc.tar.gz
+# when the job restarts after a checkpoint in the same sandbox, rosetta has already been decrypted and extracted
+if [ -f rosetta_min_enc.tar.gz ]; then
+  echo "Decrypting Rosetta"
+  openssl version # echo the version for my knowledge
+  openssl enc -d -aes256 -pbkdf2 -in rosetta_min_enc.tar.gz -out rosetta_min.tar.gz -pass file:pass.txt
+  rm rosetta_min_enc.tar.gz
+fi
 
 # extract rosetta and any additional tar files that might contain additional data
 if [ "$(ls 2>/dev/null -Ubad1 -- *.tar.gz | wc -l)" -gt 0 ];
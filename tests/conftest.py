@@ -0,0 +1,15 @@
+""" the scripts in code/ import each other as top-level modules and use paths relative to the repo root """
+import os
+import sys
+from os.path import abspath, dirname, join
+
+import pytest
+
+REPO_DIR = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, join(REPO_DIR, "code"))
+
+
+@pytest.fixture
+def repo_dir(monkeypatch):
+    monkeypatch.chdir(REPO_DIR)
+    return REPO_DIR
@@ -0,0 +1,20 @@
+import os
+
+import analysis
+import failures
+
+FAILURE_CLASSES = [failures.TRANSIENT, failures.DETERMINISTIC, failures.SYSTEMIC, failures.TIMEOUT]
+
+
+def test_failed_variants_with_failure_classes(tmp_path):
+    """ failed.txt lines with each failure class, and without one (older jobs), all count as failed variants """
+    job_dir = tmp_path / "energize_local_0_2024-01-01_00-00-00_abcdefghijkl"
+    os.makedirs(job_dir)
+    (job_dir / "energies.csv").write_text("pdb_fn,variant\n")
+    lines = ["2qmt_p.pdb M1A,Q2W {}".format(failure) for failure in FAILURE_CLASSES] + ["2qmt_p.pdb Y3P"]
+    (job_dir / "failed.txt").write_text("".join("{}\n".format(line) for line in lines))
+
+    failed_log_dirs, failed_jobs, failed_variants = analysis.check_for_failed_jobs(str(tmp_path))
+    assert failed_log_dirs == []
+    assert failed_jobs == []
+    assert failed_variants == ["2qmt_p.pdb M1A,Q2W"] * len(FAILURE_CLASSES) + ["2qmt_p.pdb Y3P"]
@@ -0,0 +1,46 @@
+import itertools
+
+import numpy as np
+import pytest
+
+condor = pytest.importorskip("condor")
+
+
+def makespan(item_times, jobs):
+    return max(sum(item_times[i] for i in job) for job in jobs)
+
+
+def optimal_makespan(item_times, num_jobs):
+    """ the best makespan over every assignment of items to jobs (only for a handful of items) """
+    best = None
+    for assignment in itertools.product(range(num_jobs), repeat=len(item_times)):
+        job_times = [0] * num_jobs
+        for item, job in enumerate(assignment):
+            job_times[job] += item_times[item]
+        best = max(job_times) if best is None else min(best, max(job_times))
+    return best
+
+
+def test_lpt_schedule_assigns_every_item_once():
+    item_times = np.random.default_rng(0).uniform(1, 100, 500).tolist()
+    jobs = condor.lpt_schedule(item_times, 7)
+    assert len(jobs) == 7
+    assert sorted(i for job in jobs for i in job) == list(range(500))
+    # with many small items, lpt is close to the lower bound (the mean job time)
+    lower_bound = max(sum(item_times) / 7, max(item_times))
+    assert makespan(item_times, jobs) <= 1.01 * lower_bound
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_lpt_schedule_makespan_bound(seed):
+    item_times = np.random.default_rng(seed).integers(1, 20, 8).tolist()
+    num_jobs = 3
+    jobs = condor.lpt_schedule(item_times, num_jobs)
+    # Graham's bound for longest processing time first
+    assert makespan(item_times, jobs) <= (4 / 3 - 1 / (3 * num_jobs)) * optimal_makespan(item_times, num_jobs)
+
+
+def test_lpt_schedule_known_schedule():
+    assert condor.lpt_schedule([5, 4, 3, 3, 3], 2) == [[0, 3], [1, 2, 4]]
+    assert condor.lpt_schedule([1, 2], 4) == [[1], [0], [], []]
+    assert condor.lpt_schedule([1, 2], 0) == []
@@ -0,0 +1,125 @@
+import argparse
+import itertools
+import os
+import time
+from os.path import join
+
+import pytest
+
+import energize
+import failures
+from score_file import ScoreFileError, parse_score_file
+from utils import extract_seq_from_pdb
+from variant_encoding import AAS
+from variant_space import format_range_line
+from variants import gen_all_variants
+
+ROSETTA_HPARAMS = {"relax_distance": 10, "relax_repeats": 1, "relax_nstruct": 1, "mutate_default_max_cycles": 100}
+
+
+def test_parse_empty_score_file(tmp_path):
+    score_sc_fn = str(tmp_path / "score.sc")
+    open(score_sc_fn, "w").close()
+    with pytest.raises(ScoreFileError):
+        parse_score_file(score_sc_fn)
+
+
+def test_empty_score_file_fails_variant(repo_dir, tmp_path, monkeypatch):
+    """ an empty score file fails the variant (and is retried) instead of raising out of the worker """
+    calls = []
+
+    def fake_rosetta_pipeline(rosetta_main_dir, working_dir, *args, **kwargs):
+        # rosetta "ran" but left empty score files behind
+        calls.append(working_dir)
+        for fn in ["relax.sc", "filter.sc", "centroid.sc"]:
+            open(join(working_dir, fn), "w").close()
+        run_times = {step: 1.0 for step in ["all", "mutate", "relax", "filter", "centroid"]}
+        run_usage = {step: energize.get_resource_usage() for step in ["mutate", "relax", "filter", "centroid"]}
+        return run_times, run_usage
+
+    monkeypatch.setattr(energize, "run_rosetta_pipeline", fake_rosetta_pipeline)
+
+    working_dir = str(tmp_path / "energize_wd")
+    record, failure = energize.run_variant_with_retries("rosetta_minimal", "pdb_files/prepared_pdb_files/2qmt_p.pdb",
+                                                        "A", "M1A", ROSETTA_HPARAMS, working_dir, str(tmp_path))
+    assert record is None
+    assert failure == failures.TRANSIENT
+    assert len(calls) == 3
+    assert not os.path.isdir(working_dir)
+
+
+def sleep_variant(variant, sleep_time, **kwargs):
+    time.sleep(sleep_time)
+    return {"variant": variant}, None
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_run_variants_stop_finishes_running_variants(monkeypatch, num_workers):
+    """ after stop, the variants that are running are still yielded, but no queued variants are started """
+    monkeypatch.setattr(energize, "run_variant_with_retries", sleep_variant)
+    # the first variant finishes while the second is still running
+    tasks = [{"variant": "v{}".format(i), "sleep_time": 0.5 if i == 1 else 0.1} for i in range(6)]
+
+    finished = []
+    results = energize.run_variants(tasks, num_workers=num_workers, stop=lambda: len(finished) > 0)
+    for i, (record, failure) in results:
+        finished.append(record["variant"])
+
+    if num_workers == 1:
+        assert finished == ["v0"]
+    else:
+        assert finished == ["v0", "v1"]
+
+
+def energize_args(tmp_path, variants_fn, **kwargs):
+    args = {"rosetta_main_dir": str(tmp_path / "no_rosetta"),
+            "variants_fn": variants_fn,
+            "chain": "A",
+            "pdb_dir": "pdb_files/prepared_pdb_files",
+            "allowable_failure_fraction": 0.25,
+            "num_workers": 1,
+            "batch_size": 1,
+            "timeout_factor": 10,
+            "min_step_timeout": 600,
+            "max_systemic_failures": 0,
+            "save_parquet": False,
+            "fused": False,
+            "mutate_default_max_cycles": 100,
+            "relax_repeats": 1,
+            "relax_nstruct": 1,
+            "relax_distance": 10.0,
+            "checkpoint_interval": 0,
+            "no_resume": False,
+            "save_wd": False,
+            "log_dir_base": str(tmp_path / "output"),
+            "cluster": "local",
+            "process": "local",
+            "commit_id": "no_commit_id"}
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def test_main_expands_range_lines_of_multi_chain_pdb(repo_dir, tmp_path):
+    """ range lines are expanded with the sequence of --chain, like variants.py --rank_ranges --chain_id.
+        without rosetta every variant fails, but main gets through expanding the range line """
+    seq = extract_seq_from_pdb("pdb_files/prepared_pdb_files/1FCC_dms.pdb", chain_id="C")
+    variants_fn = str(tmp_path / "variants.txt")
+    with open(variants_fn, "w") as f:
+        f.write("{}\n".format(format_range_line("1FCC_dms.pdb", 1, 0, 5)))
+
+    with pytest.raises(SystemExit):
+        energize.main(energize_args(tmp_path, variants_fn, chain="C"))
+
+    log_dir, = os.listdir(tmp_path / "output")
+    with open(tmp_path / "output" / log_dir / "failed.txt", "r") as f:
+        failed = [line.split()[1] for line in f.read().splitlines()]
+    assert failed == list(itertools.islice(gen_all_variants(seq, 1, AAS, range(len(seq))), 5))
+
+
+def test_fused_with_multiple_structures_is_rejected(repo_dir, tmp_path):
+    variants_fn = str(tmp_path / "variants.txt")
+    with open(variants_fn, "w") as f:
+        f.write("2qmt_p.pdb M1A\n")
+
+    with pytest.raises(ValueError, match="relax_nstruct"):
+        energize.main(energize_args(tmp_path, variants_fn, fused=True, relax_nstruct=2))
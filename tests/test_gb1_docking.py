@@ -0,0 +1,54 @@
+import argparse
+import os
+from os.path import join
+
+import pytest
+
+import energize
+import gb1_docking
+
+DOCKING_PDBS = ["1FCC_dms.pdb", "1FCC_rosetta_best.pdb"]
+
+
+def docking_args(tmp_path, variants_fn, **kwargs):
+    args = {"rosetta_main_dir": str(tmp_path / "no_rosetta"),
+            "variants_fn": variants_fn,
+            "chain": "C",
+            "pdb_dir": "pdb_files/prepared_pdb_files",
+            "allowable_failure_fraction": 0.25,
+            "num_structs": 1,
+            "timeout_factor": 10,
+            "min_step_timeout": 600,
+            "max_systemic_failures": 0,
+            "save_wd": False,
+            "log_dir_base": str(tmp_path / "output"),
+            "cluster": "local",
+            "process": "local",
+            "commit_id": "no_commit_id"}
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+@pytest.mark.parametrize("pdb_fn", DOCKING_PDBS)
+def test_step_timeout_multi_chain(repo_dir, pdb_fn):
+    pdb_fn = join("pdb_files/prepared_pdb_files", pdb_fn)
+    # the docking pdbs have chains A and C, the timeout is based on the length of the mutated chain
+    assert energize.get_pdb_step_timeout(pdb_fn, "C", 10, 0) == energize.get_step_timeout(56, 10, 0)
+    # falls back to the minimum timeout if the chain isn't in the pdb file
+    assert energize.get_pdb_step_timeout(pdb_fn, "Z", 10, 600) == 600
+    assert energize.get_pdb_step_timeout(pdb_fn, "C", 0, 600) is None
+
+
+def test_main_runs_variants_for_multi_chain_pdbs(repo_dir, tmp_path):
+    """ without rosetta every variant fails, but main gets through the setup and tries each variant """
+    variants_fn = str(tmp_path / "variants.txt")
+    with open(variants_fn, "w") as f:
+        f.write("".join("{} Y3A\n".format(pdb_fn) for pdb_fn in DOCKING_PDBS))
+
+    with pytest.raises(SystemExit):
+        gb1_docking.main(docking_args(tmp_path, variants_fn))
+
+    log_dir, = os.listdir(tmp_path / "output")
+    with open(tmp_path / "output" / log_dir / "failed.txt", "r") as f:
+        failed = [line.split()[:2] for line in f.read().splitlines()]
+    assert failed == [[pdb_fn, "Y3A"] for pdb_fn in DOCKING_PDBS]
@@ -0,0 +1,27 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from pdb_cache import PDBCache
+
+PDB_FNS = ["pdb_files/prepared_pdb_files/2qmt_p.pdb", "pdb_files/prepared_pdb_files/1a3a_remod_p.pdb"]
+
+
+def save_seq(cache_fn, pdb_fn):
+    pdb_cache = PDBCache(cache_fn)
+    seq = pdb_cache.get_seq(pdb_fn)
+    pdb_cache.save()
+    return seq
+
+
+def test_concurrent_saves_keep_all_entries(repo_dir, tmp_path):
+    cache_fn = str(tmp_path / "pdb_cache.json")
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        seqs = list(executor.map(save_seq, [cache_fn] * 4, PDB_FNS * 2))
+
+    with open(cache_fn, "r") as f:
+        cache = json.load(f)
+    assert sorted(v["seq"] for v in cache["metadata"].values()) == sorted(seqs[:2])
+
+    pdb_cache = PDBCache(cache_fn)
+    assert [pdb_cache.get_seq(pdb_fn) for pdb_fn in PDB_FNS] == seqs[:2]
+    assert len(pdb_cache.new_metadata) == 0
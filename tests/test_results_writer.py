@@ -0,0 +1,42 @@
+import csv
+
+import pytest
+
+from results_writer import ResultsWriter
+
+
+def read_rows(fn):
+    with open(fn, "r", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_missing_columns_are_left_empty(tmp_path):
+    out_fn = str(tmp_path / "energies.csv")
+    with ResultsWriter(out_fn, fsync=False) as writer:
+        writer.write({"pdb_fn": "2qmt_p.pdb", "variant": "M1A", "total_score": 1.5})
+        writer.write({"pdb_fn": "2qmt_p.pdb", "variant": "M1C"})
+
+    rows = read_rows(out_fn)
+    assert [row["variant"] for row in rows] == ["M1A", "M1C"]
+    assert rows[1]["total_score"] == ""
+
+
+def test_extra_columns_raise(tmp_path):
+    out_fn = str(tmp_path / "energies.csv")
+    with ResultsWriter(out_fn, fsync=False) as writer:
+        writer.write({"pdb_fn": "2qmt_p.pdb", "variant": "M1A"})
+        with pytest.raises(ValueError, match="total_score"):
+            writer.write({"pdb_fn": "2qmt_p.pdb", "variant": "M1C", "total_score": 1.5})
+
+    assert [row["variant"] for row in read_rows(out_fn)] == ["M1A"]
+
+
+def test_resumed_file_checks_existing_header(tmp_path):
+    out_fn = str(tmp_path / "energies.csv")
+    with ResultsWriter(out_fn, fsync=False) as writer:
+        writer.write({"pdb_fn": "2qmt_p.pdb", "variant": "M1A"})
+
+    with ResultsWriter(out_fn, fsync=False) as writer:
+        assert writer.written_keys() == {"2qmt_p.pdb M1A"}
+        with pytest.raises(ValueError):
+            writer.write({"pdb_fn": "2qmt_p.pdb", "variant": "M1C", "total_score": 1.5})
@@ -0,0 +1,17 @@
+import sqlite3
+
+from runtime_model import load_seq_lens
+
+PDB_DIR = "pdb_files/prepared_pdb_files"
+
+
+def test_load_seq_lens_multi_chain(repo_dir, tmp_path):
+    con = sqlite3.connect(str(tmp_path / "database.db"))
+    with open("variant_database/create_tables.sql", "r") as f:
+        con.executescript(f.read())
+    rows = [("2qmt_p.pdb", "M1A", "job1"), ("1FCC_dms.pdb", "Y3A", "job2"), ("missing.pdb", "M1A", "job2")]
+    con.executemany("INSERT INTO variant (pdb_fn, mutations, job_uuid) VALUES (?, ?, ?)", rows)
+
+    # chain A of 1FCC_dms.pdb has 206 residues and chain C has 56
+    assert load_seq_lens(con, PDB_DIR) == {"2qmt_p.pdb": 56, "1FCC_dms.pdb": 262}
+    con.close()
@@ -0,0 +1,49 @@
+import math
+
+import pytest
+
+from score_file import ScoreFileError, aggregate_score_records, parse_score_file
+
+RECORDS = [{"total_score": -10.0, "fa_rep": 2.0, "description": "s_0001"},
+           {"total_score": -12.0, "fa_rep": 4.0, "description": "s_0002"},
+           {"total_score": -12.0, "fa_rep": 6.0, "description": "s_0003"},
+           {"total_score": -8.0, "fa_rep": math.nan, "description": "s_0004"}]
+
+
+def test_aggregate_avg():
+    # nan values are skipped and the non-numeric description column is dropped
+    assert aggregate_score_records(iter(RECORDS), "avg") == {"total_score": -10.5, "fa_rep": 4.0}
+
+
+def test_aggregate_min_energy():
+    assert aggregate_score_records(iter(RECORDS), "min_energy_avg") == {"total_score": -12.0, "fa_rep": 5.0}
+    assert aggregate_score_records(iter(RECORDS), "min_energy_first") == RECORDS[1]
+    assert aggregate_score_records(iter(RECORDS), "min_energy_first", sort_col="fa_rep") == RECORDS[0]
+
+
+def test_aggregate_single_structure():
+    for agg_method in ["avg", "min_energy_avg", "min_energy_first"]:
+        assert aggregate_score_records(iter(RECORDS[:1]), agg_method) == RECORDS[0]
+
+
+def test_aggregate_errors():
+    with pytest.raises(ValueError):
+        aggregate_score_records(iter(RECORDS), "median")
+    with pytest.raises(ScoreFileError):
+        aggregate_score_records(iter([]), "avg")
+    no_total = [{"total_score": "nan?", "description": "s_0001"}, {"total_score": "nan?", "description": "s_0002"}]
+    with pytest.raises(ScoreFileError):
+        aggregate_score_records(iter(no_total), "min_energy_first")
+
+
+def test_parse_score_file(tmp_path):
+    score_sc_fn = str(tmp_path / "score.sc")
+    with open(score_sc_fn, "w") as f:
+        f.write("SEQUENCE:\n"
+                "SCORE: total_score fa_rep description\n"
+                "SCORE:     -10.000  2.000 s_0001\n"
+                "SCORE:     -12.000  4.000 s_0002\n"
+                "SCORE:     -11.000  3.0")
+    # the truncated last line (rosetta was killed while writing it) is skipped
+    assert parse_score_file(score_sc_fn) == {"total_score": -11.0, "fa_rep": 3.0}
+    assert parse_score_file(score_sc_fn, "min_energy_first") == {"total_score": -12.0, "fa_rep": 4.0}
@@ -0,0 +1,73 @@
+import sqlite3
+
+import numpy as np
+
+from variant_encoding import AAS, encode_variants, variant_keys
+from variant_index import bloom_filter_contains, build_bloom_filter, load_variant_index
+from variant_space import VariantSpace
+
+SEQ = "MQYKLILNGKTLKGETTTEA"
+
+
+def make_db(db_fn, variants, pdb_fn="2qmt_p.pdb"):
+    con = sqlite3.connect(db_fn)
+    with open("variant_database/create_tables.sql", "r") as f:
+        con.executescript(f.read())
+    add_variants(con, variants, pdb_fn)
+    return con
+
+
+def add_variants(con, variants, pdb_fn="2qmt_p.pdb"):
+    con.executemany("INSERT INTO variant (pdb_fn, mutations, job_uuid) VALUES (?, ?, ?)",
+                    [(pdb_fn, v, "job") for v in variants])
+    con.commit()
+
+
+def test_bloom_filter_has_no_false_negatives():
+    space = VariantSpace(SEQ, 2, AAS, range(len(SEQ)))
+    keys = variant_keys(encode_variants([space.unrank(r) for r in range(0, space.size, 7)]))
+    others = variant_keys(encode_variants([space.unrank(r) for r in range(3, space.size, 7)]))
+    bits = build_bloom_filter(keys, 10)
+
+    assert bloom_filter_contains(bits, keys).all()
+    # about 1% false positives with 10 bits per key
+    assert bloom_filter_contains(bits, others).mean() < 0.05
+
+
+def test_index_lookups(repo_dir, tmp_path):
+    db_fn = str(tmp_path / "database.db")
+    con = make_db(db_fn, ["M1A", "Q2W,Y3P", "M1A,Q2W,Y3P,K4A"])
+    add_variants(con, ["M1C"], pdb_fn="1a3a_remod_p.pdb")
+
+    queries = ["M1A", "Q2W,Y3P", "M1A,Q2W,Y3P,K4A", "M1C", "Q2W", "M1A,Q2W,Y3P,K4A,L5A"]
+    for bloom_bits in [0, 10]:
+        index = load_variant_index(db_fn, "pdb_files/prepared_pdb_files/2qmt_p.pdb", bloom_bits)
+        assert len(index) == 3
+        assert index.contains(queries).tolist() == [True, True, True, False, False, False]
+
+    # new rows are added to the existing index, including ones wider than the index
+    add_variants(con, ["Q2W", "M1A,Q2W,Y3P,K4A,L5A"])
+    index = load_variant_index(db_fn, "pdb_files/prepared_pdb_files/2qmt_p.pdb")
+    assert len(index) == 5
+    assert index.contains(queries).tolist() == [True, True, True, False, True, True]
+
+    # deleted rows rebuild the index
+    con.execute("DELETE FROM variant WHERE mutations = 'M1A'")
+    con.commit()
+    index = load_variant_index(db_fn, "pdb_files/prepared_pdb_files/2qmt_p.pdb")
+    assert index.contains(queries).tolist() == [False, True, True, False, True, True]
+    con.close()
+
+
+def test_index_matches_database_with_bloom_filter(repo_dir, tmp_path):
+    space = VariantSpace(SEQ, 2, AAS, range(len(SEQ)))
+    ranks = np.random.default_rng(0).choice(space.size, 2000, replace=False)
+    in_db = [space.unrank(int(r)) for r in ranks[:1000]]
+    not_in_db = [space.unrank(int(r)) for r in ranks[1000:]]
+
+    db_fn = str(tmp_path / "database.db")
+    make_db(db_fn, in_db).close()
+    index = load_variant_index(db_fn, "2qmt_p.pdb", 8)
+    assert index.bloom is not None
+    assert index.contains(in_db).all()
+    assert not index.contains(not_in_db).any()
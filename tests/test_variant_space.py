@@ -0,0 +1,91 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from variant_encoding import AAS
+from variant_space import (VariantSpace, expand_variant_lines, format_range_line, num_line_variants, sample_ranks,
+                           split_range_line, split_variant_lines)
+from variants import gen_all_variants
+
+SEQ = "MQYKLILNG"
+
+
+def legacy_variants(seq, num_subs, chars, seq_idxs):
+    """ the original nested-loop enumeration of variants.gen_all_variants """
+    variants = []
+    for positions in itertools.combinations(seq_idxs, num_subs):
+        for new_chars in itertools.product(chars, repeat=num_subs):
+            if all(seq[pos] != c for pos, c in zip(positions, new_chars)):
+                variants.append(",".join("{}{}{}".format(seq[pos], pos + 1, c)
+                                         for pos, c in zip(positions, new_chars)))
+    return variants
+
+
+@pytest.mark.parametrize("num_subs,seq_idxs", [(1, range(9)), (2, range(9)), (3, range(2, 7))])
+def test_unrank_matches_legacy_order(num_subs, seq_idxs):
+    space = VariantSpace(SEQ, num_subs, AAS, seq_idxs)
+    expected = legacy_variants(SEQ, num_subs, AAS, seq_idxs)
+    assert space.size == len(expected)
+    assert [space.unrank(r) for r in range(space.size)] == expected
+    assert list(gen_all_variants(SEQ, num_subs, AAS, seq_idxs)) == expected
+
+
+@pytest.mark.parametrize("num_subs", [1, 2, 4])
+def test_rank_unrank_round_trip(num_subs):
+    space = VariantSpace(SEQ, num_subs, AAS, range(len(SEQ)))
+    ranks = sample_ranks(space.size, min(space.size, 2000), np.random.default_rng(0)) + [0, space.size - 1]
+    for r in ranks:
+        assert space.rank(space.unrank(r)) == r
+
+
+def test_rank_rejects_variants_outside_the_space():
+    space = VariantSpace(SEQ, 2, AAS, range(1, 5))
+    for variant in ["M1A,Q2A", "Q2A", "Q2Q,Y3A", "Q2A,Q2C", "L5A,I6A"]:
+        with pytest.raises(ValueError):
+            space.rank(variant)
+    with pytest.raises(ValueError):
+        space.unrank(space.size)
+
+
+@pytest.mark.parametrize("n,size", [(10, 10), (1000, 50), (2 ** 80, 1000)])
+def test_sample_ranks_distinct_and_in_range(n, size):
+    ranks = sample_ranks(n, size, np.random.default_rng(1))
+    assert len(ranks) == size
+    assert len(set(ranks)) == size
+    assert all(0 <= r < n for r in ranks)
+
+
+def test_sample_ranks_too_many():
+    with pytest.raises(ValueError):
+        sample_ranks(5, 6, np.random.default_rng(0))
+
+
+def test_split_range_line():
+    line = format_range_line("2qmt_p.pdb", 2, 3, 25, 1, 8)
+    chunks = list(split_range_line(line, 10))
+    assert chunks == [format_range_line("2qmt_p.pdb", 2, 3, 13, 1, 8),
+                      format_range_line("2qmt_p.pdb", 2, 13, 23, 1, 8),
+                      format_range_line("2qmt_p.pdb", 2, 23, 25, 1, 8)]
+    assert sum(num_line_variants(c) for c in chunks) == num_line_variants(line)
+
+
+def test_split_variant_lines_keeps_variant_order():
+    lines = ["2qmt_p.pdb M1A", format_range_line("2qmt_p.pdb", 1, 0, 12), "2qmt_p.pdb M1C,Q2A"]
+    chunks = list(split_variant_lines(lines, 5))
+    assert [sum(num_line_variants(line) for line in chunk) for chunk in chunks] == [5, 5, 4]
+
+    def get_seq(pdb_fn):
+        return SEQ
+    expanded = list(expand_variant_lines(lines, get_seq))
+    assert [v for chunk in chunks for v in expand_variant_lines(chunk, get_seq)] == expanded
+
+
+def test_expand_variant_lines():
+    lines = ["2qmt_p.pdb M1A", format_range_line("2qmt_p.pdb", 2, 5, 40, 2, 6)]
+    expected = ["2qmt_p.pdb M1A"] + ["2qmt_p.pdb {}".format(v)
+                                     for v in legacy_variants(SEQ, 2, AAS, range(2, 6))[5:40]]
+    assert list(expand_variant_lines(lines, lambda pdb_fn: SEQ)) == expected
+
+    with pytest.raises(ValueError):
+        list(expand_variant_lines([format_range_line("2qmt_p.pdb", 1, 0, 9 * 19 + 1)], lambda pdb_fn: SEQ))
@@ -0,0 +1,105 @@
+import argparse
+import os
+import sqlite3
+
+import pytest
+
+import db_fingerprint
+import variants
+
+PDB_FNS = ["pdb_files/prepared_pdb_files/2qmt_p.pdb", "pdb_files/prepared_pdb_files/1a3a_remod_p.pdb"]
+
+
+def variants_args(out_dir, **kwargs):
+    args = {"method": "all",
+            "pdb_fn": PDB_FNS,
+            "chain_id": None,
+            "seq_idxs_range_start": None,
+            "seq_idxs_range_end": None,
+            "target_num": 1000,
+            "seed": 7,
+            "out_dir": str(out_dir),
+            "db_fn": None,
+            "db_mode": None,
+            "db_pdb_fn": None,
+            "no_db_index": False,
+            "db_index_bloom_bits": None,
+            "ignore_existing_out_file": False,
+            "chunk_size": 100000,
+            "rank_ranges": False,
+            "workers": 1,
+            "num_subs_list": [1],
+            "num_replicates": 1,
+            "max_num_subs": 3,
+            "min_num_subs": 1}
+    args.update(kwargs)
+    os.makedirs(out_dir)
+    return argparse.Namespace(**args)
+
+
+@pytest.fixture
+def db_fn(repo_dir, tmp_path):
+    """ a database with a few single-substitution variants of each PDB file """
+    db_fn = str(tmp_path / "database.db")
+    con = sqlite3.connect(db_fn)
+    with open("variant_database/create_tables.sql", "r") as f:
+        con.executescript(f.read())
+    rows = [("2qmt_p.pdb", "M1A", "job1"), ("2qmt_p.pdb", "Q2W", "job1"), ("2qmt_p.pdb", "Y3P", "job2"),
+            ("2qmt_p.pdb", "M1A,Q2W", "job2"),
+            ("1a3a_remod_p.pdb", "{}1A".format(variants.PDBCache().extract_seq(PDB_FNS[1])[0]), "job2")]
+    con.executemany("INSERT INTO variant (pdb_fn, mutations, job_uuid) VALUES (?, ?, ?)", rows)
+    con.commit()
+    con.close()
+    return db_fn
+
+
+def read_variant_lists(out_dir):
+    lists = {}
+    for fn in os.listdir(out_dir):
+        if fn.endswith(".txt"):
+            with open(os.path.join(out_dir, fn), "r") as f:
+                lists[fn] = f.read()
+    return lists
+
+
+@pytest.mark.parametrize("db_pdb_fn", [None, PDB_FNS[0]])
+def test_workers_with_db(db_fn, tmp_path, db_pdb_fn):
+    """ generating with multiple workers against a database gives the same variant lists as a single process """
+    for workers in [1, 2]:
+        variants.main(variants_args(tmp_path / "workers_{}".format(workers), db_fn=db_fn, db_mode="filter",
+                                    db_pdb_fn=db_pdb_fn, workers=workers))
+
+    lists = read_variant_lists(tmp_path / "workers_1")
+    assert len(lists) == 2
+    assert lists == read_variant_lists(tmp_path / "workers_2")
+
+    fingerprint = db_fingerprint.update_fingerprint(db_fn)
+    assert all(fingerprint in fn for fn in lists)
+    if db_pdb_fn is None:
+        # each PDB file's own database variants are filtered out
+        assert "M1A" not in lists[next(fn for fn in lists if fn.startswith("2qmt_p"))]
+        assert " M1C\n" in lists[next(fn for fn in lists if fn.startswith("2qmt_p"))]
+
+
+def read_variants(out_dir):
+    variant_list, = read_variant_lists(out_dir).values()
+    return [line.split()[1] for line in variant_list.splitlines()]
+
+
+def test_db_pdb_fn_with_different_wild_type(db_fn, tmp_path):
+    """ database variants of another PDB file only match variants with the same wild-type residues.
+        2qmt_p starts with MQY and 1a3a_remod_p with MAN, so 2qmt_p's Q2W and Y3P are not 1a3a_remod_p's A2W and N3P """
+    kwargs = {"pdb_fn": [PDB_FNS[1]], "db_fn": db_fn, "db_pdb_fn": PDB_FNS[0]}
+
+    variants.main(variants_args(tmp_path / "filter", db_mode="filter", **kwargs))
+    filtered = read_variants(tmp_path / "filter")
+    assert "M1A" not in filtered
+    assert "A2W" in filtered and "N3P" in filtered
+
+    variants.main(variants_args(tmp_path / "sample", db_mode="sample", **kwargs))
+    assert read_variants(tmp_path / "sample") == ["M1A"]
+
+    # sampled subvariants are the database's variants, with 2qmt_p's wild-type residues
+    variants.main(variants_args(tmp_path / "subvariants", method="subvariants", db_mode="sample", target_num=3,
+                                max_num_subs=2, **kwargs))
+    assert sorted(read_variants(tmp_path / "subvariants")) == ["M1A", "M1A,Q2W", "Q2W"]
@@ -9,6 +9,27 @@ CREATE TABLE IF NOT EXISTS  `variant` (
     `filter_run_time` INTEGER,
     `centroid_run_time` INTEGER,
 
+    `mutate_cpu_user` REAL,
+    `mutate_cpu_sys` REAL,
+    `mutate_max_rss` INTEGER,
+    `mutate_io_in` INTEGER,
+    `mutate_io_out` INTEGER,
+    `relax_cpu_user` REAL,
+    `relax_cpu_sys` REAL,
+    `relax_max_rss` INTEGER,
+    `relax_io_in` INTEGER,
+    `relax_io_out` INTEGER,
+    `filter_cpu_user` REAL,
+    `filter_cpu_sys` REAL,
+    `filter_max_rss` INTEGER,
+    `filter_io_in` INTEGER,
+    `filter_io_out` INTEGER,
+    `centroid_cpu_user` REAL,
+    `centroid_cpu_sys` REAL,
+    `centroid_max_rss` INTEGER,
+    `centroid_io_in` INTEGER,
+    `centroid_io_out` INTEGER,
+
     `total_score` REAL,
     `dslf_fa13` REAL,
     `fa_atr` REAL,
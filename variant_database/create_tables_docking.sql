@@ -7,6 +7,17 @@ CREATE TABLE IF NOT EXISTS  `variant` (
     `mutate_run_time` INTEGER,
     `dock_run_time` INTEGER,
 
+    `mutate_cpu_user` REAL,
+    `mutate_cpu_sys` REAL,
+    `mutate_max_rss` INTEGER,
+    `mutate_io_in` INTEGER,
+    `mutate_io_out` INTEGER,
+    `dock_cpu_user` REAL,
+    `dock_cpu_sys` REAL,
+    `dock_max_rss` INTEGER,
+    `dock_io_in` INTEGER,
+    `dock_io_out` INTEGER,
+
     `total_score` REAL,
     `complex_normalized` REAL,
     `dG_cross` REAL,